@@ -0,0 +1,334 @@
+"""模拟微信读书和Notion接口的本地HTTP服务器，用于benchmarks
+
+同一个端口同时提供两种接口：/v1/ 开头的请求按Notion处理，其余按微信读书处理。
+支持设置每个请求的延迟、Notion返回429的概率，以及让微信读书接口返回若干次 -2012。
+划线、笔记和章节接口和真实接口一样按syncKey返回增量数据，syncKey为0时返回完整列表。
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeState:
+    """模拟服务器的数据和请求统计
+
+    books为书籍数量，每本书有bookmarks条划线、reviews条笔记和一条点评。
+    latency为每个请求的延迟（秒），rate429为Notion请求返回429的概率，
+    expire_left为接下来返回 -2012 的微信读书请求数。
+    """
+
+    def __init__(self, books=10, bookmarks=20, reviews=3, latency=0.0, rate429=0.0, expire_left=0):
+        self.latency = latency
+        self.rate429 = rate429
+        self.expire_left = expire_left
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.books = [make_book(i, bookmarks, reviews) for i in range(books)]
+        self.by_id = {book["bookId"]: book for book in self.books}
+        self.pages = {}  # page_id -> {"properties", "archived"}
+        self.blocks = {}  # block_id -> {"parent", "block", "archived"}
+        self.children = {}  # parent_id -> [block_id]
+        self.snapshots = {}  # (bookId, 接口) -> [{id: 内容}]，synckey为列表中的序号加1
+
+    def get_delta(self, bookId, name, items, get_id, synckey):
+        """按synckey返回(updated, removed, 新的synckey)
+
+        每次返回数据时记录一份快照，synckey为0或者不认识时返回完整列表，
+        否则只返回和synckey对应的快照相比新增或修改的项以及删除的id。内容没有变化时synckey不变。
+        """
+        current = {get_id(x): json.dumps(x, sort_keys=True, ensure_ascii=False) for x in items}
+        with self.lock:
+            snapshots = self.snapshots.setdefault((bookId, name), [])
+            if not snapshots or snapshots[-1] != current:
+                snapshots.append(current)
+            new_key = len(snapshots)
+            try:
+                synckey = int(synckey or 0)
+            except (TypeError, ValueError):
+                synckey = 0
+            old = snapshots[synckey - 1] if 0 < synckey <= len(snapshots) else None
+        if old is None:
+            self.count(f"delta {name} full")
+            return list(items), [], new_key
+        self.count(f"delta {name} inc")
+        updated = [x for x in items if old.get(get_id(x)) != current[get_id(x)]]
+        removed = [x for x in old if x not in current]
+        return updated, removed, new_key
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def total(self, prefix):
+        """某一类请求的总数，prefix为"weread"、"notion"或"429" """
+        with self.lock:
+            return sum(n for key, n in self.counts.items() if key.split(" ", 1)[0] == prefix)
+
+
+def make_book(i, bookmarks, reviews):
+    bookId = str(100000 + i)
+    chapters = [{"chapterUid": c, "chapterIdx": c, "level": 1, "title": f"第{c}章"} for c in range(1, 6)]
+    bookmark_list = [
+        {
+            "bookmarkId": f"{bookId}_{j}",
+            "bookId": bookId,
+            "chapterUid": 1 + j % 5,
+            "range": f"{j * 10}-{j * 10 + 5}",
+            "markText": f"划线 {j}",
+            "style": j % 3,
+            "colorStyle": j % 5 + 1,
+        }
+        for j in range(bookmarks)
+    ]
+    review_list = [
+        {
+            "review": {
+                "reviewId": f"r{bookId}_{j}",
+                "type": 1,
+                "content": f"笔记 {j}",
+                "chapterUid": 1 + j % 5,
+                "range": f"{j * 10 + 1}-{j * 10 + 3}",
+                "abstract": f"引用 {j}",
+            }
+        }
+        for j in range(reviews)
+    ]
+    review_list.append({"review": {"reviewId": f"s{bookId}", "type": 4, "content": "点评"}})
+    return {
+        "bookId": bookId,
+        "sort": 1600000000 + i,
+        "book": {
+            "bookId": bookId,
+            "title": f"书籍 {i}",
+            "author": "作者",
+            "cover": "https://example.com/s_cover.jpg",
+            "categories": [{"title": "分类"}],
+        },
+        "noteCount": bookmarks,
+        "reviewCount": reviews,
+        # noteCount是划线数，bookmarkCount是书签数
+        "bookmarkCount": 0,
+        "_chapters": chapters,
+        "_bookmarks": bookmark_list,
+        "_reviews": review_list,
+    }
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PATCH(self):
+            self._dispatch("PATCH")
+
+        def do_DELETE(self):
+            self._dispatch("DELETE")
+
+        def _send(self, code, obj, headers=None):
+            data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _error(self, code, error_code, message):
+            return self._send(code, {"object": "error", "status": code, "code": error_code, "message": message})
+
+        def _dispatch(self, method):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            if state.latency:
+                time.sleep(state.latency)
+            if url.path.startswith("/v1/"):
+                path = url.path[4:]
+                state.count(f"notion {method} {path.split('/')[0]}")
+                if state.rate429 and random.random() < state.rate429:
+                    state.count("429")
+                    return self._send(
+                        429,
+                        {"object": "error", "status": 429, "code": "rate_limited", "message": "rate limited"},
+                        {"Retry-After": "0"},
+                    )
+                return self._notion(method, path, query, body)
+            state.count(f"weread {method} {url.path}")
+            return self._weread(url.path, query, body)
+
+        def _weread(self, path, query, body):
+            if path == "/":
+                data = b"<html></html>"
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                return self.wfile.write(data)
+            with state.lock:
+                expired = state.expire_left > 0
+                if expired:
+                    state.expire_left -= 1
+            if expired:
+                return self._send(200, {"errCode": -2012, "errMsg": "登录超时"})
+            if path == "/api/user/notebook":
+                books = [{k: v for k, v in book.items() if not k.startswith("_")} for book in state.books]
+                return self._send(200, {"books": books})
+            if path == "/web/book/chapterInfos":
+                bookIds = body.get("bookIds", [])
+                synckeys = body.get("synckeys") or []
+                data = []
+                for i, bookId in enumerate(bookIds):
+                    if bookId not in state.by_id:
+                        continue
+                    synckey = synckeys[i] if i < len(synckeys) else 0
+                    updated, removed, synckey = state.get_delta(
+                        bookId, "chapter", state.by_id[bookId]["_chapters"], get_chapter_uid, synckey
+                    )
+                    data.append({"bookId": bookId, "synckey": synckey, "updated": updated, "removed": removed})
+                return self._send(200, {"data": data})
+            book = state.by_id.get(query.get("bookId"))
+            if book is None:
+                return self._send(200, {"errCode": -2010, "errMsg": "书籍不存在"})
+            if path == "/web/book/bookmarklist":
+                updated, removed, synckey = state.get_delta(
+                    book["bookId"], "bookmark", book["_bookmarks"], get_bookmark_id, query.get("syncKey")
+                )
+                return self._send(200, {"synckey": synckey, "updated": updated, "removed": removed})
+            if path == "/web/review/list":
+                updated, removed, synckey = state.get_delta(
+                    book["bookId"], "review", book["_reviews"], get_review_id, query.get("syncKey")
+                )
+                return self._send(200, {"synckey": synckey, "reviews": updated, "removed": removed})
+            if path == "/web/book/info":
+                return self._send(200, {"isbn": "9787000000000", "newRating": 800})
+            if path == "/web/book/readinfo":
+                return self._send(200, {"markedStatus": 4, "readingTime": 4000, "readingProgress": 100})
+            return self._send(404, {})
+
+        def _new_block(self, parent, block):
+            block_id = str(uuid.uuid4())
+            content = block.get(block.get("type"))
+            children = content.pop("children", None) if isinstance(content, dict) else None
+            state.blocks[block_id] = {"parent": parent, "block": block, "archived": False}
+            state.children.setdefault(parent, []).append(block_id)
+            for child in children or []:
+                self._new_block(block_id, child)
+            return {"object": "block", "id": block_id, **block}
+
+        def _has_children(self, block_id):
+            return any(not state.blocks[i]["archived"] for i in state.children.get(block_id, []))
+
+        def _list(self, items, cursor, size):
+            start = int(cursor or 0)
+            size = int(size or 100)
+            more = start + size < len(items)
+            return items[start : start + size], more, str(start + size) if more else None
+
+        def _notion(self, method, path, query, body):
+            parts = path.split("/")
+            with state.lock:
+                if parts[0] == "databases":
+                    return self._send(200, {"id": parts[1], "data_sources": [{"id": parts[1]}]})
+                if parts[0] == "data_sources" and len(parts) == 2:
+                    names = ["BookName", "BookId", "Sort", "Progress", "Status"]
+                    return self._send(200, {"id": parts[1], "properties": {n: {"id": n, "name": n} for n in names}})
+                if parts[0] == "data_sources" and parts[2] == "query":
+                    pages = [(page_id, page) for page_id, page in state.pages.items() if not page["archived"]]
+                    filter = body.get("filter") or {}
+                    if filter.get("property") == "BookId":
+                        bookId = filter["rich_text"]["equals"]
+                        pages = [x for x in pages if get_book_id(x[1]) == bookId]
+                    if body.get("sorts"):
+                        pages.sort(key=lambda x: -(x[1]["properties"].get("Sort", {}).get("number") or 0))
+                    chunk, more, cursor = self._list(pages, body.get("start_cursor"), body.get("page_size"))
+                    results = [{"object": "page", "id": page_id, "properties": page["properties"]} for page_id, page in chunk]
+                    return self._send(200, {"results": results, "has_more": more, "next_cursor": cursor})
+                if parts[0] == "pages" and method == "POST":
+                    page_id = str(uuid.uuid4())
+                    state.pages[page_id] = {"properties": body["properties"], "archived": False}
+                    for child in body.get("children", []):
+                        self._new_block(page_id, child)
+                    return self._send(200, {"object": "page", "id": page_id})
+                if parts[0] == "pages" and method == "PATCH":
+                    page = state.pages.get(parts[1])
+                    if page is None:
+                        return self._error(404, "object_not_found", "页面不存在")
+                    if page["archived"]:
+                        return self._error(400, "validation_error", "Can't edit block that is archived.")
+                    page["properties"].update(body.get("properties", {}))
+                    return self._send(200, {"object": "page", "id": parts[1]})
+                if parts[0] == "blocks" and len(parts) == 3 and method == "PATCH":
+                    parent = parts[1]
+                    if parent not in state.pages and parent not in state.blocks:
+                        return self._error(404, "object_not_found", "块不存在")
+                    children = body.get("children", [])
+                    if len(children) > 100:
+                        return self._error(400, "validation_error", "children最多100个")
+                    results = [self._new_block(parent, child) for child in children]
+                    if body.get("after"):
+                        siblings = state.children[parent]
+                        new_ids = [result["id"] for result in results]
+                        del siblings[-len(new_ids):]
+                        position = siblings.index(body["after"]) + 1
+                        siblings[position:position] = new_ids
+                    return self._send(200, {"object": "list", "results": results})
+                if parts[0] == "blocks" and len(parts) == 3 and method == "GET":
+                    ids = [i for i in state.children.get(parts[1], []) if not state.blocks[i]["archived"]]
+                    chunk, more, cursor = self._list(ids, query.get("start_cursor"), query.get("page_size"))
+                    results = [
+                        {"object": "block", "id": i, "has_children": self._has_children(i), **state.blocks[i]["block"]}
+                        for i in chunk
+                    ]
+                    return self._send(200, {"object": "list", "results": results, "has_more": more, "next_cursor": cursor})
+                if parts[0] == "blocks" and method == "DELETE":
+                    target = state.pages.get(parts[1]) or state.blocks.get(parts[1])
+                    if target is not None:
+                        target["archived"] = True
+                    return self._send(200, {"object": "block", "id": parts[1]})
+                if parts[0] == "blocks" and method == "PATCH":
+                    block = state.blocks[parts[1]]["block"]
+                    block.update(body)
+                    return self._send(200, {"object": "block", "id": parts[1]})
+            return self._error(404, "object_not_found", path)
+
+    return Handler
+
+
+def get_chapter_uid(chapter):
+    return chapter["chapterUid"]
+
+
+def get_bookmark_id(bookmark):
+    return bookmark["bookmarkId"]
+
+
+def get_review_id(review):
+    return review["review"]["reviewId"]
+
+
+def get_book_id(page):
+    rich_text = page["properties"].get("BookId", {}).get("rich_text") or [{}]
+    return rich_text[0].get("text", {}).get("content")
+
+
+def serve(state, port=0):
+    """在后台线程中启动服务器，返回(server, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,99 @@
+"""用本地模拟服务器测量scripts/weread.py的同步速度
+
+每个书籍数量启动一个新的模拟服务器，用子进程运行一次完整同步，输出耗时、每秒同步的书籍数
+和每本书的请求数。例如：
+
+    python benchmarks/run_benchmark.py --books 10 500 5000 --latency 0.05 --rate429 0.1
+
+Notion默认限速每秒3个请求，5000本书需要很长时间，只想测量程序本身的开销时可以加上
+--notion-rate 1000。
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_servers import FakeState, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "scripts", "weread.py")
+
+
+def run_once(books, options):
+    state = FakeState(
+        books=books,
+        bookmarks=options.bookmarks,
+        reviews=options.reviews,
+        latency=options.latency,
+        rate429=options.rate429,
+    )
+    server, base_url = serve(state)
+    env = dict(
+        os.environ,
+        WEREAD_BASE_URL=base_url,
+        NOTION_BASE_URL=base_url,
+        WEREAD_COOKIE="wr_skey=benchmark; wr_vid=1",
+        NOTION_TOKEN="benchmark",
+        NOTION_PAGE="0123456789abcdef0123456789abcdef",
+    )
+    for name in ("CC_URL", "CC_ID", "CC_PASSWORD"):
+        env.pop(name, None)
+    argv = [sys.executable, SCRIPT, "--engine", options.engine, "--workers", str(options.workers)]
+    if options.notion_rate:
+        argv += ["--notion-rate", str(options.notion_rate)]
+    argv += options.extra
+    try:
+        with tempfile.TemporaryDirectory() as cwd:
+            argv += ["--cache-dir", os.path.join(cwd, "cache")]
+            start = time.monotonic()
+            result = subprocess.run(argv, cwd=cwd, env=env, capture_output=True, text=True)
+            wall = time.monotonic() - start
+    finally:
+        server.shutdown()
+    if result.returncode != 0:
+        print(result.stdout[-2000:])
+        print(result.stderr[-2000:])
+        raise SystemExit(f"同步失败，退出码 {result.returncode}")
+    synced = sum(1 for page in state.pages.values() if not page["archived"])
+    return {
+        "books": books,
+        "synced": synced,
+        "wall": wall,
+        "books_per_sec": synced / wall if wall else 0,
+        "weread_per_book": state.total("weread") / max(1, books),
+        "notion_per_book": state.total("notion") / max(1, books),
+        "rate_limited": state.total("429"),
+    }
+
+
+def print_table(rows):
+    print(f"{'书籍数':>8} {'已同步':>8} {'耗时(s)':>10} {'书/秒':>8} {'微信读书请求/书':>14} {'Notion请求/书':>14} {'429次数':>8}")
+    for row in rows:
+        print(
+            f"{row['books']:>8} {row['synced']:>8} {row['wall']:>10.2f} {row['books_per_sec']:>8.2f} "
+            f"{row['weread_per_book']:>14.2f} {row['notion_per_book']:>14.2f} {row['rate_limited']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, nargs="+", default=[10, 500, 5000], help="书籍数量，可以有多个")
+    parser.add_argument("--bookmarks", type=int, default=20, help="每本书的划线数")
+    parser.add_argument("--reviews", type=int, default=3, help="每本书的笔记数")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument("--rate429", type=float, default=0.0, help="Notion请求返回429的概率")
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--notion-rate", type=float, default=None, help="传给weread.py的--notion-rate")
+    parser.add_argument("extra", nargs="*", help="其他传给weread.py的参数，放在--之后")
+    options = parser.parse_args()
+    rows = []
+    for books in options.books:
+        print(f"正在测试 {books} 本书...")
+        sys.stdout.flush()
+        rows.append(run_once(books, options))
+    print()
+    print_table(rows)
@@ -0,0 +1,61 @@
+import json
+import os
+import re
+
+# 账号名称同时是缓存子目录的名称
+ACCOUNT_NAME_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+def load_accounts(path):
+    """读取多账号配置文件，返回每个账号的配置
+
+    配置文件为JSON，accounts中每一项使用和环境变量相同的名称，例如：
+
+        {"accounts": [
+            {"name": "alice", "WEREAD_COOKIE": "...", "NOTION_TOKEN": "${ALICE_NOTION_TOKEN}",
+             "NOTION_PAGE": "https://www.notion.so/..."},
+            {"name": "bob", "CC_ID": "...", "CC_PASSWORD": "...", "NOTION_TOKEN": "...",
+             "NOTION_PAGE": "..."}
+        ]}
+
+    字符串中的${VAR}会替换为环境变量，密钥可以不直接写在文件中。
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    items = data.get("accounts") if isinstance(data, dict) else data
+    accounts = []
+    names = set()
+    for i, item in enumerate(items or []):
+        account = {
+            key: os.path.expandvars(value) if isinstance(value, str) else value
+            for key, value in item.items()
+        }
+        name = account.get("name") or f"account{i + 1}"
+        if not ACCOUNT_NAME_PATTERN.match(name):
+            raise Exception(f"账号名称只能包含字母、数字、下划线、点和减号: {name}")
+        if name in names:
+            raise Exception(f"账号名称重复: {name}")
+        names.add(name)
+        account["name"] = name
+        accounts.append(account)
+    if not accounts:
+        raise Exception(f"多账号配置文件中没有账号: {path}")
+    return accounts
+
+
+def interleave(queues):
+    """轮流从每个队列中取一项，产出(key, item)，queues为[(key, items)]
+
+    所有账号的书籍按这个顺序排队等待并发名额，一个账号的书籍再多也不会让其他账号一直等待。
+    """
+    iterators = [(key, iter(items)) for key, items in queues]
+    done = object()
+    while iterators:
+        remaining = []
+        for key, items in iterators:
+            item = next(items, done)
+            if item is done:
+                continue
+            remaining.append((key, items))
+            yield key, item
+        iterators = remaining
@@ -0,0 +1,477 @@
+import asyncio
+import sys
+
+from book import (
+    get_block_entries,
+    get_children,
+    get_page_properties,
+    iter_batches,
+    iter_children,
+    merge_bookmarks,
+    split_blocks,
+)
+from cache import BOOKINFO_TTL
+from notion_index import INDEX_PROPERTIES, get_index_pages
+from pipeline import iter_groups
+from retry_policy import RetryPolicy
+from sync_plan import (
+    BlockSync,
+    BookmarkFetch,
+    ChapterFetch,
+    ReviewFetch,
+    drop_resume,
+    get_filter_properties,
+    get_query_body,
+    lookup_page,
+    lookup_pages_to_delete,
+    plan_resume,
+    record_book,
+    remember_page,
+)
+from weread_api import (
+    BOOKMARKLIST_HEADERS,
+    CHAPTER_INFO_HEADERS,
+    HEADERS,
+    WEREAD_BOOK_INFO,
+    WEREAD_BOOKMARKLIST_URL,
+    WEREAD_CHAPTER_INFO,
+    WEREAD_NOTEBOOKS_URL,
+    WEREAD_READ_INFO_URL,
+    WEREAD_REVIEW_LIST_URL,
+    CHAPTER_BATCH_SIZE,
+    check_status,
+    get_bookmark_list_params,
+    get_fingerprint,
+    get_read_info_params,
+    get_review_list_params,
+    parse_bookinfo,
+    parse_notebooklist,
+    parse_read_info,
+)
+
+
+class AsyncEngine:
+    """基于asyncio的同步引擎，和weread.py中的主循环生成相同的页面
+
+    session为AsyncWeReadSession，client为AsyncThrottledClient，两者各自限制并发。
+    workers为同时处理的书籍数量，每本书的微信读书请求同时发出，写入Notion时按页面顺序进行。
+    每本书的日志在处理完成后一次性输出，避免不同书籍的日志交错。
+    name不为None时（多账号）日志以账号名称开头。retry_policy为微信读书请求的重试策略，
+    为None时使用默认的RetryPolicy。
+    """
+
+    def __init__(self, session, client, database_id, data_source_id,
+                 cache=None, page_index=None, incremental=False, workers=4, journal=None, name=None,
+                 retry_policy=None):
+        self.session = session
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.name = name
+        self.client = client
+        self.database_id = database_id
+        self.data_source_id = data_source_id
+        self.cache = cache
+        self.page_index = page_index
+        self.journal = journal
+        self.incremental = incremental
+        self.workers = max(1, workers)
+        self.success_count = 0
+        self.fail_count = 0
+        # bookId -> 批量获取章节信息的分组，见plan_chapters
+        self._chapter_groups = {}
+
+    async def run(self, todo, total, batch_size=CHAPTER_BATCH_SIZE):
+        """同步todo中的书籍，返回(成功数, 失败数)
+
+        todo中的元素为(index, book)，可以是列表或者迭代器。同时处理workers本书，有空闲时才从todo中
+        取下一组（batch_size本）书籍，todo不会一次全部读入，处理完的书籍随即释放。
+        """
+        semaphore = asyncio.Semaphore(self.workers)
+        tasks = set()
+
+        async def worker(index, book):
+            try:
+                await self.sync_book(index, book, total)
+            finally:
+                semaphore.release()
+
+        for group in iter_groups(todo, batch_size):
+            self.plan_chapters([book.get("book").get("bookId") for _, book in group])
+            for index, book in group:
+                await semaphore.acquire()
+                task = asyncio.ensure_future(worker(index, book))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        return self.success_count, self.fail_count
+
+    async def sync_book(self, index, book, total):
+        sort = book["sort"]
+        fingerprint = get_fingerprint(book)
+        book = book.get("book")
+        title = book.get("title")
+        cover = book.get("cover").replace("/s_", "/t7_")
+        bookId = book.get("bookId")
+        author = book.get("author")
+        categories = book.get("categories")
+        if categories != None:
+            categories = [x["title"] for x in categories]
+        log = [f"[{index+1}/{total}] 正在同步《{title}》..."]
+        if self.name is not None:
+            log[0] = f"[{self.name}] {log[0]}"
+        try:
+            fetched = await self.fetch_book(bookId, fingerprint)
+            summary, reviews = fetched["review_list"]
+            bookmark_list = fetched["bookmark_list"]
+            isbn, rating = fetched["bookinfo"]
+            page_fields = (title, bookId, cover, sort, author, isbn, rating, categories, fetched["read_info"])
+            log.append(f"  - 划线数: {len(bookmark_list)}, 笔记数: {len(reviews)}, 点评数: {len(summary)}")
+            if len(bookmark_list) == 0 and len(reviews) > 0:
+                log.append(f"  ⚠️  警告: 有笔记但没有划线，这不正常！bookId={bookId}")
+            bookmark_list = merge_bookmarks(bookmark_list, reviews)
+            log.append(f"  - 总计 {len(bookmark_list)} 条内容")
+            page_id = None
+            if self.incremental and (self.journal is None or self.journal.get(bookId) is None):
+                page_id = await self.update_existing_page(bookId, page_fields)
+            if page_id is not None:
+                children, keys = get_children(fetched["chapter"], summary, bookmark_list)
+                log.append(f"  - 生成了 {len(children)} 个内容块")
+                entries = get_block_entries(children, keys)
+                inserted, updated, deleted = await self.sync_blocks(
+                    bookId, page_id, children, keys
+                )
+                log.append(f"  - 增量同步: 新增 {inserted}，更新 {updated}，删除 {deleted} 个内容块")
+            else:
+                content = (fetched["chapter"], summary, bookmark_list)
+                resumed = await self.resume_page(bookId, fingerprint, page_fields, content, log)
+                if resumed is not None:
+                    page_id, children, state = resumed
+                    entries, ids, start = list(state["entries"]), list(state["ids"]), state["batches"]
+                else:
+                    await self.delete_book(bookId)
+                    page_id = await self.insert_to_notion(*page_fields)
+                    if self.journal is not None:
+                        self.journal.start(bookId, page_id, sort, fingerprint)
+                    children, entries, ids, start = iter_children(*content), [], [], 0
+                appended = await self.append_blocks(page_id, iter_batches(children), bookId, start)
+                if appended is None:
+                    log.append("  ⚠️  添加内容块时出现问题")
+                    entries = None
+                else:
+                    entries.extend(appended[0])
+                    ids.extend(appended[1])
+                    log.append(f"  - 添加了 {len(appended[0])} 个内容块，共 {len(entries)} 个")
+                    if self.cache is not None:
+                        self.cache.set_block_state(bookId, page_id, entries, ids)
+            record_book(self.page_index, self.journal, bookId, page_id, sort, fingerprint, entries)
+            log.append("  ✓ 成功")
+            self.success_count += 1
+        except Exception as e:
+            log.append(f"  ✗ 失败: {e}")
+            self.fail_count += 1
+        print("\n".join(log))
+        sys.stdout.flush()
+
+    async def get_notebooklist(self):
+        """获取笔记本列表，失败时返回None"""
+        r = await self.session.get(WEREAD_NOTEBOOKS_URL, headers=HEADERS)
+        if r.status_code >= 400:
+            print(f"请求失败，状态码: {r.status_code}")
+            sys.stdout.flush()
+            return None
+        return parse_notebooklist(r.json())
+
+    async def get_data_source_id(self):
+        """从数据库ID获取数据源ID，失败时直接使用数据库ID"""
+        try:
+            response = await self.client.request(path=f"databases/{self.database_id}", method="GET")
+            if response.get("data_sources"):
+                return response["data_sources"][0]["id"]
+        except Exception as e:
+            print(f"获取数据源ID失败，尝试直接使用database_id: {e}")
+            sys.stdout.flush()
+        return self.database_id
+
+    async def load_database(self):
+        """与weread.py中的load_database相同，返回[(bookId, page_id, properties)]"""
+        try:
+            response = await self.client.request(path=f"data_sources/{self.data_source_id}", method="GET")
+            properties = response.get("properties", {})
+        except Exception as e:
+            print(f"获取数据库属性失败: {e}")
+            properties = None
+        query = get_filter_properties(properties, INDEX_PROPERTIES)
+        pages = []
+        start_cursor = None
+        while True:
+            response = await self.client.request(
+                path=f"data_sources/{self.data_source_id}/query",
+                method="POST",
+                query=query,
+                body=get_query_body(start_cursor),
+            )
+            pages.extend(get_index_pages(response.get("results")))
+            if not response.get("has_more"):
+                break
+            start_cursor = response.get("next_cursor")
+        return pages
+
+    async def fetch_book(self, bookId, fingerprint):
+        """同时获取一本书需要的全部微信读书数据"""
+        names = ["bookinfo", "read_info", "chapter", "bookmark_list", "review_list"]
+        results = await asyncio.gather(
+            self.get_bookinfo(bookId),
+            self.get_read_info(bookId),
+            self.get_chapter(bookId),
+            self.with_retry(WEREAD_BOOKMARKLIST_URL, self.get_bookmark_list, bookId, fingerprint),
+            self.with_retry(WEREAD_REVIEW_LIST_URL, self.get_review_list, bookId, fingerprint),
+        )
+        return dict(zip(names, results))
+
+    async def with_retry(self, endpoint, func, *args):
+        """按错误类别重试，登录超时时先刷新Cookie"""
+        return await self.retry_policy.call_async(endpoint, func, *args, on_auth=self.session.refresh)
+
+    async def get_bookmark_list(self, bookId, fingerprint=None):
+        fetch = BookmarkFetch(self.cache, bookId, fingerprint)
+        while not fetch.done:
+            r = await self.session.get(
+                WEREAD_BOOKMARKLIST_URL,
+                params=get_bookmark_list_params(bookId, fetch.synckey),
+                headers=BOOKMARKLIST_HEADERS,
+            )
+            check_status(r)
+            if r.status_code >= 400:
+                return []
+            fetch.feed(r.json())
+        return fetch.result()
+
+    async def get_read_info(self, bookId):
+        try:
+            r = await self.session.get(
+                WEREAD_READ_INFO_URL, params=get_read_info_params(bookId), headers=HEADERS
+            )
+            if r.status_code >= 400:
+                return None
+            return parse_read_info(r.json())
+        except Exception as e:
+            print(f"  [提示] 获取阅读信息异常: {e}")
+            sys.stdout.flush()
+            return None
+
+    async def get_bookinfo(self, bookId):
+        if self.cache is not None:
+            cached = self.cache.get(bookId, "bookinfo", ttl=BOOKINFO_TTL)
+            if cached is not None:
+                return tuple(cached)
+        try:
+            r = await self.session.get(WEREAD_BOOK_INFO, params=dict(bookId=bookId), headers=HEADERS)
+            if r.status_code >= 400:
+                print(f"  [提示] 获取书籍详情HTTP失败, status={r.status_code}")
+                return ("", 0)
+            bookinfo = parse_bookinfo(r.json())
+            if bookinfo is None:
+                return ("", 0)
+            if self.cache is not None:
+                self.cache.set(bookId, "bookinfo", list(bookinfo))
+            return bookinfo
+        except Exception as e:
+            print(f"  [提示] 获取书籍详情异常: {e}")
+            sys.stdout.flush()
+            return ("", 0)
+
+    async def get_review_list(self, bookId, fingerprint=None):
+        fetch = ReviewFetch(self.cache, bookId, fingerprint)
+        while not fetch.done:
+            r = await self.session.get(
+                WEREAD_REVIEW_LIST_URL,
+                params=get_review_list_params(bookId, fetch.synckey),
+                headers=HEADERS,
+            )
+            check_status(r)
+            fetch.feed(r.json())
+        return fetch.result()
+
+    def plan_chapters(self, bookIds, size=CHAPTER_BATCH_SIZE):
+        """把要同步的书籍按顺序每size本分为一组，同一组书籍的章节信息用一次请求获取
+
+        请求在组内第一本书需要章节信息时发出，组内的书籍都取走结果后释放。
+        """
+        for i in range(0, len(bookIds), size):
+            group = {"bookIds": bookIds[i : i + size], "task": None}
+            for bookId in group["bookIds"]:
+                self._chapter_groups[bookId] = group
+
+    async def get_chapter(self, bookId):
+        """获取一本书的章节信息，在plan_chapters的分组中时和同组的书籍一起请求
+
+        整组请求失败时单独请求这本书，一本书的问题不会让同一组的其他书籍失败。
+        """
+        group = self._chapter_groups.pop(bookId, None)
+        if group is not None:
+            if group["task"] is None:
+                group["task"] = asyncio.ensure_future(
+                    self.with_retry(WEREAD_CHAPTER_INFO, self.get_chapter_infos, group["bookIds"])
+                )
+            try:
+                # 同一组的每本书只取一次，取走后释放
+                return (await group["task"]).pop(bookId, None)
+            except Exception:
+                pass
+        chapters = await self.with_retry(WEREAD_CHAPTER_INFO, self.get_chapter_infos, [bookId])
+        return chapters.get(bookId)
+
+    async def get_chapter_infos(self, bookIds):
+        """一次请求获取多本书的章节信息，返回{bookId: 章节dict或None}"""
+        fetch = ChapterFetch(self.cache, bookIds)
+        if not fetch.items:
+            return fetch.result
+        r = await self.session.post(WEREAD_CHAPTER_INFO, json=fetch.body(), headers=CHAPTER_INFO_HEADERS)
+        check_status(r)
+        return fetch.feed(r.json() if r.status_code < 400 else None)
+
+    async def find_page(self, bookId):
+        query, page_id = lookup_page(self.page_index, bookId)
+        if not query:
+            return page_id
+        return remember_page(self.page_index, bookId, await self.query_page_ids(bookId))
+
+    async def query_page_ids(self, bookId):
+        filter = {"property": "BookId", "rich_text": {"equals": bookId}}
+        response = await self.client.request(
+            path=f"data_sources/{self.data_source_id}/query",
+            method="POST",
+            body={"filter": filter},
+        )
+        return [result["id"] for result in response["results"]]
+
+    async def delete_book(self, bookId):
+        page_ids = lookup_pages_to_delete(self.page_index, bookId)
+        if page_ids is None:
+            page_ids = await self.query_page_ids(bookId)
+        for page_id in page_ids:
+            try:
+                await self.client.blocks.delete(block_id=page_id)
+            except Exception as e:
+                print(f"删除块时出错: {e}")
+        if self.page_index is not None:
+            self.page_index.remove(bookId)
+
+    async def insert_to_notion(self, *page_fields):
+        parent = {"database_id": self.database_id, "type": "database_id"}
+        properties, icon = get_page_properties(*page_fields)
+        response = await self.client.pages.create(
+            parent=parent, icon=icon, cover=icon, properties=properties
+        )
+        return response["id"]
+
+    async def update_page(self, page_id, *page_fields):
+        properties, icon = get_page_properties(*page_fields)
+        await self.client.pages.update(page_id=page_id, icon=icon, cover=icon, properties=properties)
+
+    async def update_existing_page(self, bookId, page_fields):
+        page_id = await self.find_page(bookId)
+        if page_id is None:
+            return None
+        try:
+            await self.update_page(page_id, *page_fields)
+            return page_id
+        except Exception:
+            if self.page_index is None:
+                raise
+            self.page_index.remove(bookId)
+        page_id = await self.find_page(bookId)
+        if page_id is not None:
+            await self.update_page(page_id, *page_fields)
+        return page_id
+
+    async def add_children(self, id, children, after=None):
+        """添加子块，同一个页面的批次必须按顺序添加"""
+        if not children:
+            return []
+        results = []
+        for batch in split_blocks(children):
+            try:
+                if after is None:
+                    response = await self.client.blocks.children.append(block_id=id, children=batch)
+                else:
+                    response = await self.client.blocks.children.append(
+                        block_id=id, children=batch, after=after
+                    )
+                    after = response.get("results")[-1]["id"]
+                results.extend(response.get("results"))
+            except Exception as e:
+                print(f"添加blocks失败: {e}")
+                return None
+        return results if len(results) == len(children) else None
+
+    async def append_blocks(self, page_id, batches, bookId=None, start=0):
+        """与weread.py中的append_blocks相同，每批生成后立即添加，返回(entries, ids)"""
+        entries = []
+        ids = []
+        for index, batch in enumerate(batches, start):
+            blocks = [block for block, _ in batch]
+            results = await self.add_children(page_id, blocks)
+            if results is None:
+                return None
+            batch_entries = get_block_entries(blocks, [key for _, key in batch])
+            batch_ids = [result["id"] for result in results]
+            if self.journal is not None and bookId is not None:
+                self.journal.commit_batch(bookId, index, batch_entries, batch_ids)
+            entries.extend(batch_entries)
+            ids.extend(batch_ids)
+        return entries, ids
+
+    async def resume_page(self, bookId, fingerprint, page_fields, content, log):
+        """与weread.py中的resume_page相同，返回(page_id, 剩下的(block, key), 日志记录)或None"""
+        state, children = plan_resume(self.journal, bookId, fingerprint, content)
+        if state is None:
+            return None
+        if children is not None:
+            try:
+                await self.update_page(state["page_id"], *page_fields)
+                log.append(f"  - 继续上次没有完成的写入，已添加 {len(state['entries'])} 个内容块")
+                return state["page_id"], children, state
+            except Exception as e:
+                log.append(f"  [提示] 无法继续上次的写入: {e}")
+        try:
+            await self.client.blocks.delete(block_id=state["page_id"])
+        except Exception as e:
+            print(f"删除块时出错: {e}")
+        drop_resume(self.journal, self.page_index, bookId, state)
+        return None
+
+    async def list_blocks(self, page_id):
+        blocks = []
+        start_cursor = None
+        while True:
+            response = await self.client.blocks.children.list(
+                block_id=page_id, **get_query_body(start_cursor)
+            )
+            blocks.extend(response.get("results"))
+            if not response.get("has_more"):
+                break
+            start_cursor = response.get("next_cursor")
+        return blocks
+
+    async def sync_blocks(self, bookId, page_id, children, keys):
+        """与weread.py中的sync_blocks相同，返回(新增数, 更新数, 删除数)"""
+        state = self.cache.get_block_state(bookId, page_id) if self.cache is not None else None
+        listed = await self.list_blocks(page_id) if state is None else None
+        plan = BlockSync(children, keys, state, listed)
+        if self.cache is not None:
+            self.cache.set_block_state(bookId, None, [], [])
+        await asyncio.gather(*(
+            self.client.blocks.update(block_id=block_id, **content) for block_id, content in plan.update
+        ))
+        for after, blocks, indexes in plan.inserts():
+            results = await self.add_children(page_id, blocks, after=after)
+            if results is None:
+                raise Exception("添加内容块失败")
+            plan.inserted(indexes, results)
+        await asyncio.gather(*(
+            self.client.blocks.delete(block_id=block_id) for block_id in plan.delete
+        ))
+        if self.cache is not None:
+            self.cache.set_block_state(bookId, page_id, plan.entries, plan.ids)
+        return plan.counts()
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from urllib.parse import urlparse
+
+import httpx
+
+from transport import get_httpx_timeout, get_weread_timeout
+from weread_api import WEREAD_URL
+from weread_session import is_login_timeout, record_response
+
+
+class AsyncWeReadSession:
+    """WeReadSession的异步版本，基于httpx.AsyncClient
+
+    同样只预热一次主页，-2012时刷新后重放请求。concurrency限制同时进行的微信读书请求数，
+    与Notion的并发限制互相独立。transport不为None时使用这个连接池，多个账号可以共用，
+    这时aclose不会关闭连接池。timeout为默认超时，请求没有指定timeout时使用各接口的超时。
+    """
+
+    def __init__(self, home_url=WEREAD_URL, cookies=None, headers=None, concurrency=4, timeout=30, metrics=None,
+                 transport=None):
+        self.home_url = home_url
+        self.metrics = metrics
+        self.client = httpx.AsyncClient(
+            cookies=cookies, headers=headers, follow_redirects=True, timeout=timeout, transport=transport
+        )
+        self._shared_transport = transport is not None
+        self.warmup_count = 0
+        self.api_count = 0
+        self.replay_count = 0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    @property
+    def cookies(self):
+        return self.client.cookies
+
+    @property
+    def avoided_warmups(self):
+        return max(0, self.api_count + self.replay_count - self.warmup_count)
+
+    async def warm_up(self):
+        async with self._lock:
+            if self._generation == 0:
+                await self._visit_home()
+
+    async def refresh(self, generation=None):
+        async with self._lock:
+            if generation is None or generation == self._generation:
+                await self._visit_home()
+
+    async def _visit_home(self):
+        response = await self._send("GET", self.home_url)
+        self.warmup_count += 1
+        self._generation += 1
+        return response
+
+    async def request(self, method, url, **kwargs):
+        await self.warm_up()
+        generation = self._generation
+        response = await self._send(method, url, **kwargs)
+        self.api_count += 1
+        if is_login_timeout(response):
+            await self.refresh(generation)
+            response = await self._send(method, url, retry=True, **kwargs)
+            self.replay_count += 1
+        return response
+
+    async def _send(self, method, url, retry=False, **kwargs):
+        if "timeout" not in kwargs:
+            kwargs["timeout"] = get_httpx_timeout(get_weread_timeout(url))
+        async with self._semaphore:
+            start = time.monotonic()
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except Exception:
+                if self.metrics is not None:
+                    self.metrics.record("weread", urlparse(url).path, time.monotonic() - start, retry=retry)
+                raise
+        if self.metrics is not None:
+            record_response(self.metrics, url, response, time.monotonic() - start, retry)
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        if not self._shared_transport:
+            await self.client.aclose()
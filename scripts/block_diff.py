@@ -0,0 +1,127 @@
+import hashlib
+import json
+from collections import deque
+
+
+def get_block_hash(block):
+    """计算块内容的哈希，不包含嵌套的子块"""
+    content = dict(block.get(block["type"], {}))
+    content.pop("children", None)
+    return _hash({"type": block["type"], block["type"]: content})
+
+
+def get_children_hash(children):
+    """计算子块（比如划线下面的引用）的哈希"""
+    return _hash(children or [])
+
+
+def get_text_hash(block):
+    """按类型、文字、颜色和图标计算的哈希
+
+    从Notion读取的块比生成的块多了很多字段，不能直接用get_block_hash比较，两种格式都可以用这个。
+    """
+    content = block.get(block.get("type")) or {}
+    text = "".join((x.get("text") or {}).get("content", "") for x in content.get("rich_text") or [])
+    icon = (content.get("icon") or {}).get("emoji")
+    return _hash([block.get("type"), text, content.get("color"), icon])
+
+
+def get_update_content(block):
+    """生成blocks.update的参数，update不能修改子块，需要去掉children"""
+    content = dict(block[block["type"]])
+    content.pop("children", None)
+    return {block["type"]: content}
+
+
+def get_content_hash(entries):
+    """计算整个页面内容的哈希，entries为get_block_entries生成的列表"""
+    return _hash(entries)
+
+
+def _hash(obj):
+    data = json.dumps(obj, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def unique_key(seen, key):
+    """保证块的标识不重复，重复的依次加上序号，seen记录每个标识已经出现的次数"""
+    count = seen.get(key, 0)
+    seen[key] = count + 1
+    return key if count == 0 else f"{key}~{count}"
+
+
+def diff_blocks(old, new):
+    """对比上次同步到页面上的块和这次新生成的块
+
+    old为上次同步保存的[key, block_id, hash, children_hash]列表，按页面上的顺序排列；
+    new为新生成的[key, hash, children_hash]列表。返回一个dict：
+        ids: 与new一一对应，可以保留的块为已有的block_id，需要插入的为None
+        update: 内容有变化、可以原地更新的块，[(new中的下标, block_id)]
+        delete: 需要删除的block_id
+        insert: 需要插入的连续块，[(插入位置前一个块的下标, [new中的下标])]，下标为-1时插到anchor之后
+        anchor: 插到最前面的块要插在哪个块之后，为None时直接添加到页面中
+    子块有变化或者顺序变化的块无法原地修改，会删除后重新插入。
+    Notion只能把块插到某个块之后，需要在最前面插入块时，把它们插到第一个保留的块之后，
+    再重新创建这个块，原来的块放在delete中，所以删除要在插入之后进行。
+    """
+    old_pos = {entry[0]: (i, entry) for i, entry in enumerate(old)}
+    ids = [None] * len(new)
+    update = []
+    kept = set()
+    last = -1
+    for i, (key, block_hash, children_hash) in enumerate(new):
+        found = old_pos.get(key)
+        if found is None:
+            continue
+        pos, (_, block_id, old_hash, old_children_hash) = found
+        if pos <= last or old_children_hash != children_hash:
+            continue
+        last = pos
+        kept.add(key)
+        ids[i] = block_id
+        if old_hash != block_hash:
+            update.append((i, block_id))
+    delete = [entry[1] for entry in old if entry[0] not in kept]
+    insert = []
+    for i in range(len(new)):
+        if ids[i] is not None:
+            continue
+        if insert and insert[-1][1][-1] == i - 1:
+            insert[-1][1].append(i)
+        else:
+            insert.append((i - 1, [i]))
+    anchor = None
+    if kept and insert and insert[0][0] < 0:
+        first = insert[0][1][-1] + 1
+        anchor = ids[first]
+        ids[first] = None
+        update = [(i, block_id) for i, block_id in update if i != first]
+        delete.append(anchor)
+        indexes = insert.pop(0)[1] + [first]
+        if insert and insert[0][0] == first:
+            indexes += insert.pop(0)[1]
+        insert.insert(0, (-1, indexes))
+    return {"ids": ids, "update": update, "delete": delete, "insert": insert, "anchor": anchor}
+
+
+def rebuild_block_state(listed, children, entries):
+    """没有上次同步的记录时（不使用缓存或者第一次增量同步），从页面上现有的块重建记录
+
+    listed为blocks.children.list读取的块，按页面上的顺序排列；children和entries为这次生成的块
+    和对应的get_block_entries。类型、文字、颜色和图标都相同的块按顺序对应到新块的key，可以保留；
+    读取的块不包含子块的内容，有子块的块会删除后重新插入；没有对应的块会被删除。
+    返回和diff_blocks的old相同格式的列表。
+    """
+    positions = {}
+    for i, block in enumerate(children):
+        positions.setdefault(get_text_hash(block), deque()).append(i)
+    state = []
+    for block in listed:
+        queue = positions.get(get_text_hash(block))
+        if not queue:
+            state.append([f"unmatched-{block['id']}", block["id"], None, None])
+            continue
+        key, block_hash, _ = entries[queue.popleft()]
+        children_hash = None if block.get("has_children") else get_children_hash([])
+        state.append([key, block["id"], block_hash, children_hash])
+    return state
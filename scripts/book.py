@@ -0,0 +1,324 @@
+import hashlib
+import json
+import re
+from datetime import datetime
+
+from block_diff import get_block_hash, get_children_hash, unique_key
+from utils import (
+    SEGMENT_LIMIT,
+    get_callout,
+    get_date,
+    get_file,
+    get_heading,
+    get_icon,
+    get_multi_select,
+    get_number,
+    get_quote,
+    get_rich_text,
+    get_select,
+    get_table_of_contents,
+    get_text_segments,
+    get_title,
+    get_url,
+)
+
+# 把微信读书的数据转换为Notion页面的属性和内容，同步和异步引擎共用
+
+# blocks.children.append每次最多添加100个块，包括嵌套的子块在内最多1000个块，
+# 请求体最大500KB
+BATCH_SIZE = 100
+BATCH_BLOCKS = 1000
+BATCH_BYTES = 500 * 1000
+# 请求体中children以外的部分（{"children": []}、after等）预留的字节数
+BATCH_OVERHEAD = 200
+# 单个块（包括子块）序列化后的上限，单独成为一批时请求体也不超过BATCH_BYTES
+BLOCK_BYTES = BATCH_BYTES - BATCH_OVERHEAD
+
+
+def get_page_properties(bookName, bookId, cover, sort, author, isbn, rating, categories, read_info=None):
+    """生成页面的属性和图标，read_info为None时表示阅读信息获取失败"""
+    if not cover or not cover.startswith("http"):
+        cover = "https://www.notion.so/icons/book_gray.svg"
+    properties = {
+        "BookName": get_title(bookName),
+        "BookId": get_rich_text(bookId),
+        "ISBN": get_rich_text(isbn),
+        "URL": get_url(
+            f"https://weread.qq.com/web/reader/{calculate_book_str_id(bookId)}"
+        ),
+        "Author": get_rich_text(author),
+        "Sort": get_number(sort),
+        "Rating": get_number(rating),
+        "Cover": get_file(cover),
+    }
+    if categories != None:
+        properties["Categories"] = get_multi_select(categories)
+    if read_info != None:
+        markedStatus = read_info.get("markedStatus", 0)
+        readingTime = read_info.get("readingTime", 0)
+        readingProgress = read_info.get("readingProgress", 0)
+        format_time = ""
+        hour = readingTime // 3600
+        if hour > 0:
+            format_time += f"{hour}时"
+        minutes = readingTime % 3600 // 60
+        if minutes > 0:
+            format_time += f"{minutes}分"
+        properties["Status"] = get_select("读完" if markedStatus == 4 else "在读")
+        properties["ReadingTime"] = get_rich_text(format_time)
+        properties["Progress"] = get_number(readingProgress)
+        if "finishedDate" in read_info:
+            properties["Date"] = get_date(
+                datetime.utcfromtimestamp(read_info.get("finishedDate")).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                )
+            )
+
+    icon = get_icon(cover)
+    return properties, icon
+
+
+def merge_bookmarks(bookmark_list, reviews):
+    """合并划线和笔记，按章节和位置排序"""
+    return sorted(
+        bookmark_list + reviews,
+        key=lambda x: (
+            x.get("chapterUid", 1),
+            (
+                0
+                if (
+                    x.get("range", "") == ""
+                    or x.get("range").split("-")[0] == ""
+                )
+                else int(x.get("range").split("-")[0])
+            ),
+        ),
+    )
+
+
+def get_item_key(item):
+    """划线或笔记在页面上的标识，增量同步时用来找到对应的块"""
+    if item.get("reviewId") != None:
+        return f"review-{item.get('reviewId')}"
+    return f"bookmark-{item.get('bookmarkId')}"
+
+
+def get_children(chapter, summary, bookmark_list):
+    """生成页面内容，返回(children, keys)
+
+    keys与children一一对应，是每个块的标识，用于增量同步。
+    """
+    children = []
+    keys = []
+    for block, key in iter_children(chapter, summary, bookmark_list):
+        children.append(block)
+        keys.append(key)
+    return children, keys
+
+
+def iter_children(chapter, summary, bookmark_list):
+    """逐个生成页面内容块，产出(block, key)，key已经去重
+
+    划线的引用（abstract）直接作为callout的子块，和callout在同一个请求中添加。
+    """
+    seen = {}
+    for key, block in _iter_blocks(chapter, summary, bookmark_list):
+        yield block, unique_key(seen, key)
+
+
+def iter_batches(items, size=BATCH_SIZE, max_blocks=BATCH_BLOCKS, max_bytes=BATCH_BYTES):
+    """把逐个生成的(block, key)打包成批产出，内存中最多只有一批
+
+    每批不超过size个块，包括嵌套的子块在内不超过max_blocks个块，序列化后不超过max_bytes字节，
+    在这些限制内每批尽量多放，请求数最少。单个块本身就超过限制时单独成为一批。
+    """
+    batch = []
+    blocks = 0
+    length = BATCH_OVERHEAD
+    for item in items:
+        count, size_bytes = get_block_size(item[0])
+        if batch and (
+            len(batch) == size
+            or blocks + count > max_blocks
+            or length + size_bytes > max_bytes
+        ):
+            yield batch
+            batch = []
+            blocks = 0
+            length = BATCH_OVERHEAD
+        batch.append(item)
+        blocks += count
+        # 块之间的","
+        length += size_bytes + 1
+    if batch:
+        yield batch
+
+
+def split_blocks(children):
+    """把一组块按iter_batches的限制拆成多批，返回[[block]]"""
+    return [
+        [block for block, _ in batch]
+        for batch in iter_batches((block, None) for block in children)
+    ]
+
+
+def get_block_size(block):
+    """返回(包括嵌套子块在内的块数, 序列化后的字节数)"""
+    return _count_blocks(block), len(encode_json(block))
+
+
+def encode_json(obj):
+    """和httpx（0.28起）发送请求体时的编码相同：中文不转义、没有空格，UTF-8编码"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _count_blocks(block):
+    children = block.get(block.get("type"), {}).get("children") or []
+    return 1 + sum(_count_blocks(child) for child in children)
+
+
+def _iter_callouts(content, style, colorStyle, reviewId, key, abstract=None):
+    """长内容放在一个callout的多段rich_text中，超过一个块的上限（SEGMENT_LIMIT段，或者连同引用
+    序列化后超过BLOCK_BYTES字节）时才拆分为多个callout，引用放在最后一个callout下面"""
+    segments = get_text_segments(content)
+    empty = get_callout("", style, colorStyle, reviewId)
+    empty["callout"]["rich_text"] = []
+    size = len(encode_json(empty))
+    quote = None
+    reserve = 0
+    if abstract != None and abstract != "":
+        # 引用是划线原文的摘录，最多占一个块的一半，超出的部分截掉
+        quote = _fit_quote(get_quote(abstract), BLOCK_BYTES // 2)
+        reserve = len(encode_json(dict(empty, callout=dict(empty["callout"], children=[quote])))) - size
+    # 从后往前装，最后一个callout要给引用留出位置
+    pieces = []
+    piece = []
+    length = size + reserve
+    for segment in reversed(segments):
+        # 加上段之间的","
+        segment_size = len(encode_json(segment)) + 1
+        if piece and (len(piece) == SEGMENT_LIMIT or length + segment_size > BLOCK_BYTES):
+            pieces.append(piece)
+            piece = []
+            length = size
+        piece.append(segment)
+        length += segment_size
+    pieces.append(piece)
+    blocks = []
+    for i, piece in enumerate(reversed(pieces)):
+        block = get_callout("", style, colorStyle, reviewId)
+        block["callout"]["rich_text"] = piece[::-1]
+        blocks.append((key + (f"#{i}" if i > 0 else ""), block))
+    if quote is not None:
+        blocks[-1][1]["callout"]["children"] = [quote]
+    return blocks
+
+
+def _fit_quote(quote, limit):
+    """引用最多SEGMENT_LIMIT段，并且序列化后不超过limit字节"""
+    rich_text = quote["quote"]["rich_text"][:SEGMENT_LIMIT]
+    quote["quote"]["rich_text"] = rich_text
+    while len(rich_text) > 1 and len(encode_json(quote)) > limit:
+        rich_text.pop()
+    return quote
+
+
+def _iter_blocks(chapter, summary, bookmark_list):
+    if chapter != None:
+        # 添加目录
+        yield "toc", get_table_of_contents()
+        d = {}
+        for data in bookmark_list:
+            chapterUid = data.get("chapterUid", 1)
+            if chapterUid not in d:
+                d[chapterUid] = []
+            d[chapterUid].append(data)
+        for key, value in d.items():
+            if key in chapter:
+                # 添加章节
+                yield f"chapter-{key}", get_heading(
+                    chapter.get(key).get("level"), chapter.get(key).get("title")
+                )
+            for i in value:
+                yield from _iter_callouts(
+                    i.get("markText"),
+                    i.get("style"),
+                    i.get("colorStyle"),
+                    i.get("reviewId"),
+                    get_item_key(i),
+                    i.get("abstract"),
+                )
+    else:
+        # 如果没有章节信息
+        for data in bookmark_list:
+            yield from _iter_callouts(
+                data.get("markText"),
+                data.get("style"),
+                data.get("colorStyle"),
+                data.get("reviewId"),
+                get_item_key(data),
+            )
+    if summary != None and len(summary) > 0:
+        yield "summary", get_heading(1, "点评")
+        for i in summary:
+            yield from _iter_callouts(
+                i.get("review").get("content"),
+                i.get("style"),
+                i.get("colorStyle"),
+                i.get("review").get("reviewId"),
+                get_item_key(i.get("review")),
+            )
+
+
+def get_block_entries(children, keys):
+    """生成增量同步用的[key, hash, children_hash]列表"""
+    return [
+        [
+            key,
+            get_block_hash(block),
+            get_children_hash(block[block["type"]].get("children")),
+        ]
+        for key, block in zip(keys, children)
+    ]
+
+
+def transform_id(book_id):
+    id_length = len(book_id)
+
+    if re.match(r"^\d*$", book_id):
+        ary = []
+        for i in range(0, id_length, 9):
+            ary.append(format(int(book_id[i : min(i + 9, id_length)]), "x"))
+        return "3", ary
+
+    result = ""
+    for i in range(id_length):
+        result += format(ord(book_id[i]), "x")
+    return "4", [result]
+
+
+def calculate_book_str_id(book_id):
+    md5 = hashlib.md5()
+    md5.update(book_id.encode("utf-8"))
+    digest = md5.hexdigest()
+    result = digest[0:3]
+    code, transformed_ids = transform_id(book_id)
+    result += code + "2" + digest[-2:]
+
+    for i in range(len(transformed_ids)):
+        hex_length_str = format(len(transformed_ids[i]), "x")
+        if len(hex_length_str) == 1:
+            hex_length_str = "0" + hex_length_str
+
+        result += hex_length_str + transformed_ids[i]
+
+        if i < len(transformed_ids) - 1:
+            result += "g"
+
+    if len(result) < 20:
+        result += digest[0 : 20 - len(result)]
+
+    md5 = hashlib.md5()
+    md5.update(result.encode("utf-8"))
+    result += md5.hexdigest()[0:3]
+    return result
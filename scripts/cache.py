@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+import time
+
+# 静态数据的有效期（秒），章节目录和ISBN、评分很少变化
+CHAPTER_TTL = 7 * 24 * 3600
+BOOKINFO_TTL = 30 * 24 * 3600
+# 增量获取的数据超过这个时间后重新全量获取一次，避免遗漏的删除一直留在缓存中
+FULL_FETCH_TTL = 30 * 24 * 3600
+
+
+class BookCache:
+    """按bookId保存微信读书接口数据的本地缓存，每本书一个JSON文件
+
+    划线、笔记等会变化的数据用笔记本列表中的指纹判断是否失效（有新的笔记时指纹会变），
+    章节、书籍详情等静态数据按有效期失效。同时保存接口返回的synckey，
+    失效后用synckey只请求变化的部分，合并到缓存的完整数据中。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, "books"), exist_ok=True)
+
+    def _file(self, bookId):
+        return os.path.join(self.path, "books", f"{bookId}.json")
+
+    def _load(self, bookId):
+        try:
+            with open(self._file(bookId), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _dump(self, bookId, entries):
+        file = self._file(bookId)
+        tmp = f"{file}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp, file)
+
+    def get_entry(self, bookId, name):
+        """返回原始缓存项，包含data、version、synckey和fetched_at"""
+        with self._lock:
+            return self._load(bookId).get(name)
+
+    def get(self, bookId, name, version=None, ttl=None):
+        """返回仍然有效的缓存数据，没有或已经失效时返回None"""
+        entry = self.get_entry(bookId, name)
+        valid = (
+            entry is not None
+            and (version is None or entry.get("version") == version)
+            and (ttl is None or time.time() - entry.get("fetched_at", 0) < ttl)
+        )
+        with self._lock:
+            if valid:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry["data"] if valid else None
+
+    def get_delta_base(self, bookId, name):
+        """返回增量请求需要的(完整数据, synckey)
+
+        没有缓存、没有synckey或者距离上次全量获取超过FULL_FETCH_TTL时返回(None, 0)，需要全量获取。
+        """
+        entry = self.get_entry(bookId, name)
+        if (
+            entry is None
+            or not entry.get("synckey")
+            or time.time() - entry.get("full_at", 0) > FULL_FETCH_TTL
+        ):
+            return None, 0
+        return entry["data"], entry["synckey"]
+
+    def set(self, bookId, name, data, version=None, synckey=None, delta=False):
+        """保存数据，delta为True表示data是用增量数据合并出来的"""
+        with self._lock:
+            entries = self._load(bookId)
+            now = time.time()
+            full_at = now
+            if delta and name in entries:
+                full_at = entries[name].get("full_at", 0)
+            entries[name] = {
+                "data": data,
+                "version": version,
+                "synckey": synckey,
+                "fetched_at": now,
+                "full_at": full_at,
+            }
+            self._dump(bookId, entries)
+
+    def get_block_state(self, bookId, page_id):
+        """返回上次同步到页面上的[key, block_id, hash, children_hash]列表，页面不一致时返回None"""
+        state = self.get(bookId, "blocks")
+        if state is None or state.get("page_id") != page_id:
+            return None
+        return state["blocks"]
+
+    def set_block_state(self, bookId, page_id, entries, ids):
+        """保存页面上每个块的标识和block_id，下次增量同步时使用"""
+        blocks = [[key, block_id, h, ch] for (key, h, ch), block_id in zip(entries, ids)]
+        self.set(bookId, "blocks", {"page_id": page_id, "blocks": blocks})
@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+import time
+
+from requests.cookies import RequestsCookieJar, create_cookie
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+except ImportError:  # 可选依赖，没有安装时不保存Cookie
+    Fernet = None
+
+# 加密Cookie使用的密钥，可以是任意字符串
+COOKIE_KEY_ENV = "WEREAD_COOKIE_KEY"
+# 从密钥派生加密密钥时使用的随机盐的字节数，盐保存在密文前面
+SALT_SIZE = 16
+KDF_ITERATIONS = 600000
+
+
+def derive_key(key, salt):
+    """用PBKDF2从密钥字符串和盐派生Fernet密钥"""
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS)
+    return base64.urlsafe_b64encode(kdf.derive(key.encode("utf-8")))
+
+
+class CookieStore:
+    """加密保存微信读书会话的Cookie，保存在缓存目录的cookies.enc中
+
+    运行结束时保存会话中最新的Cookie（包括服务器轮换的wr_skey），下次启动时直接使用，
+    省去请求CookieCloud和Cookie过期后刷新的过程。source为Cookie来源的哈希，
+    配置的Cookie或者CookieCloud账号改变后不再使用保存的Cookie。
+    文件内容为随机盐加上Fernet密文，加密密钥由key和盐用PBKDF2派生。
+    """
+
+    def __init__(self, path, key):
+        self.file = os.path.join(path, "cookies.enc")
+        self.key = key
+        self.salt = None
+        self.fernet = None
+        self.source = None  # 读取到的Cookie的来源
+        os.makedirs(path, exist_ok=True)
+
+    def _use_salt(self, salt):
+        # 派生密钥比较慢，盐不变时沿用
+        if salt != self.salt:
+            self.salt = salt
+            self.fernet = Fernet(derive_key(self.key, salt))
+
+    def load(self, source):
+        """返回保存的RequestsCookieJar，没有保存、无法解密或者来源不一致时返回None
+
+        source为None（没有配置Cookie来源）时使用保存的任意Cookie。
+        """
+        try:
+            with open(self.file, "rb") as f:
+                content = f.read()
+        except OSError:
+            return None
+        if len(content) <= SALT_SIZE:
+            return None
+        self._use_salt(content[:SALT_SIZE])
+        try:
+            data = json.loads(self.fernet.decrypt(content[SALT_SIZE:]))
+        except (ValueError, InvalidToken):
+            return None
+        if source is not None and data.get("source") != source:
+            return None
+        if not data.get("cookies"):
+            return None
+        self.source = data.get("source")
+        jar = RequestsCookieJar()
+        for cookie in data["cookies"]:
+            jar.set_cookie(create_cookie(**cookie))
+        return jar
+
+    def save(self, jar, source):
+        """jar为http.cookiejar.CookieJar，requests和httpx的Cookie都可以
+
+        source为None时沿用读取到的Cookie的来源。
+        """
+        cookies = [
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "expires": cookie.expires,
+                "secure": cookie.secure,
+            }
+            for cookie in jar
+        ]
+        if not cookies:
+            return
+        if source is None:
+            source = self.source
+        data = json.dumps({"source": source, "cookies": cookies, "saved_at": time.time()})
+        if self.fernet is None:
+            self._use_salt(os.urandom(SALT_SIZE))
+        tmp = f"{self.file}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.salt + self.fernet.encrypt(data.encode("utf-8")))
+        os.replace(tmp, self.file)
+
+
+def get_cookie_store(path, key=None):
+    """返回CookieStore，没有设置密钥时返回None，不保存Cookie"""
+    key = key or os.getenv(COOKIE_KEY_ENV)
+    if not key:
+        return None
+    if Fernet is None:
+        print(f"⚠️  设置了 {COOKIE_KEY_ENV}，但是没有安装 cryptography，不保存 Cookie")
+        sys.stdout.flush()
+        return None
+    return CookieStore(path, key)
+
+
+def get_cookie_source(env=os.environ):
+    """Cookie来源的哈希：CookieCloud的地址和ID，或者配置的WEREAD_COOKIE，都没有配置时返回None"""
+    if env.get("CC_ID") and env.get("CC_PASSWORD"):
+        source = f"cookiecloud:{env.get('CC_URL') or ''}:{env.get('CC_ID')}"
+    elif env.get("WEREAD_COOKIE"):
+        source = f"cookie:{env.get('WEREAD_COOKIE')}"
+    else:
+        return None
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
@@ -0,0 +1,60 @@
+import json
+import os
+
+
+class ExportWriter:
+    """把要写入Notion的页面和内容块写成JSONL文件，不请求Notion
+
+    每本书依次写一行page（页面属性）、若干行blocks（每行一批最多100个块）和一行end。
+    文件可以用--replay写入Notion，也可以直接用来检查生成的内容。
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+        self.books = 0
+        self.blocks = 0
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False))
+        self.file.write("\n")
+
+    def write_book(self, bookId, title, sort, fingerprint, properties, icon, batches):
+        """写入一本书，batches为iter_batches产出的[(block, key)]，返回写入的块数"""
+        self._write(
+            {
+                "type": "page",
+                "bookId": bookId,
+                "title": title,
+                "sort": sort,
+                "fingerprint": fingerprint,
+                "properties": properties,
+                "icon": icon,
+            }
+        )
+        count = 0
+        for batch in batches:
+            children = [block for block, _ in batch]
+            keys = [key for _, key in batch]
+            self._write({"type": "blocks", "bookId": bookId, "children": children, "keys": keys})
+            count += len(children)
+        self._write({"type": "end", "bookId": bookId, "count": count})
+        self.file.flush()
+        self.books += 1
+        self.blocks += count
+        return count
+
+    def close(self):
+        self.file.close()
+
+
+def read_export(path):
+    """逐行读取导出文件，产出每条记录"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
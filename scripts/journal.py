@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+
+from book import get_block_entries
+
+
+class WriteJournal:
+    """新建页面的预写日志，保存在缓存目录的journal.jsonl中
+
+    每行一个事件，先写日志再继续下一步：
+      page  页面已经创建，记录page_id、sort和fingerprint
+      batch 第index批内容块（连同嵌套的子块）已经添加，记录这一批的entries和block_id，
+            启动时会把已完成的批次合并成一条，batches为合并了多少批
+      done  全部内容块已经添加并更新了索引，记录总块数
+    进程中途退出后，日志中没有done的书籍下次运行时从最后一个完成的批次继续添加，
+    不需要删除页面重新上传。path为None时只保存在内存中。
+    """
+
+    def __init__(self, path=None):
+        self.file = os.path.join(path, "journal.jsonl") if path else None
+        self.books = {}
+        self._lock = threading.Lock()
+        if self.file is None:
+            return
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(self.file, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 写到一半时退出，最后一行不完整
+                        break
+                    self._apply(record)
+        except OSError:
+            self.books = {}
+        self._compact()
+
+    def __len__(self):
+        return len(self.books)
+
+    def get(self, bookId):
+        """返回没有写完的页面{page_id, sort, fingerprint, batches, entries, ids}，没有时返回None"""
+        return self.books.get(bookId)
+
+    def start(self, bookId, page_id, sort, fingerprint):
+        self._append(
+            {"event": "page", "bookId": bookId, "page_id": page_id, "sort": sort, "fingerprint": fingerprint}
+        )
+
+    def commit_batch(self, bookId, index, entries, ids):
+        self._append({"event": "batch", "bookId": bookId, "index": index, "entries": entries, "ids": ids})
+
+    def finish(self, bookId):
+        """页面已经完整写入，或者没写完的页面已经删除"""
+        state = self.books.get(bookId)
+        if state is not None:
+            self._append({"event": "done", "bookId": bookId, "blocks": len(state["entries"])})
+
+    def _apply(self, record):
+        bookId = record.get("bookId")
+        event = record.get("event")
+        if event == "page":
+            self.books[bookId] = {
+                "page_id": record["page_id"],
+                "sort": record.get("sort"),
+                "fingerprint": record.get("fingerprint"),
+                "batches": 0,
+                "entries": [],
+                "ids": [],
+            }
+        elif event == "batch":
+            state = self.books.get(bookId)
+            # 批次必须连续，否则说明日志有问题，只保留前面连续的部分
+            if state is not None and record["index"] == state["batches"]:
+                state["batches"] += record.get("batches", 1)
+                state["entries"].extend(record["entries"])
+                state["ids"].extend(record["ids"])
+        elif event == "done":
+            self.books.pop(bookId, None)
+
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            if self.file is None:
+                return
+            with open(self.file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _compact(self):
+        """启动时只保留没有写完的书籍，日志不会一直变大"""
+        records = []
+        for bookId, state in self.books.items():
+            records.append(
+                {
+                    "event": "page",
+                    "bookId": bookId,
+                    "page_id": state["page_id"],
+                    "sort": state["sort"],
+                    "fingerprint": state["fingerprint"],
+                }
+            )
+            if state["batches"]:
+                # 已完成的批次合并成一条记录，记下合并的批数，之后的批次从这个序号继续
+                records.append(
+                    {
+                        "event": "batch",
+                        "bookId": bookId,
+                        "index": 0,
+                        "batches": state["batches"],
+                        "entries": state["entries"],
+                        "ids": state["ids"],
+                    }
+                )
+        tmp = f"{self.file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.file)
+
+
+def skip_committed(state, children):
+    """跳过日志中已经添加的内容块，返回剩下的(block, key)迭代器
+
+    children为iter_children产出的(block, key)。按块数而不是批数跳过，重新生成的前几个块
+    和日志中的不一致（例如缓存中的数据有变化）时返回None，需要重新写入整个页面。
+    """
+    children = iter(children)
+    committed = []
+    for _ in range(len(state["entries"])):
+        item = next(children, None)
+        if item is None:
+            return None
+        committed.append(item)
+    entries = get_block_entries([block for block, _ in committed], [key for _, key in committed])
+    if entries != state["entries"]:
+        return None
+    return children
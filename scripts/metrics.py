@@ -0,0 +1,149 @@
+import json
+import math
+import os
+import re
+import threading
+
+# 路径中的页面ID、块ID等替换为{id}，同一个接口的请求合并统计
+ID_PATTERN = re.compile(r"^[0-9a-fA-F-]{16,}$")
+PROMETHEUS_PREFIX = "weread_sync"
+
+
+class Metrics:
+    """按接口统计请求次数、状态码、errCode、耗时、字节数和重试次数
+
+    WeReadSession和ThrottledClient每发出一个HTTP请求调用一次record，
+    运行结束后输出表格，并可以写成JSON和Prometheus textfile。
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, service, endpoint, latency, status=None, err_code=None, size=0, retry=False):
+        """记录一次请求，status为None表示没有收到响应（超时、连接失败等）"""
+        error = status is None or status >= 400 or err_code not in (None, 0)
+        with self._lock:
+            stats = self.endpoints.get((service, endpoint))
+            if stats is None:
+                stats = self.endpoints[(service, endpoint)] = {
+                    "count": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "bytes": 0,
+                    "latencies": [],
+                    "status": {},
+                    "err_code": {},
+                }
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["retries"] += int(retry)
+            stats["bytes"] += size or 0
+            stats["latencies"].append(latency)
+            key = str(status) if status is not None else "none"
+            stats["status"][key] = stats["status"].get(key, 0) + 1
+            if err_code not in (None, 0):
+                key = str(err_code)
+                stats["err_code"][key] = stats["err_code"].get(key, 0) + 1
+
+    def to_dict(self):
+        """按接口汇总，latency为秒"""
+        with self._lock:
+            items = sorted(self.endpoints.items())
+            result = []
+            for (service, endpoint), stats in items:
+                latencies = sorted(stats["latencies"])
+                result.append({
+                    "service": service,
+                    "endpoint": endpoint,
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "retries": stats["retries"],
+                    "bytes": stats["bytes"],
+                    "latency_p50": percentile(latencies, 0.5),
+                    "latency_p95": percentile(latencies, 0.95),
+                    "latency_max": latencies[-1] if latencies else 0,
+                    "latency_sum": sum(latencies),
+                    "status": dict(stats["status"]),
+                    "err_code": dict(stats["err_code"]),
+                })
+            return result
+
+    def table(self):
+        rows = self.to_dict()
+        if not rows:
+            return ""
+        width = max(len(f"{row['service']} {row['endpoint']}") for row in rows)
+        lines = [
+            f"{'接口':<{width}} {'次数':>6} {'p50(ms)':>8} {'p95(ms)':>8} {'max(ms)':>8} {'错误':>6} {'重试':>6} {'KB':>8}"
+        ]
+        for row in rows:
+            name = f"{row['service']} {row['endpoint']}"
+            lines.append(
+                f"{name:<{width}} {row['count']:>6} {row['latency_p50'] * 1000:>8.0f} "
+                f"{row['latency_p95'] * 1000:>8.0f} {row['latency_max'] * 1000:>8.0f} "
+                f"{row['errors']:>6} {row['retries']:>6} {row['bytes'] / 1024:>8.1f}"
+            )
+        return "\n".join(lines)
+
+    def write_json(self, path):
+        _write(path, json.dumps({"endpoints": self.to_dict()}, ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path):
+        """写成node_exporter textfile collector可以读取的格式"""
+        lines = []
+        metrics = [
+            ("requests_total", "counter", "请求次数", "count"),
+            ("request_errors_total", "counter", "失败的请求次数", "errors"),
+            ("request_retries_total", "counter", "重试的请求次数", "retries"),
+            ("response_bytes_total", "counter", "响应的字节数", "bytes"),
+        ]
+        rows = self.to_dict()
+        for name, kind, help, field in metrics:
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for row in rows:
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{_labels(row)}}} {row[field]}")
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_request_latency_seconds 请求耗时")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_request_latency_seconds summary")
+        for row in rows:
+            for quantile, field in (("0.5", "latency_p50"), ("0.95", "latency_p95"), ("1", "latency_max")):
+                lines.append(
+                    f'{PROMETHEUS_PREFIX}_request_latency_seconds{{{_labels(row)},quantile="{quantile}"}} {row[field]:.6f}'
+                )
+            lines.append(f"{PROMETHEUS_PREFIX}_request_latency_seconds_sum{{{_labels(row)}}} {row['latency_sum']:.6f}")
+            lines.append(f"{PROMETHEUS_PREFIX}_request_latency_seconds_count{{{_labels(row)}}} {row['count']}")
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_err_code_total 接口返回的errCode次数")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_err_code_total counter")
+        for row in rows:
+            for code, count in sorted(row["err_code"].items()):
+                lines.append(f'{PROMETHEUS_PREFIX}_err_code_total{{{_labels(row)},code="{code}"}} {count}')
+        _write(path, "\n".join(lines) + "\n")
+
+
+def percentile(values, q):
+    """values已经排序，按nearest-rank取分位数"""
+    if not values:
+        return 0
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def get_notion_endpoint(method, path):
+    """Notion接口的名称，例如 PATCH blocks/{id}/children"""
+    parts = ["{id}" if ID_PATTERN.match(part) else part for part in path.strip("/").split("/")]
+    return f"{method.upper()} {'/'.join(parts)}"
+
+
+def _labels(row):
+    endpoint = row["endpoint"].replace("\\", "\\\\").replace('"', '\\"')
+    return f'service="{row["service"]}",endpoint="{endpoint}"'
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, path)
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import time
+
+# 超过这个时间没有和Notion核对过的记录需要重新查询
+INDEX_TTL = 7 * 24 * 3600
+# 读取整个数据库时只取这几个属性
+INDEX_PROPERTIES = ["BookId", "Sort", "Progress", "Status"]
+
+
+class NotionIndex:
+    """bookId到Notion页面的本地索引，保存在缓存目录的index.json中
+
+    每条记录包含page_id、sort、hash（页面内容的哈希）、fingerprint（笔记本列表中的指纹）
+    和synced_at（最后一次和Notion核对的时间）。
+    查询书籍是否存在时先查索引，只有记录过期时才需要请求Notion。
+    path为None时只保存在内存中。complete为True表示索引是从整个数据库读取的，
+    索引中没有的书籍在Notion中也不存在。
+    """
+
+    def __init__(self, path=None):
+        self.file = os.path.join(path, "index.json") if path else None
+        self.books = {}
+        self.complete = False
+        self._lock = threading.Lock()
+        if self.file is None:
+            return
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(self.file, encoding="utf-8") as f:
+                data = json.load(f)
+            self.books = data.get("books", {})
+            self.complete = data.get("complete", False)
+        except (OSError, ValueError):
+            self.books = {}
+
+    def __len__(self):
+        return len(self.books)
+
+    def get(self, bookId, fresh=True):
+        """返回索引中的记录，fresh为True时只返回没有过期的记录"""
+        entry = self.books.get(bookId)
+        if entry is None:
+            return None
+        if fresh and time.time() - entry.get("synced_at", 0) > INDEX_TTL:
+            return None
+        return entry
+
+    def is_missing(self, bookId):
+        """索引是完整的并且其中没有这本书时返回True，不需要再查询Notion"""
+        return self.complete and bookId not in self.books
+
+    def put(self, bookId, page_id, sort=None, hash=None, fingerprint=None):
+        with self._lock:
+            self.books[bookId] = {
+                "page_id": page_id,
+                "sort": sort,
+                "hash": hash,
+                "fingerprint": fingerprint,
+                "synced_at": time.time(),
+            }
+            self._save()
+
+    def is_changed(self, bookId, sort, fingerprint):
+        """判断书籍自上次同步以来是否有变化，无法判断时返回None
+
+        有指纹时比较指纹；从Notion数据库读取的记录没有指纹，比较这本书自己的sort。
+        索引中没有这本书时，完整的索引说明是新书，否则无法判断。
+        """
+        entry = self.books.get(bookId)
+        if entry is None:
+            return True if self.complete else None
+        if entry.get("fingerprint") is not None:
+            return entry["fingerprint"] != fingerprint
+        # 内容没有完整写入时不记录sort，需要重新同步
+        return entry.get("sort") is None or sort > entry["sort"]
+
+    def load_pages(self, pages):
+        """用从Notion数据库读取的全部页面重建索引
+
+        pages中的每一项为(bookId, page_id, properties)，properties中的Sort、Progress、Status
+        也保存到索引中。同一本书有多个页面时，其余的页面ID记录在duplicates中。
+        """
+        now = time.time()
+        books = {}
+        for bookId, page_id, properties in pages:
+            if bookId in books:
+                books[bookId].setdefault("duplicates", []).append(page_id)
+                continue
+            books[bookId] = {
+                "page_id": page_id,
+                "sort": properties.get("Sort"),
+                "hash": None,
+                "progress": properties.get("Progress"),
+                "status": properties.get("Status"),
+                "synced_at": now,
+            }
+        with self._lock:
+            self.books = books
+            self.complete = True
+            self._save()
+
+    def remove(self, bookId):
+        with self._lock:
+            if self.books.pop(bookId, None) is not None:
+                self._save()
+
+    def latest_sort(self):
+        """索引中最大的sort，索引为空时返回None"""
+        sorts = [entry["sort"] for entry in self.books.values() if entry.get("sort")]
+        return max(sorts) if sorts else None
+
+    def _save(self):
+        if self.file is None:
+            return
+        tmp = f"{self.file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"books": self.books, "complete": self.complete}, f, ensure_ascii=False)
+        os.replace(tmp, self.file)
+
+
+def get_index_pages(results):
+    """把数据库查询结果转换为load_pages需要的[(bookId, page_id, properties)]，没有BookId的页面会被忽略"""
+    pages = []
+    for result in results:
+        properties = result.get("properties", {})
+        values = {name: get_property_value(properties.get(name)) for name in INDEX_PROPERTIES}
+        if values["BookId"]:
+            pages.append((values["BookId"], result["id"], values))
+    return pages
+
+
+def get_property_value(property):
+    """取出查询结果中属性的值，只处理索引需要的几种类型"""
+    if property is None:
+        return None
+    if property.get("type") == "rich_text" or "rich_text" in property:
+        return "".join(
+            x.get("plain_text") or x.get("text", {}).get("content", "")
+            for x in property.get("rich_text", [])
+        )
+    if property.get("type") == "number" or "number" in property:
+        return property.get("number")
+    if property.get("type") == "select" or "select" in property:
+        select = property.get("select")
+        return select.get("name") if select else None
+    return None
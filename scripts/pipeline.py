@@ -0,0 +1,58 @@
+import queue
+import threading
+from itertools import islice
+
+# 生产者最多领先消费者的批数
+PIPELINE_DEPTH = 2
+
+
+def pipelined(iterable, depth=PIPELINE_DEPTH):
+    """在后台线程中迭代iterable，通过有界队列逐个产出
+
+    生产者最多领先depth项，内存占用有上限。生产者抛出的异常会在消费者一侧重新抛出；
+    消费者提前停止（break或者异常）时生产者也会停止。
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except BaseException as error:
+            put((False, error))
+            return
+        put((False, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = items.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_groups(iterable, size):
+    """按顺序每size项打包成一个列表产出，只读取下一组需要的项"""
+    iterator = iter(iterable)
+    while True:
+        group = list(islice(iterator, size))
+        if not group:
+            return
+        yield group
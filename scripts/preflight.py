@@ -0,0 +1,119 @@
+import sys
+import time
+
+from weread_api import (
+    BOOKMARKLIST_HEADERS,
+    CHAPTER_INFO_HEADERS,
+    HEADERS,
+    WEREAD_BOOK_INFO,
+    WEREAD_BOOKMARKLIST_URL,
+    WEREAD_CHAPTER_INFO,
+    WEREAD_NOTEBOOKS_URL,
+    WEREAD_READ_INFO_URL,
+    WEREAD_REVIEW_LIST_URL,
+    WEREAD_URL,
+    get_bookmark_list_params,
+    get_chapter_info_body,
+    get_read_info_params,
+    get_review_list_params,
+)
+from weread_session import get_err_code
+
+def run_preflight(session, client=None, database_id=None, data_source_id=None):
+    """依次请求微信读书和Notion的各个接口，返回每个接口的检查结果
+
+    微信读书的书籍接口使用笔记本列表中的第一本书。client为None时不检查Notion。
+    """
+    results = []
+    _check_weread(results, "GET /", lambda: session.get(WEREAD_URL))
+    notebook = _check_weread(
+        results, "GET /api/user/notebook", lambda: session.get(WEREAD_NOTEBOOKS_URL, headers=HEADERS)
+    )
+    books = (notebook or {}).get("books") or []
+    bookId = books[0].get("book", {}).get("bookId") if books else None
+    if bookId is not None:
+        _check_weread(
+            results, "GET /web/book/info", lambda: session.get(WEREAD_BOOK_INFO, params={"bookId": bookId}, headers=HEADERS)
+        )
+        _check_weread(
+            results,
+            "GET /web/book/readinfo",
+            lambda: session.get(WEREAD_READ_INFO_URL, params=get_read_info_params(bookId), headers=HEADERS),
+        )
+        _check_weread(
+            results,
+            "GET /web/book/bookmarklist",
+            lambda: session.get(
+                WEREAD_BOOKMARKLIST_URL, params=get_bookmark_list_params(bookId), headers=BOOKMARKLIST_HEADERS
+            ),
+        )
+        _check_weread(
+            results,
+            "GET /web/review/list",
+            lambda: session.get(WEREAD_REVIEW_LIST_URL, params=get_review_list_params(bookId), headers=HEADERS),
+        )
+        _check_weread(
+            results,
+            "POST /web/book/chapterInfos",
+            lambda: session.post(WEREAD_CHAPTER_INFO, json=get_chapter_info_body(bookId), headers=CHAPTER_INFO_HEADERS),
+        )
+    if client is not None:
+        _check_notion(
+            results, "GET databases/{id}", lambda: client.request(path=f"databases/{database_id}", method="GET")
+        )
+        _check_notion(
+            results,
+            "POST data_sources/{id}/query",
+            lambda: client.request(
+                path=f"data_sources/{data_source_id}/query", method="POST", body={"page_size": 1}
+            ),
+        )
+    return results
+
+
+def _check_weread(results, endpoint, send):
+    """检查一个微信读书接口，返回解析后的JSON，失败时返回None"""
+    result = {"service": "weread", "endpoint": endpoint, "ok": False, "status": None, "err_code": None}
+    start = time.monotonic()
+    data = None
+    try:
+        response = send()
+        result["status"] = response.status_code
+        result["err_code"] = get_err_code(response)
+        result["ok"] = response.status_code < 400 and result["err_code"] in (None, 0)
+        if result["ok"] and endpoint != "GET /":
+            data = response.json()
+    except Exception as e:
+        result["message"] = str(e)
+    result["latency"] = time.monotonic() - start
+    results.append(result)
+    return data
+
+
+def _check_notion(results, endpoint, send):
+    result = {"service": "notion", "endpoint": endpoint, "ok": False, "status": None, "err_code": None}
+    start = time.monotonic()
+    try:
+        send()
+        result["status"] = 200
+        result["ok"] = True
+    except Exception as e:
+        result["status"] = getattr(e, "status", None)
+        result["err_code"] = getattr(e, "code", None)
+        result["message"] = str(e)
+    result["latency"] = time.monotonic() - start
+    results.append(result)
+
+
+def print_preflight(results):
+    width = max(len(f"{result['service']} {result['endpoint']}") for result in results)
+    print(f"{'接口':<{width}} {'结果':>4} {'状态码':>6} {'errCode':>8} {'耗时(ms)':>9}")
+    for result in results:
+        name = f"{result['service']} {result['endpoint']}"
+        print(
+            f"{name:<{width}} {'✓' if result['ok'] else '✗':>4} {str(result['status']):>6} "
+            f"{str(result['err_code']):>8} {result['latency'] * 1000:>9.0f}"
+        )
+        if result.get("message"):
+            print(f"  {result['message'][:200]}")
+    sys.stdout.flush()
@@ -0,0 +1,224 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+
+from notion_client import APIErrorCode, APIResponseError, AsyncClient, Client
+from notion_client.client import ClientOptions
+from notion_client.errors import RequestTimeoutError
+
+from metrics import get_notion_endpoint
+from transport import get_httpx_timeout, get_notion_timeout
+
+# Notion API 平均每秒3个请求
+NOTION_RATE = 3
+# 服务端错误只对幂等请求重试，避免重复添加内容
+SERVER_ERRORS = (
+    APIErrorCode.InternalServerError,
+    APIErrorCode.ServiceUnavailable,
+)
+# 最近一次响应的字节数，线程和协程各自独立
+_response_size = contextvars.ContextVar("response_size", default=0)
+
+
+class TokenBucket:
+    """令牌桶限流，多个线程共享
+
+    rate为每秒补充的令牌数，capacity为允许的突发数量。
+    收到429时调用pause让所有线程一起等待。
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，返回等待的秒数"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """协程版本的acquire，等待时不阻塞事件循环"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def _reserve(self):
+        """预定一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate, self.paused_until - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class _ThrottleMixin:
+    """同步和异步客户端共用的初始化和统计，rate为None时每秒NOTION_RATE个请求"""
+
+    def __init__(self, *args, rate=None, max_retries=5, metrics=None, **kwargs):
+        # 关闭notion_client自带的重试，由这里统一处理
+        if not args and "options" not in kwargs and "retry" in ClientOptions.__dataclass_fields__:
+            kwargs.setdefault("retry", False)
+        super().__init__(*args, **kwargs)
+        self.limiter = TokenBucket(rate or NOTION_RATE)
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.request_count = 0
+        self.retry_count = 0
+        self.working_time = 0
+        self.throttled_time = 0
+        self._stats_lock = threading.Lock()
+
+    def _build_request(self, method, path, *args, **kwargs):
+        # 按接口设置超时，代替notion_client对所有请求统一的timeout_ms
+        request = super()._build_request(method, path, *args, **kwargs)
+        request.extensions["timeout"] = get_httpx_timeout(get_notion_timeout(method, path)).as_dict()
+        return request
+
+    def _record(self, throttled, working, request=True):
+        with self._stats_lock:
+            if request:
+                self.request_count += 1
+            self.working_time += working
+            self.throttled_time += throttled
+
+    def _parse_response(self, response):
+        _response_size.set(len(response.content))
+        return super()._parse_response(response)
+
+    def _record_metrics(self, method, path, latency, attempt, error=None):
+        if self.metrics is None:
+            return
+        status, code = 200, None
+        if error is not None:
+            status = getattr(error, "status", None)
+            code = getattr(error, "code", None)
+            code = getattr(code, "value", code)
+        self.metrics.record(
+            "notion",
+            get_notion_endpoint(method, path),
+            latency,
+            status=status,
+            err_code=code,
+            size=_response_size.get(),
+            retry=attempt > 0,
+        )
+
+    def summary(self):
+        return (
+            f"Notion请求: {self.request_count} 次，重试 {self.retry_count} 次，"
+            f"工作 {self.working_time:.1f} 秒，限流等待 {self.throttled_time:.1f} 秒"
+        )
+
+
+class ThrottledClient(_ThrottleMixin, Client):
+    """所有请求都经过令牌桶限流的Notion客户端
+
+    pages.create、blocks.children.append、blocks.delete等接口最终都会调用request，
+    在这里统一限流，遇到429时按Retry-After等待，没有Retry-After时指数退避。
+    同时统计工作时间和限流等待时间。
+    """
+
+    def request(self, path, method, query=None, body=None, form_data=None, auth=None):
+        attempt = 0
+        while True:
+            waited = self.limiter.acquire()
+            start = time.monotonic()
+            _response_size.set(0)
+            try:
+                response = super().request(path, method, query, body, form_data, auth)
+            except Exception as error:
+                self._record(waited, time.monotonic() - start)
+                self._record_metrics(method, path, time.monotonic() - start, attempt, error)
+                if attempt >= self.max_retries or not is_retryable(error, method):
+                    raise
+                delay = get_retry_delay(error, attempt)
+                if APIResponseError.is_api_response_error(error) and error.code == APIErrorCode.RateLimited:
+                    # 限流时所有线程一起等待，等待时间计入下一次acquire
+                    self.limiter.pause(delay)
+                else:
+                    time.sleep(delay)
+                    self._record(delay, 0, request=False)
+                attempt += 1
+                with self._stats_lock:
+                    self.retry_count += 1
+                continue
+            self._record(waited, time.monotonic() - start)
+            self._record_metrics(method, path, time.monotonic() - start, attempt)
+            return response
+
+
+class AsyncThrottledClient(_ThrottleMixin, AsyncClient):
+    """ThrottledClient的异步版本，用于asyncio同步引擎
+
+    concurrency限制同时进行的Notion请求数，和令牌桶一起控制请求速度。
+    """
+
+    def __init__(self, *args, concurrency=NOTION_RATE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+
+    async def request(self, path, method, query=None, body=None, form_data=None, auth=None):
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                waited = await self.limiter.acquire_async()
+                start = time.monotonic()
+                _response_size.set(0)
+                try:
+                    response = await super().request(path, method, query, body, form_data, auth)
+                except Exception as error:
+                    self._record(waited, time.monotonic() - start)
+                    self._record_metrics(method, path, time.monotonic() - start, attempt, error)
+                    if attempt >= self.max_retries or not is_retryable(error, method):
+                        raise
+                    delay = get_retry_delay(error, attempt)
+                    rate_limited = (
+                        APIResponseError.is_api_response_error(error)
+                        and error.code == APIErrorCode.RateLimited
+                    )
+                    if rate_limited:
+                        self.limiter.pause(delay)
+                else:
+                    self._record(waited, time.monotonic() - start)
+                    self._record_metrics(method, path, time.monotonic() - start, attempt)
+                    return response
+            if not rate_limited:
+                await asyncio.sleep(delay)
+                self._record(delay, 0, request=False)
+            attempt += 1
+            with self._stats_lock:
+                self.retry_count += 1
+
+
+def is_retryable(error, method):
+    if APIResponseError.is_api_response_error(error):
+        if error.code == APIErrorCode.RateLimited:
+            return True
+        return method.upper() in ("GET", "DELETE") and error.code in SERVER_ERRORS
+    return RequestTimeoutError.is_request_timeout_error(error) and method.upper() in ("GET", "DELETE")
+
+
+def get_retry_delay(error, attempt):
+    """优先使用Retry-After，否则指数退避加随机抖动"""
+    if APIResponseError.is_api_response_error(error) and error.headers is not None:
+        retry_after = error.headers.get("retry-after")
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+    return min(60.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
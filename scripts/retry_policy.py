@@ -0,0 +1,215 @@
+import asyncio
+import functools
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from weread_api import WeReadError
+from weread_session import ERR_CODE_LOGIN_TIMEOUT
+
+# 微信读书接口的错误类别
+AUTH = "auth"  # 登录超时（-2012），刷新Cookie后重试
+RATE_LIMIT = "rate_limit"  # 429，等待较长时间后重试
+TRANSIENT = "transient"  # 网络错误、超时、5xx，很快就能恢复
+PERMANENT = "permanent"  # 其他错误，重试也不会成功
+
+# 每类错误最多重试的次数，一次调用中各类错误分别计数
+RETRY_BUDGETS = {AUTH: 1, RATE_LIMIT: 4, TRANSIENT: 3, PERMANENT: 0}
+# 每类错误第一次重试前等待的秒数，之后每次翻倍，再乘以0.5~1.5的随机抖动
+RETRY_BASE_DELAYS = {AUTH: 0.5, RATE_LIMIT: 5, TRANSIENT: 1}
+MAX_RETRY_DELAY = 30
+# 一个接口连续网络错误、5xx或者429这么多次后熔断，冷却期间的请求直接失败
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+RETRY_NAMES = {AUTH: "登录超时", RATE_LIMIT: "限流", TRANSIENT: "网络错误"}
+
+
+class CircuitOpenError(Exception):
+    """接口熔断中，没有发出请求"""
+
+
+def classify(error):
+    """返回错误的类别，requests和httpx的异常都可以"""
+    if isinstance(error, WeReadError):
+        if error.err_code == ERR_CODE_LOGIN_TIMEOUT:
+            return AUTH
+        if error.status == 429:
+            return RATE_LIMIT
+        if error.status is not None and error.status >= 500:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(
+        error,
+        (requests.ConnectionError, requests.Timeout, requests.JSONDecodeError, json.JSONDecodeError),
+    ):
+        # 返回的不是JSON一般是网关的错误页面
+        return TRANSIENT
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return TRANSIENT
+    return PERMANENT
+
+
+class CircuitBreaker:
+    """一个接口的熔断器
+
+    连续失败threshold次后打开，cooldown秒内的请求直接抛出CircuitOpenError；
+    冷却结束后只放一个请求试探，成功后恢复，失败则重新冷却。before_call返回这次请求是不是试探，
+    请求结束后都要把它传给end_call，试探请求没有结果（例如登录超时或者被取消）时下一个请求重新试探。
+    """
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_until = 0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.failures < self.threshold:
+                return False
+            if self._probing or time.monotonic() < self.opened_until:
+                raise CircuitOpenError(f"{self.name} 连续失败 {self.failures} 次，暂停请求")
+            self._probing = True
+            return True
+
+    def end_call(self, probe):
+        if not probe:
+            return
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            now = time.monotonic()
+            if self.failures < self.threshold or now < self.opened_until:
+                return
+            self.opened_until = now + self.cooldown
+            self.trips += 1
+        print(f"⚠️  {self.name} 连续失败 {self.failures} 次，暂停请求 {self.cooldown} 秒")
+        sys.stdout.flush()
+
+
+class RetryPolicy:
+    """按错误类别重试微信读书请求，代替原来不分错误、固定等待5秒重试3次的@retry
+
+    每类错误有自己的重试次数和指数退避，永久错误直接抛出。登录超时时先调用on_auth刷新Cookie。
+    每个接口有一个熔断器，接口故障时不再反复请求，同步和异步引擎都可以使用。
+    """
+
+    def __init__(self, budgets=None, base_delays=None, max_delay=MAX_RETRY_DELAY,
+                 threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.budgets = dict(RETRY_BUDGETS, **(budgets or {}))
+        self.base_delays = dict(RETRY_BASE_DELAYS, **(base_delays or {}))
+        self.max_delay = max_delay
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.breakers = {}
+        self.retries = {kind: 0 for kind in RETRY_NAMES}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        with self._lock:
+            if endpoint not in self.breakers:
+                name = urlparse(endpoint).path or endpoint
+                self.breakers[endpoint] = CircuitBreaker(name, self.threshold, self.cooldown)
+            return self.breakers[endpoint]
+
+    def call(self, endpoint, func, *args, on_auth=None, **kwargs):
+        """调用func，失败时按错误类别重试，endpoint为熔断器的名称（接口地址）"""
+        breaker = self.breaker(endpoint)
+        used = {}
+        while True:
+            probe = breaker.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                kind, delay = self._on_error(breaker, error, used)
+                if delay is None:
+                    raise
+                if kind == AUTH and on_auth is not None:
+                    on_auth()
+                time.sleep(delay)
+                continue
+            else:
+                breaker.record_success()
+                return result
+            finally:
+                breaker.end_call(probe)
+
+    async def call_async(self, endpoint, func, *args, on_auth=None, **kwargs):
+        """call的协程版本，func和on_auth都是协程函数"""
+        breaker = self.breaker(endpoint)
+        used = {}
+        while True:
+            probe = breaker.before_call()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as error:
+                kind, delay = self._on_error(breaker, error, used)
+                if delay is None:
+                    raise
+                if kind == AUTH and on_auth is not None:
+                    await on_auth()
+                await asyncio.sleep(delay)
+                continue
+            else:
+                breaker.record_success()
+                return result
+            finally:
+                breaker.end_call(probe)
+
+    def wrap(self, endpoint, on_auth=None):
+        """装饰器，用法和原来的@retry一样"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.call(endpoint, func, *args, on_auth=on_auth, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _on_error(self, breaker, error, used):
+        """记录一次失败，返回(类别, 重试前等待的秒数)，不再重试时等待秒数为None"""
+        kind = classify(error)
+        if kind in (RATE_LIMIT, TRANSIENT):
+            breaker.record_failure()
+        elif kind == PERMANENT:
+            # 接口有正常的响应，只是这次请求本身有问题
+            breaker.record_success()
+        attempt = used.get(kind, 0)
+        if attempt >= self.budgets.get(kind, 0):
+            return kind, None
+        used[kind] = attempt + 1
+        with self._lock:
+            self.retries[kind] += 1
+        return kind, self._get_delay(kind, attempt, error)
+
+    def _get_delay(self, kind, attempt, error):
+        retry_after = getattr(error, "retry_after", None)
+        if kind == RATE_LIMIT and retry_after is not None:
+            return min(self.max_delay, retry_after)
+        delay = min(self.max_delay, self.base_delays.get(kind, 1) * 2 ** attempt)
+        return delay * (0.5 + random.random())
+
+    def summary(self):
+        parts = [f"{RETRY_NAMES[kind]} {count} 次" for kind, count in self.retries.items()]
+        trips = sum(breaker.trips for breaker in self.breakers.values())
+        return f"微信读书重试: {'，'.join(parts)}，熔断 {trips} 次"
@@ -0,0 +1,274 @@
+from block_diff import diff_blocks, get_content_hash, get_update_content, rebuild_block_state
+from book import get_block_entries, iter_children
+from cache import CHAPTER_TTL
+from journal import skip_committed
+from weread_api import (
+    get_chapter_dict,
+    get_chapter_infos_body,
+    get_notebook_counts,
+    is_delta_response,
+    parse_bookmark_list,
+    parse_chapter_infos,
+    parse_review_list,
+    split_reviews,
+)
+
+# 同步一本书时的决策逻辑：用不用缓存、怎样合并增量数据、页面上的块怎样修改、能不能继续上次的写入。
+# 这里不发出任何网络请求，同步引擎（weread.py）和异步引擎（async_engine.py）只负责按结果发请求。
+
+
+class DeltaFetch:
+    """一次可以用synckey增量获取的请求（划线或笔记）
+
+    创建时先查缓存，指纹一致时done为True，不需要请求；否则synckey为请求时要带上的值，
+    base为增量合并的基础（缓存中的完整列表），为None时全量获取。请求后把返回的数据交给feed，
+    done为False时需要用新的synckey再请求一次，done为True后用result()取结果。
+    """
+
+    name = None
+    # 指纹中对应的数量在get_notebook_counts结果中的位置
+    count_index = None
+
+    def __init__(self, cache, bookId, fingerprint=None):
+        self.cache = cache
+        self.bookId = bookId
+        self.fingerprint = fingerprint
+        self.base = None
+        self.synckey = 0
+        self.items = None
+        self.done = False
+        self.expected = get_notebook_counts(fingerprint)[self.count_index]
+        if cache is not None:
+            cached = cache.get(bookId, self.name, version=fingerprint)
+            if cached is not None:
+                self.items = cached
+                self.done = True
+                return
+            self.base, self.synckey = cache.get_delta_base(bookId, self.name)
+
+    def feed(self, data):
+        """处理接口返回的JSON，合并增量数据并写入缓存
+
+        带了synckey请求时，结果的数量和笔记本列表中的不一致（例如漏掉了删除）时不使用这个结果，
+        把synckey改为0，done保持False，需要再全量请求一次。不带synckey全量获取的结果不检查数量。
+        """
+        delta = self.base is not None and is_delta_response(self.synckey, data)
+        items = self.parse(data, self.base if delta else None)
+        if self.base is not None and items is not None and self.expected not in (None, self.count(items)):
+            self.base, self.synckey = None, 0
+            return
+        self.done = True
+        if items is None:
+            return
+        self.items = items
+        if self.cache is not None:
+            self.cache.set(
+                self.bookId, self.name, items,
+                version=self.fingerprint, synckey=data.get("synckey"), delta=delta,
+            )
+
+    def parse(self, data, base):
+        raise NotImplementedError
+
+    def count(self, items):
+        """和笔记本列表中的数量对应的项数"""
+        return len(items)
+
+    def result(self):
+        raise NotImplementedError
+
+
+class BookmarkFetch(DeltaFetch):
+    """获取划线，result()返回排好序的划线列表"""
+
+    name = "bookmark_list"
+    count_index = 0
+
+    def parse(self, data, base):
+        return parse_bookmark_list(self.bookId, data, base)
+
+    def result(self):
+        return self.items if self.items is not None else []
+
+
+class ReviewFetch(DeltaFetch):
+    """获取笔记，result()返回(点评, 笔记)"""
+
+    name = "review_list"
+    count_index = 1
+
+    def parse(self, data, base):
+        return parse_review_list(self.bookId, data, base)
+
+    def count(self, items):
+        # 笔记本列表中的笔记数不包括点评
+        return sum(1 for x in items if x.get("review", {}).get("type") == 1)
+
+    def result(self):
+        return split_reviews(self.items) if self.items is not None else ([], [])
+
+
+class ChapterFetch:
+    """一次批量获取多本书的章节信息
+
+    缓存中没有过期的书籍直接放入result，其余的书籍在items中，为空时不需要请求。
+    请求的JSON为body()，返回的JSON交给feed（请求失败时为None），返回{bookId: 章节dict或None}。
+    """
+
+    def __init__(self, cache, bookIds):
+        self.cache = cache
+        self.result = {}
+        self.bases = {}
+        self.synckeys = {}
+        self.items = []
+        for bookId in bookIds:
+            base, synckey = None, 0
+            if cache is not None:
+                cached = cache.get(bookId, "chapter", ttl=CHAPTER_TTL)
+                if cached is not None:
+                    self.result[bookId] = get_chapter_dict(cached)
+                    continue
+                base, synckey = cache.get_delta_base(bookId, "chapter")
+            self.bases[bookId] = base
+            self.synckeys[bookId] = synckey
+            self.items.append((bookId, synckey))
+
+    def body(self):
+        return get_chapter_infos_body(self.items)
+
+    def feed(self, data):
+        parsed = (parse_chapter_infos(data, self.bases, self.synckeys) if data is not None else None) or {}
+        for bookId, _ in self.items:
+            if bookId not in parsed:
+                self.result[bookId] = None
+                continue
+            chapters, synckey, delta = parsed[bookId]
+            if self.cache is not None:
+                self.cache.set(bookId, "chapter", chapters, synckey=synckey, delta=delta)
+            self.result[bookId] = get_chapter_dict(chapters)
+        return self.result
+
+
+class BlockSync:
+    """增量同步一个页面时要做的修改
+
+    state为上次同步保存的块（cache.get_block_state），没有时用listed（页面上现有的块）重建，
+    见rebuild_block_state。之后依次用update中的内容更新块、插入inserts()中的块，每插入一组后
+    调用inserted记录新块的ID，再删除delete中的块（插入时可能要用到其中的块定位），
+    最后用entries和ids保存页面的状态。
+    """
+
+    def __init__(self, children, keys, state, listed=None):
+        self.children = children
+        self.entries = get_block_entries(children, keys)
+        if state is None and listed is not None:
+            state = rebuild_block_state(listed, children, self.entries)
+        plan = diff_blocks(state or [], self.entries)
+        self.delete = plan["delete"]
+        self.update = [
+            (block_id, get_update_content(children[i])) for i, block_id in plan["update"]
+        ]
+        self.ids = plan["ids"]
+        self._insert = plan["insert"]
+        self._anchor = plan["anchor"]
+
+    def inserts(self):
+        """依次返回(插入到哪个块之后, 块列表, 下标列表)，直接添加到页面中时第一项为None"""
+        for prev, indexes in self._insert:
+            after = self.ids[prev] if prev >= 0 else self._anchor
+            yield after, [self.children[i] for i in indexes], indexes
+
+    def inserted(self, indexes, results):
+        for i, result in zip(indexes, results):
+            self.ids[i] = result["id"]
+
+    def counts(self):
+        """返回(新增数, 更新数, 删除数)"""
+        inserted = sum(len(indexes) for _, indexes in self._insert)
+        return inserted, len(self.update), len(self.delete)
+
+
+def plan_resume(journal, bookId, fingerprint, content):
+    """返回(写入日志中的记录, 剩下的(block, key))
+
+    没有记录时返回(None, None)；书籍内容有变化、不能继续写入时剩下的为None，
+    需要用drop_resume删除没写完的页面。
+    """
+    state = journal.get(bookId) if journal is not None else None
+    if state is None:
+        return None, None
+    if state["fingerprint"] != fingerprint:
+        return state, None
+    return state, skip_committed(state, iter_children(*content))
+
+
+def drop_resume(journal, page_index, bookId, state):
+    """没写完的页面删除后清除日志记录，索引指向这个页面时一起删除"""
+    if page_index is not None:
+        entry = page_index.get(bookId, fresh=False)
+        if entry is not None and entry["page_id"] == state["page_id"]:
+            page_index.remove(bookId)
+    journal.finish(bookId)
+
+
+def lookup_page(page_index, bookId):
+    """从本地索引中找书籍的页面，返回(是否需要查询Notion, 页面ID)"""
+    if page_index is not None:
+        entry = page_index.get(bookId)
+        if entry is not None:
+            return False, entry["page_id"]
+        if page_index.is_missing(bookId):
+            return False, None
+    return True, None
+
+
+def remember_page(page_index, bookId, page_ids):
+    """把查询Notion得到的页面记到索引中，返回第一个页面ID"""
+    page_id = page_ids[0] if page_ids else None
+    if page_index is not None:
+        if page_id is None:
+            page_index.remove(bookId)
+        else:
+            entry = page_index.get(bookId, fresh=False) or {}
+            page_index.put(
+                bookId, page_id, entry.get("sort"), entry.get("hash"), entry.get("fingerprint")
+            )
+    return page_id
+
+
+def lookup_pages_to_delete(page_index, bookId):
+    """重建页面前要删除的页面ID，索引中没有记录、需要查询Notion时返回None"""
+    entry = page_index.get(bookId) if page_index is not None else None
+    if entry is not None:
+        return [entry["page_id"]] + entry.get("duplicates", [])
+    if page_index is not None and page_index.is_missing(bookId):
+        return []
+    return None
+
+
+def record_book(page_index, journal, bookId, page_id, sort, fingerprint, entries):
+    """一本书写完后更新索引和写入日志，entries为None表示内容没有完整写入"""
+    if page_index is not None:
+        # 内容没有完整写入时不记录sort，下次运行会从写入日志继续
+        if entries is None:
+            page_index.put(bookId, page_id)
+        else:
+            page_index.put(bookId, page_id, sort, get_content_hash(entries), fingerprint)
+    if entries is not None and journal is not None:
+        journal.finish(bookId)
+
+
+def get_query_body(start_cursor=None):
+    """分页查询数据库或者列出子块时每一页的参数"""
+    body = {"page_size": 100}
+    if start_cursor is not None:
+        body["start_cursor"] = start_cursor
+    return body
+
+
+def get_filter_properties(properties, names):
+    """查询数据库时只取names中的属性，properties为数据源的属性，取不到时返回None"""
+    if properties is None:
+        return None
+    ids = [properties[name]["id"] for name in names if name in properties]
+    return {"filter_properties": ids} if ids else None
@@ -0,0 +1,133 @@
+import importlib.util
+import sys
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import get_notion_endpoint
+
+# 微信读书和Notion共用的连接池和超时设置
+# requests默认每个主机只保留10个连接，并行的请求超过10个时多出的连接用完就关闭，下次请求重新握手。
+# 这里按并发数设置连接池大小，所有并行的请求都能复用已经完成TLS握手的长连接。
+
+DEFAULT_POOL_SIZE = 10
+# requests会话连接的主机，每个主机保留一个连接池；Notion使用httpx，不在其中
+POOL_HOST_NAMES = ("微信读书", "CookieCloud")
+POOL_HOSTS = len(POOL_HOST_NAMES)
+# 空闲的长连接保留的秒数
+KEEPALIVE_EXPIRY = 60
+CONNECT_TIMEOUT = 5
+# 连接池中没有空闲连接时最多等待的秒数
+POOL_TIMEOUT = 30
+
+# 微信读书各个接口的读取超时（秒），笔记本列表和划线列表可能很大
+WEREAD_TIMEOUTS = {
+    "/": 15,
+    "/api/user/notebook": 30,
+    "/web/book/bookmarklist": 30,
+    "/web/review/list": 30,
+    "/web/book/chapterInfos": 20,
+    "/web/book/info": 15,
+    "/web/book/readinfo": 15,
+}
+WEREAD_READ_TIMEOUT = 30
+# Notion各个接口的读取超时（秒），添加内容块和新建页面的请求体最大500KB，需要的时间最长。
+# GET和DELETE超时后会重试，超时短一些可以更快地重试
+NOTION_TIMEOUTS = {
+    "GET databases/{id}": 20,
+    "GET data_sources/{id}": 20,
+    "GET blocks/{id}/children": 30,
+    "DELETE blocks/{id}": 20,
+    "POST data_sources/{id}/query": 60,
+    "POST pages": 90,
+    "PATCH pages/{id}": 60,
+    "PATCH blocks/{id}": 60,
+    "PATCH blocks/{id}/children": 90,
+}
+NOTION_READ_TIMEOUT = 60
+# CookieCloud的超时
+COOKIE_CLOUD_TIMEOUT = (CONNECT_TIMEOUT, 30)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+_http2_warned = False
+
+
+def get_pool_size(concurrency):
+    """连接池大小，不少于同时进行的请求数"""
+    return max(DEFAULT_POOL_SIZE, int(concurrency or 0))
+
+
+def get_weread_timeout(url):
+    """微信读书接口的(连接超时, 读取超时)，requests可以直接使用"""
+    return CONNECT_TIMEOUT, WEREAD_TIMEOUTS.get(urlparse(url).path, WEREAD_READ_TIMEOUT)
+
+
+def get_notion_timeout(method, path):
+    """Notion接口的(连接超时, 读取超时)，path为notion_client的相对路径，例如blocks/{id}/children"""
+    return CONNECT_TIMEOUT, NOTION_TIMEOUTS.get(get_notion_endpoint(method, path), NOTION_READ_TIMEOUT)
+
+
+def get_httpx_timeout(timeout):
+    """把(连接超时, 读取超时)转换为httpx.Timeout，写入超时和读取超时相同"""
+    import httpx
+
+    connect, read = timeout
+    return httpx.Timeout(read, connect=connect, pool=POOL_TIMEOUT)
+
+
+def mount_pool(session, pool_size=DEFAULT_POOL_SIZE):
+    """给requests.Session换上按pool_size设置的连接池"""
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session():
+    """其他请求（例如CookieCloud）共用的requests.Session，多个账号获取Cookie时复用连接"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = mount_pool(requests.Session())
+        return _http_session
+
+
+def get_limits(pool_size):
+    import httpx
+
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def get_transport(pool_size=DEFAULT_POOL_SIZE, http2=False):
+    """同步的httpx连接池，用于Notion的同步客户端"""
+    import httpx
+
+    return httpx.HTTPTransport(limits=get_limits(pool_size), http2=use_http2(http2))
+
+
+def get_async_transport(pool_size=DEFAULT_POOL_SIZE, http2=False):
+    """异步的httpx连接池，微信读书和Notion的异步客户端以及多个账号都可以共用"""
+    import httpx
+
+    return httpx.AsyncHTTPTransport(limits=get_limits(pool_size), http2=use_http2(http2))
+
+
+def use_http2(http2):
+    """需要HTTP/2并且安装了h2时返回True，没有安装时提示并使用HTTP/1.1"""
+    global _http2_warned
+    if not http2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        if not _http2_warned:
+            _http2_warned = True
+            print("⚠️  使用 HTTP/2 需要安装 h2（pip install httpx[http2]），改为使用 HTTP/1.1")
+            sys.stdout.flush()
+        return False
+    return True
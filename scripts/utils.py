@@ -1,3 +1,8 @@
+# Notion中每段文字最多2000个字符，每个块最多100段
+TEXT_LIMIT = 2000
+SEGMENT_LIMIT = 100
+
+
 def get_heading(level, content):
     if level == 1:
         heading = "heading_1"
@@ -31,6 +36,14 @@ def get_title(content):
     return {"title": [{"type": "text", "text": {"content": content}}]}
 
 
+def get_text_segments(content):
+    """把内容按TEXT_LIMIT拆成多段rich_text，空字符串也返回一段"""
+    return [
+        {"type": "text", "text": {"content": content[i : i + TEXT_LIMIT]}}
+        for i in range(0, max(len(content), 1), TEXT_LIMIT)
+    ]
+
+
 def get_rich_text(content):
     return {"rich_text": [{"type": "text", "text": {"content": content}}]}
 
@@ -72,12 +85,7 @@ def get_quote(content):
     return {
         "type": "quote",
         "quote": {
-            "rich_text": [
-                {
-                    "type": "text",
-                    "text": {"content": content},
-                }
-            ],
+            "rich_text": get_text_segments(content),
             "color": "default",
         },
     }
@@ -108,14 +116,7 @@ def get_callout(content, style, colorStyle, reviewId):
     return {
         "type": "callout",
         "callout": {
-            "rich_text": [
-                {
-                    "type": "text",
-                    "text": {
-                        "content": content,
-                    },
-                }
-            ],
+            "rich_text": get_text_segments(content),
             "icon": {"emoji": emoji},
             "color": color,
         },
@@ -1,49 +1,93 @@
 import argparse
-import json
+import asyncio
+import atexit
 import logging
 import os
 import re
 import sys
-import time
-from notion_client import Client
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from requests.utils import cookiejar_from_dict
 from http.cookies import SimpleCookie
-from datetime import datetime
-import hashlib
 from dotenv import load_dotenv
-import os
-from retrying import retry
 
 # 强制刷新输出，确保在GitHub Actions中能看到实时日志
 sys.stdout.reconfigure(line_buffering=True) if hasattr(sys.stdout, 'reconfigure') else None
-from utils import (
-    get_callout,
-    get_date,
-    get_file,
-    get_heading,
-    get_icon,
-    get_multi_select,
-    get_number,
-    get_quote,
-    get_rich_text,
-    get_select,
-    get_table_of_contents,
-    get_title,
-    get_url,
+from weread_api import (
+    BOOKMARKLIST_HEADERS,
+    CHAPTER_INFO_HEADERS,
+    HEADERS,
+    WEREAD_BOOK_INFO,
+    WEREAD_BOOKMARKLIST_URL,
+    WEREAD_CHAPTER_INFO,
+    WEREAD_NOTEBOOKS_URL,
+    WEREAD_READ_INFO_URL,
+    WEREAD_REVIEW_LIST_URL,
+    WEREAD_URL,
+    CHAPTER_BATCH_SIZE,
+    check_status,
+    compact_notebook,
+    get_bookmark_list_params,
+    get_fingerprint,
+    get_read_info_params,
+    get_review_list_params,
+    parse_bookinfo,
+    parse_notebooklist,
+    parse_read_info,
+)
+from book import (
+    get_block_entries,
+    get_children,
+    get_page_properties,
+    iter_batches,
+    iter_children,
+    merge_bookmarks,
+    split_blocks,
+)
+from pipeline import iter_groups, pipelined
+from retry_policy import RetryPolicy
+from weread_session import WeReadSession
+from cache import BOOKINFO_TTL, BookCache
+from block_diff import get_content_hash
+from sync_plan import (
+    BlockSync,
+    BookmarkFetch,
+    ChapterFetch,
+    ReviewFetch,
+    drop_resume,
+    get_filter_properties,
+    get_query_body,
+    lookup_page,
+    lookup_pages_to_delete,
+    plan_resume,
+    record_book,
+    remember_page,
 )
+from notion_index import INDEX_PROPERTIES, NotionIndex, get_index_pages
+from metrics import Metrics
+from export import ExportWriter, read_export
+from journal import WriteJournal
+from transport import COOKIE_CLOUD_TIMEOUT, get_async_transport, get_http_session, get_pool_size, get_transport
+from accounts import interleave, load_accounts
+from cookie_store import COOKIE_KEY_ENV, get_cookie_source, get_cookie_store
+from preflight import print_preflight, run_preflight
 load_dotenv()
-WEREAD_URL = "https://weread.qq.com/"
-WEREAD_NOTEBOOKS_URL = "https://weread.qq.com/api/user/notebook"
-WEREAD_BOOKMARKLIST_URL = "https://weread.qq.com/web/book/bookmarklist"
-WEREAD_CHAPTER_INFO = "https://weread.qq.com/web/book/chapterInfos"
-WEREAD_READ_INFO_URL = "https://weread.qq.com/web/book/readinfo"
-WEREAD_REVIEW_LIST_URL = "https://weread.qq.com/web/review/list"
-WEREAD_BOOK_INFO = "https://weread.qq.com/web/book/info"
 
 # 全局变量
 database_id = None  # 数据库ID，用于创建页面
 data_source_id = None  # 数据源ID，用于查询
+cache = None  # 本地接口缓存，为None时不使用缓存
+page_index = None  # bookId到Notion页面的本地索引，为None时每次都查询Notion
+journal = None  # 新建页面的预写日志，为None时中断后需要重新写入整个页面
+
+# 设置必要的请求头，模拟浏览器行为
+SESSION_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Referer': 'https://weread.qq.com/',
+    'Origin': 'https://weread.qq.com'
+}
 
 
 def parse_cookie_string(cookie_string):
@@ -70,84 +114,42 @@ def parse_cookie_string(cookie_string):
     
     return cookiejar
 
-def refresh_token(exception):
-    session.get(WEREAD_URL)
-    return True
-
-@retry(stop_max_attempt_number=3, wait_fixed=5000,retry_on_exception=refresh_token)
-def get_bookmark_list(bookId):
-    """获取我的划线"""
-    session.get(WEREAD_URL)
-    params = dict(bookId=bookId)
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'application/json, text/plain, */*',
-        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-        'Referer': 'https://weread.qq.com/',
-        'Origin': 'https://weread.qq.com',
-        'Connection': 'keep-alive',
-        'Sec-Fetch-Dest': 'empty',
-        'Sec-Fetch-Mode': 'cors',
-        'Sec-Fetch-Site': 'same-origin'
-    }
-    r = session.get(WEREAD_BOOKMARKLIST_URL, params=params, headers=headers)
-    if r.ok:
+# 微信读书请求的重试策略，按错误类别退避，接口故障时熔断
+retry_policy = RetryPolicy()
+
+
+def refresh_token():
+    session.refresh()
+
+@retry_policy.wrap(WEREAD_BOOKMARKLIST_URL, on_auth=refresh_token)
+def get_bookmark_list(bookId, fingerprint=None):
+    """获取我的划线，指纹与缓存中的一致时直接使用缓存，否则用synckey只获取变化的部分"""
+    fetch = BookmarkFetch(cache, bookId, fingerprint)
+    while not fetch.done:
+        params = get_bookmark_list_params(bookId, fetch.synckey)
+        r = session.get(WEREAD_BOOKMARKLIST_URL, params=params, headers=BOOKMARKLIST_HEADERS)
+        check_status(r)
+        if not r.ok:
+            return []
         data = r.json()
-        # 检查是否有错误码
-        if data.get("errCode") != 0 and "errCode" in data:
-            # 打印详细的错误信息用于调试
-            if data.get("errCode") == -2012:
-                print(f"  调试: bookmarklist API失败")
-                print(f"  请求URL: {r.url}")
-                print(f"  响应: {data}")
-                cookie_names = [c.name for c in session.cookies]
-                print(f"  Cookie字段: {cookie_names}")
-                sys.stdout.flush()
-            raise Exception(data.get('errMsg', '登录超时'))
-        updated = data.get("updated")
-        
-        # 添加调试信息
-        if updated is None:
-            print(f"  [DEBUG] bookmarklist API返回updated=None, bookId={bookId}")
-            print(f"  [DEBUG] 完整响应: {data}")
-            sys.stdout.flush()
-        elif not isinstance(updated, list):
-            print(f"  [DEBUG] bookmarklist API返回updated类型错误: {type(updated)}, bookId={bookId}")
-            sys.stdout.flush()
-        elif len(updated) == 0:
-            print(f"  [DEBUG] bookmarklist API返回空列表, bookId={bookId}")
-            print(f"  [DEBUG] 响应keys: {list(data.keys())}")
+        # 打印详细的错误信息用于调试
+        if data.get("errCode") == -2012:
+            print(f"  调试: bookmarklist API失败")
+            print(f"  请求URL: {r.url}")
+            print(f"  响应: {data}")
+            cookie_names = [c.name for c in session.cookies]
+            print(f"  Cookie字段: {cookie_names}")
             sys.stdout.flush()
-        
-        if updated is None or not isinstance(updated, list):
-            return []
-        updated = sorted(
-            updated,
-            key=lambda x: (x.get("chapterUid", 1), int(x.get("range", "0-0").split("-")[0])),
-        )
-        return updated
-    return []
+        fetch.feed(data)
+    return fetch.result()
 
 def get_read_info(bookId):
     """获取阅读信息 - 如果失败返回None而不中断流程"""
     try:
-        session.get(WEREAD_URL)
-        params = dict(bookId=bookId, readingDetail=1, readingBookIndex=1, finishedDate=1)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Referer': 'https://weread.qq.com/',
-        }
-        r = session.get(WEREAD_READ_INFO_URL, params=params, headers=headers)
+        params = get_read_info_params(bookId)
+        r = session.get(WEREAD_READ_INFO_URL, params=params, headers=HEADERS)
         if r.ok:
-            data = r.json()
-            # 如果返回登录超时错误（-2012），返回None
-            if data.get("errCode") == -2012:
-                return None
-            if data.get("errCode") != 0 and "errCode" in data:
-                print(f"  [DEBUG] get_read_info 其他错误: errCode={data.get('errCode')}, errMsg={data.get('errMsg')}")
-                sys.stdout.flush()
-                return None
-            return data
+            return parse_read_info(r.json())
         return None
     except Exception as e:
         print(f"  [提示] 获取阅读信息异常: {e}")
@@ -156,29 +158,20 @@ def get_read_info(bookId):
 
 def get_bookinfo(bookId):
     """获取书的详情"""
+    if cache is not None:
+        cached = cache.get(bookId, "bookinfo", ttl=BOOKINFO_TTL)
+        if cached is not None:
+            return tuple(cached)
     try:
-        session.get(WEREAD_URL)
         params = dict(bookId=bookId)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Referer': 'https://weread.qq.com/',
-        }
-        r = session.get(WEREAD_BOOK_INFO, params=params, headers=headers)
-        isbn = ""
+        r = session.get(WEREAD_BOOK_INFO, params=params, headers=HEADERS)
         if r.ok:
-            data = r.json()
-            # 如果返回登录超时错误（-2012），返回默认值而不是抛出异常
-            if data.get("errCode") == -2012:
-                print(f"  [提示] 获取书籍详情失败（权限不足），使用默认值")
-                sys.stdout.flush()
+            bookinfo = parse_bookinfo(r.json())
+            if bookinfo is None:
                 return ("", 0)
-            if data.get("errCode") != 0 and "errCode" in data:
-                print(f"  [DEBUG] get_bookinfo 其他错误: errCode={data.get('errCode')}, errMsg={data.get('errMsg')}")
-                sys.stdout.flush()
-                return ("", 0)
-            isbn = data.get("isbn","")
-            newRating = data.get("newRating", 0) / 1000
-            return (isbn, newRating)
+            if cache is not None:
+                cache.set(bookId, "bookinfo", list(bookinfo))
+            return bookinfo
         else:
             print(f"  [提示] 获取书籍详情HTTP失败, status={r.status_code}")
             return ("", 0)
@@ -187,150 +180,134 @@ def get_bookinfo(bookId):
         sys.stdout.flush()
         return ("", 0)
 
-@retry(stop_max_attempt_number=3, wait_fixed=5000,retry_on_exception=refresh_token)
-def get_review_list(bookId):
-    """获取笔记"""
-    session.get(WEREAD_URL)
-    params = dict(bookId=bookId, listType=11, mine=1, syncKey=0)
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Referer': 'https://weread.qq.com/',
-    }
-    r = session.get(WEREAD_REVIEW_LIST_URL, params=params, headers=headers)
-    data = r.json()
-    # 如果是登录超时，返回空数据而不是抛出异常
-    if data.get("errCode") == -2012:
-        print(f"  [DEBUG] review_list API登录超时, bookId={bookId}")
-        sys.stdout.flush()
-        return [], []
-    if data.get("errCode") != 0 and "errCode" in data:
-        raise Exception(data.get('errMsg', '登录超时'))
-    reviews = data.get("reviews")
-    if not reviews:
-        print(f"  [DEBUG] review_list API返回空reviews, bookId={bookId}")
-        print(f"  [DEBUG] 响应keys: {list(data.keys())}")
-        sys.stdout.flush()
-        return [], []
-    summary = list(filter(lambda x: x.get("review").get("type") == 4, reviews))
-    reviews = list(filter(lambda x: x.get("review").get("type") == 1, reviews))
-    reviews = list(map(lambda x: x.get("review"), reviews))
-    reviews = list(map(lambda x: {**x, "markText": x.pop("content")}, reviews))
-    return summary, reviews
+@retry_policy.wrap(WEREAD_REVIEW_LIST_URL, on_auth=refresh_token)
+def get_review_list(bookId, fingerprint=None):
+    """获取笔记，指纹与缓存中的一致时直接使用缓存，否则用synckey只获取变化的部分"""
+    fetch = ReviewFetch(cache, bookId, fingerprint)
+    while not fetch.done:
+        params = get_review_list_params(bookId, fetch.synckey)
+        r = session.get(WEREAD_REVIEW_LIST_URL, params=params, headers=HEADERS)
+        check_status(r)
+        fetch.feed(r.json())
+    return fetch.result()
 
 
 def check_exists(bookId):
     """检查书籍是否已存在，不删除"""
+    return find_page(bookId) is not None
+
+
+def find_page(bookId):
+    """返回书籍对应的页面ID，不存在时返回None
+
+    优先使用本地索引，索引中没有或者已经过期时才查询Notion。
+    """
+    query, page_id = lookup_page(page_index, bookId)
+    if not query:
+        return page_id
+    return remember_page(page_index, bookId, query_page_ids(bookId))
+
+
+def query_page_ids(bookId):
+    """查询Notion中书籍对应的全部页面ID"""
     filter = {"property": "BookId", "rich_text": {"equals": bookId}}
     response = client.request(
         path=f"data_sources/{data_source_id}/query",
         method="POST",
         body={"filter": filter}
     )
-    return len(response["results"]) > 0
+    return [result["id"] for result in response["results"]]
 
 def delete_book(bookId):
     """删除已存在的书籍"""
-    filter = {"property": "BookId", "rich_text": {"equals": bookId}}
-    response = client.request(
-        path=f"data_sources/{data_source_id}/query",
-        method="POST",
-        body={"filter": filter}
-    )
-    for result in response["results"]:
+    page_ids = lookup_pages_to_delete(page_index, bookId)
+    if page_ids is None:
+        page_ids = query_page_ids(bookId)
+    for page_id in page_ids:
         try:
-            client.blocks.delete(block_id=result["id"])
+            client.blocks.delete(block_id=page_id)
         except Exception as e:
             print(f"删除块时出错: {e}")
+    if page_index is not None:
+        page_index.remove(bookId)
 
-@retry(stop_max_attempt_number=3, wait_fixed=5000,retry_on_exception=refresh_token)
 def get_chapter_info(bookId):
-    """获取章节信息"""
-    session.get(WEREAD_URL)
-    body = {"bookIds": [bookId], "synckeys": [0], "teenmode": 0}
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Content-Type': 'application/json',
-        'Referer': 'https://weread.qq.com/',
-    }
-    r = session.post(WEREAD_CHAPTER_INFO, json=body, headers=headers)
-    if r.ok:
-        data = r.json()
-        # 如果是登录超时，返回None
-        if data.get("errCode") == -2012:
-            return None
-        if data.get("errCode") != 0 and "errCode" in data:
-            raise Exception(data.get('errMsg', '登录超时'))
-        if (
-            "data" in data
-            and len(data["data"]) == 1
-            and "updated" in data["data"][0]
-        ):
-            update = data["data"][0]["updated"]
-            return {item["chapterUid"]: item for item in update}
-    return None
+    """获取一本书的章节信息"""
+    return get_chapter_infos([bookId]).get(bookId)
+
+
+@retry_policy.wrap(WEREAD_CHAPTER_INFO, on_auth=refresh_token)
+def get_chapter_infos(bookIds):
+    """一次请求获取多本书的章节信息，返回{bookId: 章节dict或None}
+
+    缓存中没有过期的书籍不请求，缓存过期后用synckey只获取变化的部分。
+    """
+    fetch = ChapterFetch(cache, bookIds)
+    if not fetch.items:
+        return fetch.result
+    r = session.post(WEREAD_CHAPTER_INFO, json=fetch.body(), headers=CHAPTER_INFO_HEADERS)
+    check_status(r)
+    return fetch.feed(r.json() if r.ok else None)
+
 
+class ChapterFuture:
+    """批量章节请求中一本书的结果，和Future一样用result()取值
 
-def insert_to_notion(bookName, bookId, cover, sort, author, isbn, rating, categories):
-    """插入到notion"""
-    if not cover or not cover.startswith("http"):
-        cover = "https://www.notion.so/icons/book_gray.svg"
+    整批请求失败时单独请求这本书，一本书的问题不会让同一批的其他书籍失败。
+    """
+
+    def __init__(self, batch, bookId):
+        self.batch = batch
+        self.bookId = bookId
+
+    def result(self):
+        try:
+            chapters = self.batch.result()
+        except Exception:
+            return get_chapter_info(self.bookId)
+        # 同一批的每本书只取一次，取走后释放
+        return chapters.pop(self.bookId, None)
+
+
+def insert_to_notion(bookName, bookId, cover, sort, author, isbn, rating, categories, read_info=None):
+    """插入到notion，read_info为None时表示阅读信息获取失败"""
+    properties, icon = get_page_properties(
+        bookName, bookId, cover, sort, author, isbn, rating, categories, read_info
+    )
+    return create_page(properties, icon)
+
+
+def create_page(properties, icon):
+    """在数据库中创建页面，返回页面ID"""
     parent = {"database_id": database_id, "type": "database_id"}
-    properties = {
-        "BookName": get_title(bookName),
-        "BookId": get_rich_text(bookId),
-        "ISBN": get_rich_text(isbn),
-        "URL": get_url(
-            f"https://weread.qq.com/web/reader/{calculate_book_str_id(bookId)}"
-        ),
-        "Author": get_rich_text(author),
-        "Sort": get_number(sort),
-        "Rating": get_number(rating),
-        "Cover": get_file(cover),
-    }
-    if categories != None:
-        properties["Categories"] = get_multi_select(categories)
-    read_info = get_read_info(bookId=bookId)
-    if read_info != None:
-        markedStatus = read_info.get("markedStatus", 0)
-        readingTime = read_info.get("readingTime", 0)
-        readingProgress = read_info.get("readingProgress", 0)
-        format_time = ""
-        hour = readingTime // 3600
-        if hour > 0:
-            format_time += f"{hour}时"
-        minutes = readingTime % 3600 // 60
-        if minutes > 0:
-            format_time += f"{minutes}分"
-        properties["Status"] = get_select("读完" if markedStatus == 4 else "在读")
-        properties["ReadingTime"] = get_rich_text(format_time)
-        properties["Progress"] = get_number(readingProgress)
-        if "finishedDate" in read_info:
-            properties["Date"] = get_date(
-                datetime.utcfromtimestamp(read_info.get("finishedDate")).strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                )
-            )
+    response = client.pages.create(parent=parent, icon=icon, cover=icon, properties=properties)
+    return response["id"]
 
-    icon = get_icon(cover)
-    # notion api 限制100个block
-    response = client.pages.create(parent=parent, icon=icon,cover=icon, properties=properties)
-    id = response["id"]
-    return id
+
+def update_page(page_id, bookName, bookId, cover, sort, author, isbn, rating, categories, read_info=None):
+    """更新已有页面的属性，页面ID保持不变"""
+    properties, icon = get_page_properties(
+        bookName, bookId, cover, sort, author, isbn, rating, categories, read_info
+    )
+    client.pages.update(page_id=page_id, icon=icon, cover=icon, properties=properties)
 
 
-def add_children(id, children):
+def add_children(id, children, after=None):
+    """添加子块，after不为None时插入到该块之后"""
     if not children or len(children) == 0:
         return []
     results = []
-    for i in range(0, len(children) // 100 + 1):
-        batch = children[i * 100 : (i + 1) * 100]
-        if not batch:  # 跳过空批次
-            continue
-        time.sleep(0.3)
+    for batch in split_blocks(children):
         try:
-            response = client.blocks.children.append(
-                block_id=id, children=batch
-            )
+            if after is None:
+                response = client.blocks.children.append(
+                    block_id=id, children=batch
+                )
+            else:
+                response = client.blocks.children.append(
+                    block_id=id, children=batch, after=after
+                )
+                after = response.get("results")[-1]["id"]
             results.extend(response.get("results"))
         except Exception as e:
             print(f"添加blocks失败: {e}")
@@ -338,36 +315,231 @@ def add_children(id, children):
     return results if len(results) == len(children) else None
 
 
-def add_grandchild(grandchild, results):
-    for key, value in grandchild.items():
-        time.sleep(0.3)
-        id = results[key].get("id")
-        client.blocks.children.append(block_id=id, children=[value])
+def append_blocks(page_id, batches, bookId=None, start=0):
+    """边生成边添加内容块，返回(entries, ids)，添加失败时返回None
 
+    batches为iter_batches产出的[(block, key)]，在后台线程中生成，
+    第一批添加到Notion的同时后面的章节还在生成，内存中最多只有几批内容块。
+    bookId不为None时每添加一批都记录到写入日志，start为日志中已有的批数。
+    """
+    entries = []
+    ids = []
+    for index, batch in enumerate(pipelined(batches), start):
+        blocks = [block for block, _ in batch]
+        results = add_children(page_id, blocks)
+        if results is None:
+            return None
+        batch_entries = get_block_entries(blocks, [key for _, key in batch])
+        batch_ids = [result["id"] for result in results]
+        if journal is not None and bookId is not None:
+            journal.commit_batch(bookId, index, batch_entries, batch_ids)
+        entries.extend(batch_entries)
+        ids.extend(batch_ids)
+    return entries, ids
 
-def get_notebooklist():
-    """获取笔记本列表"""
-    session.get(WEREAD_URL)
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Referer': 'https://weread.qq.com/',
-    }
-    r = session.get(WEREAD_NOTEBOOKS_URL, headers=headers)
-    if r.ok:
-        data = r.json()
-        # 检查是否有错误码
-        if "errCode" in data and data.get("errCode") != 0:
-            print(f"获取笔记本列表失败: {data}")
+
+def resume_page(bookId, fingerprint, page_fields, content):
+    """继续写入日志中上次没有写完的页面，返回(page_id, 剩下的(block, key), 日志记录)
+
+    没有日志记录时返回None。书籍内容有变化或者页面已经不存在时删除没写完的页面，
+    同样返回None，需要重新创建页面。
+    """
+    state, children = plan_resume(journal, bookId, fingerprint, content)
+    if state is None:
+        return None
+    if children is not None:
+        try:
+            # 顺便确认页面还存在
+            update_page(state["page_id"], *page_fields)
+            print(f"  - 继续上次没有完成的写入，已添加 {len(state['entries'])} 个内容块")
             sys.stdout.flush()
-            return None
-        books = data.get("books")
-        if books:
-            books.sort(key=lambda x: x["sort"])
-            return books
+            return state["page_id"], children, state
+        except Exception as e:
+            print(f"  [提示] 无法继续上次的写入: {e}")
+            sys.stdout.flush()
+    try:
+        client.blocks.delete(block_id=state["page_id"])
+    except Exception as e:
+        print(f"删除块时出错: {e}")
+    drop_resume(journal, page_index, bookId, state)
+    return None
+
+
+def update_existing_page(bookId, page_fields):
+    """增量同步时更新已有页面的属性，返回页面ID，页面不存在时返回None"""
+    page_id = find_page(bookId)
+    if page_id is None:
+        return None
+    try:
+        update_page(page_id, *page_fields)
+        return page_id
+    except Exception:
+        if page_index is None:
+            raise
+        # 本地索引中的页面可能已经在Notion中被删除，查询Notion后再试一次
+        page_index.remove(bookId)
+    page_id = find_page(bookId)
+    if page_id is not None:
+        update_page(page_id, *page_fields)
+    return page_id
+
+
+def save_block_state(bookId, page_id, entries, ids):
+    """保存页面上每个块的标识和block_id，下次增量同步时使用"""
+    if cache is not None:
+        cache.set_block_state(bookId, page_id, entries, ids)
+
+
+def list_blocks(page_id):
+    """分页读取页面下的全部子块"""
+    blocks = []
+    start_cursor = None
+    while True:
+        response = client.blocks.children.list(block_id=page_id, **get_query_body(start_cursor))
+        blocks.extend(response.get("results"))
+        if not response.get("has_more"):
+            break
+        start_cursor = response.get("next_cursor")
+    return blocks
+
+
+def sync_blocks(bookId, page_id, children, keys):
+    """增量同步页面内容：只追加新的块、更新修改过的块、删除已经不存在的块
+
+    通过划线的bookmarkId和笔记的reviewId找到页面上对应的块，页面本身不会删除重建，
+    页面ID和其他页面对它的引用保持不变。没有上次同步的记录时读取页面上现有的块，按内容对应后
+    同样只修改有变化的块。返回(新增数, 更新数, 删除数)。
+    """
+    state = cache.get_block_state(bookId, page_id) if cache is not None else None
+    listed = list_blocks(page_id) if state is None else None
+    plan = BlockSync(children, keys, state, listed)
+    # 中途失败时页面和记录不一致，清掉记录让下次同步重建页面
+    save_block_state(bookId, None, [], [])
+    for block_id, content in plan.update:
+        client.blocks.update(block_id=block_id, **content)
+    for after, blocks, indexes in plan.inserts():
+        results = add_children(page_id, blocks, after=after)
+        if results is None:
+            raise Exception("添加内容块失败")
+        plan.inserted(indexes, results)
+    # 插到最前面的块以要删除的块定位，插入之后再删除
+    for block_id in plan.delete:
+        client.blocks.delete(block_id=block_id)
+    save_block_state(bookId, page_id, plan.entries, plan.ids)
+    return plan.counts()
+
+
+def write_book(bookId, sort, fingerprint, page_fields, content, incremental=False):
+    """把一本书写入Notion，content为生成页面内容需要的(chapter, summary, bookmark_list)
+
+    incremental为True并且页面已经存在时只修改有变化的块，否则删除后重新创建页面。
+    """
+    page_id = None
+    # 有没写完的页面时优先继续写入，不做增量同步
+    if incremental and (journal is None or journal.get(bookId) is None):
+        page_id = update_existing_page(bookId, page_fields)
+    if page_id is not None:
+        # 增量同步需要和上次的全部块对比，一次生成全部内容
+        children, keys = get_children(*content)
+        print(f"  - 生成了 {len(children)} 个内容块")
+        sys.stdout.flush()
+        entries = get_block_entries(children, keys)
+        inserted, updated, deleted = sync_blocks(bookId, page_id, children, keys)
+        print(f"  - 增量同步: 新增 {inserted}，更新 {updated}，删除 {deleted} 个内容块")
+        sys.stdout.flush()
+    else:
+        resumed = resume_page(bookId, fingerprint, page_fields, content)
+        if resumed is not None:
+            page_id, children, state = resumed
+            entries, ids, start = list(state["entries"]), list(state["ids"]), state["batches"]
         else:
-            print("警告: 返回的书籍列表为空")
+            # 删除已存在的书籍（如果有）
+            delete_book(bookId)
+            page_id = insert_to_notion(*page_fields)
+            if journal is not None:
+                journal.start(bookId, page_id, sort, fingerprint)
+            children, entries, ids, start = iter_children(*content), [], [], 0
+        appended = append_blocks(page_id, iter_batches(children), bookId, start)
+        if appended is None:
+            print(f"  ⚠️  添加内容块时出现问题")
             sys.stdout.flush()
-            return []
+            entries = None
+        else:
+            entries.extend(appended[0])
+            ids.extend(appended[1])
+            print(f"  - 添加了 {len(appended[0])} 个内容块，共 {len(entries)} 个")
+            sys.stdout.flush()
+            save_block_state(bookId, page_id, entries, ids)
+    record_book(page_index, journal, bookId, page_id, sort, fingerprint, entries)
+
+
+def replay_export(path):
+    """把--export导出的文件写入Notion，返回(成功数, 失败数)
+
+    文件中每本书是一行page、若干行blocks和一行end。没有end的书籍（导出时中断）
+    和写入失败的书籍都算作失败，索引中不记录sort，下次运行会重新同步。
+    """
+    success = 0
+    fail = 0
+    current = None
+    for record in read_export(path):
+        kind = record.get("type")
+        if kind == "page":
+            if current is not None:
+                print(f"  ✗ 导出文件中《{current['title']}》不完整")
+                page_index.put(current["bookId"], current["page_id"])
+                fail += 1
+            current = None
+            bookId = record["bookId"]
+            print(f"正在写入《{record.get('title')}》...")
+            sys.stdout.flush()
+            try:
+                delete_book(bookId)
+                page_id = create_page(record["properties"], record["icon"])
+            except Exception as e:
+                print(f"  ✗ 失败: {e}")
+                fail += 1
+                continue
+            current = dict(record, page_id=page_id, entries=[], ids=[])
+        elif current is None:
+            # 失败的书籍剩下的内容直接跳过
+            continue
+        elif kind == "blocks":
+            results = add_children(current["page_id"], record["children"])
+            if results is None:
+                print(f"  ✗ 失败: 添加内容块失败")
+                page_index.put(current["bookId"], current["page_id"])
+                fail += 1
+                current = None
+                continue
+            current["entries"].extend(get_block_entries(record["children"], record["keys"]))
+            current["ids"].extend(result["id"] for result in results)
+        elif kind == "end":
+            entries = current["entries"]
+            save_block_state(current["bookId"], current["page_id"], entries, current["ids"])
+            page_index.put(
+                current["bookId"],
+                current["page_id"],
+                current["sort"],
+                get_content_hash(entries),
+                current["fingerprint"],
+            )
+            print(f"  ✓ 成功，添加了 {len(entries)} 个内容块")
+            sys.stdout.flush()
+            success += 1
+            current = None
+    if current is not None:
+        print(f"  ✗ 导出文件中《{current['title']}》不完整")
+        page_index.put(current["bookId"], current["page_id"])
+        fail += 1
+    return success, fail
+
+
+def get_notebooklist():
+    """获取笔记本列表"""
+    r = session.get(WEREAD_NOTEBOOKS_URL, headers=HEADERS)
+    if r.ok:
+        return parse_notebooklist(r.json())
     else:
         print(f"请求失败，状态码: {r.status_code}")
         print(f"响应内容: {r.text[:500]}")
@@ -375,129 +547,352 @@ def get_notebooklist():
     return None
 
 
-def get_sort():
-    """获取database中的最新时间"""
-    filter = {"property": "Sort", "number": {"is_not_empty": True}}
-    sorts = [
-        {
-            "property": "Sort",
-            "direction": "descending",
-        }
-    ]
-    response = client.request(
-        path=f"data_sources/{data_source_id}/query",
-        method="POST",
-        body={"filter": filter, "sorts": sorts, "page_size": 1}
+def submit_book_fetch(executor, bookId, fingerprint, chapters=None):
+    """提交一本书需要的全部微信读书请求，这些接口互不依赖，可以并行获取
+
+    chapters为批量获取章节信息的Future，为None时单独请求这本书的章节。
+    """
+    return {
+        "bookinfo": executor.submit(get_bookinfo, bookId),
+        "read_info": executor.submit(get_read_info, bookId),
+        "chapter": (
+            executor.submit(get_chapter_info, bookId) if chapters is None else ChapterFuture(chapters, bookId)
+        ),
+        "bookmark_list": executor.submit(get_bookmark_list, bookId, fingerprint),
+        "review_list": executor.submit(get_review_list, bookId, fingerprint),
+    }
+
+
+def resolve_book_fetch(futures):
+    """等待一本书的全部请求完成，接口抛出的异常会在这里重新抛出"""
+    isbn, rating = futures["bookinfo"].result()
+    summary, reviews = futures["review_list"].result()
+    return {
+        "isbn": isbn,
+        "rating": rating,
+        "read_info": futures["read_info"].result(),
+        "chapter": futures["chapter"].result(),
+        "bookmark_list": futures["bookmark_list"].result(),
+        "summary": summary,
+        "reviews": reviews,
+    }
+
+
+def prefetch_books(items, workers, batch_size=CHAPTER_BATCH_SIZE):
+    """按原顺序产出(item, futures)，同时预取后面workers本书的数据
+
+    items中的元素为(index, book)，book为笔记本列表中的一项。
+    当前这本书写入Notion时，后面的书已经在线程池中获取，输出顺序保持不变。
+    每batch_size本书的章节信息在预取到第一本时用一次请求获取，这一组书会一起从items中取出，
+    最多领先workers + batch_size本书。
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for group in iter_groups(items, batch_size):
+            bookIds = [item[1].get("book").get("bookId") for item in group]
+            chapters = executor.submit(get_chapter_infos, bookIds)
+            for bookId, item in zip(bookIds, group):
+                fingerprint = get_fingerprint(item[1])
+                pending.append((item, submit_book_fetch(executor, bookId, fingerprint, chapters)))
+                if len(pending) > workers:
+                    yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+async def run_async_engine(todo, total, notion_token, options):
+    """用asyncio引擎同步todo中的书籍，返回(成功数, 失败数, 统计信息)
+
+    微信读书使用httpx.AsyncClient，Notion使用AsyncClient，两者的并发数分别限制，
+    连接池按各自的并发数设置。
+    """
+    # 只有async引擎需要，用到时才导入
+    import httpx
+    from async_engine import AsyncEngine
+    from async_session import AsyncWeReadSession
+    from ratelimit import AsyncThrottledClient
+
+    weread_transport = get_async_transport(get_pool_size(options.workers))
+    weread = AsyncWeReadSession(
+        WEREAD_URL,
+        cookies=session.cookies,
+        headers=dict(session.headers),
+        concurrency=options.workers,
+        metrics=metrics,
+        transport=weread_transport,
     )
-    if len(response.get("results")) == 1:
-        return response.get("results")[0].get("properties").get("Sort").get("number")
-    return 0
+    notion = AsyncThrottledClient(
+        auth=notion_token,
+        log_level=logging.ERROR,
+        rate=options.notion_rate,
+        concurrency=options.notion_concurrency,
+        metrics=metrics,
+        client=httpx.AsyncClient(
+            transport=get_async_transport(get_pool_size(options.notion_concurrency), options.http2)
+        ),
+        **get_notion_options(),
+    )
+    engine = AsyncEngine(
+        weread,
+        notion,
+        database_id,
+        data_source_id,
+        cache=cache,
+        page_index=page_index,
+        incremental=options.incremental,
+        workers=options.workers,
+        journal=journal,
+    )
+    # 流式模式章节信息按workers本一组获取，领先的书籍数不超过workers的两倍
+    batch_size = max(1, options.workers) if options.stream else CHAPTER_BATCH_SIZE
+    try:
+        success, fail = await engine.run(todo, total, batch_size)
+    finally:
+        # 异步会话中轮换的Cookie写回session，退出时一起保存
+        for cookie in weread.cookies.jar:
+            session.cookies.set_cookie(cookie)
+        await weread.aclose()
+        await weread_transport.aclose()
+        await notion.aclose()
+    stats = (
+        f"  异步引擎微信读书请求: {weread.api_count} 次，主页预热 {weread.warmup_count} 次，"
+        f"登录超时重放 {weread.replay_count} 次\n  异步引擎{engine.retry_policy.summary()}\n"
+        f"  异步引擎{notion.summary()}"
+    )
+    return success, fail, stats
 
 
-def get_children(chapter, summary, bookmark_list):
-    children = []
-    grandchild = {}
-    if chapter != None:
-        # 添加目录
-        children.append(get_table_of_contents())
-        d = {}
-        for data in bookmark_list:
-            chapterUid = data.get("chapterUid", 1)
-            if chapterUid not in d:
-                d[chapterUid] = []
-            d[chapterUid].append(data)
-        for key, value in d.items():
-            if key in chapter:
-                # 添加章节
-                children.append(
-                    get_heading(
-                        chapter.get(key).get("level"), chapter.get(key).get("title")
-                    )
-                )
-            for i in value:
-                markText = i.get("markText")
-                for j in range(0, len(markText) // 2000 + 1):
-                    children.append(
-                        get_callout(
-                            markText[j * 2000 : (j + 1) * 2000],
-                            i.get("style"),
-                            i.get("colorStyle"),
-                            i.get("reviewId"),
-                        )
-                    )
-                if i.get("abstract") != None and i.get("abstract") != "":
-                    quote = get_quote(i.get("abstract"))
-                    grandchild[len(children) - 1] = quote
+def get_todo(books, latest_sort, index, journal=None):
+    """找出需要同步的书籍，返回([(序号, book)], 跳过的数量)
+
+    index为NotionIndex，journal为WriteJournal，多账号时每个账号使用自己的。
+    """
+    todo = []
+    skip_count = 0
+    for i, book in enumerate(books):
+        if not is_todo(book, latest_sort, index, journal):
+            skip_count += 1
+            continue
+        todo.append((i, book))
+    return todo, skip_count
+
+
+def stream_todo(books, latest_sort, index, journal, stats):
+    """按优先级逐本产出需要同步的(序号, book)，最近更新（sort最大）的书籍在前
+
+    books为parse_notebooklist按sort从小到大排好的列表，从末尾逐本取出并移除，
+    处理过的书籍不再留在内存中。序号为优先级顺序，stats["skip"]记录跳过的数量。
+    """
+    total = len(books)
+    while books:
+        book = books.pop()
+        if not is_todo(book, latest_sort, index, journal):
+            stats["skip"] += 1
+            continue
+        yield total - len(books) - 1, book
+
+
+def is_todo(book, latest_sort, index, journal=None):
+    """判断一本书是否需要同步"""
+    bookId = book.get("book").get("bookId")
+    # 按指纹判断书籍是否有变化，只同步有变化的书籍
+    changed = index.is_changed(bookId, book["sort"], get_fingerprint(book))
+    if journal is not None and journal.get(bookId) is not None:
+        # 上次没有写完的书籍，从写入日志继续
+        changed = True
+    if changed is None:
+        # 无法判断时使用旧的逻辑：Sort值小于等于latest_sort的大概率已存在，直接跳过
+        changed = book["sort"] > latest_sort
+    return changed
 
+
+async def setup_account(account, options, weread_transport, notion_transport):
+    """为多账号配置中的一个账号创建会话、客户端和本地缓存，返回AsyncEngine和待同步的书籍
+
+    每个账号有自己的Cookie、Notion令牌（限速按令牌计算）和缓存子目录，连接池由所有账号共用。
+    """
+    import httpx
+    from async_engine import AsyncEngine
+    from async_session import AsyncWeReadSession
+    from ratelimit import AsyncThrottledClient
+
+    name = account["name"]
+    notion_token = account.get("NOTION_TOKEN")
+    if not notion_token or notion_token.strip() == "":
+        raise Exception(f"账号 {name} 没有配置NOTION_TOKEN")
+    cookie_store = None
+    if options.no_cache:
+        account_cache, account_index, account_journal = None, NotionIndex(), None
     else:
-        # 如果没有章节信息
-        for data in bookmark_list:
-            markText = data.get("markText")
-            for i in range(0, len(markText) // 2000 + 1):
-                children.append(
-                    get_callout(
-                        markText[i * 2000 : (i + 1) * 2000],
-                        data.get("style"),
-                        data.get("colorStyle"),
-                        data.get("reviewId"),
-                    )
-                )
-    if summary != None and len(summary) > 0:
-        children.append(get_heading(1, "点评"))
-        for i in summary:
-            content = i.get("review").get("content")
-            for j in range(0, len(content) // 2000 + 1):
-                children.append(
-                    get_callout(
-                        content[j * 2000 : (j + 1) * 2000],
-                        i.get("style"),
-                        i.get("colorStyle"),
-                        i.get("review").get("reviewId"),
-                    )
-                )
-    return children, grandchild
+        path = os.path.join(options.cache_dir, name)
+        account_cache, account_index, account_journal = BookCache(path), NotionIndex(path), WriteJournal(path)
+        cookie_store = get_cookie_store(path, account.get(COOKIE_KEY_ENV))
+    cookie_source = get_cookie_source(account)
+    cookies = cookie_store.load(cookie_source) if cookie_store is not None else None
+    stored = cookies is not None
+    if not stored:
+        cookies = parse_cookie_string(await asyncio.to_thread(get_cookie, account))
+    weread = AsyncWeReadSession(
+        WEREAD_URL,
+        cookies=cookies,
+        headers=SESSION_HEADERS,
+        concurrency=options.workers,
+        metrics=metrics,
+        transport=weread_transport,
+    )
+    notion = AsyncThrottledClient(
+        auth=notion_token,
+        log_level=logging.ERROR,
+        rate=options.notion_rate,
+        concurrency=options.notion_concurrency,
+        metrics=metrics,
+        client=httpx.AsyncClient(transport=notion_transport),
+        **get_notion_options(),
+    )
+    engine = AsyncEngine(
+        weread,
+        notion,
+        extract_page_id(account),
+        None,
+        cache=account_cache,
+        page_index=account_index,
+        incremental=options.incremental,
+        workers=options.workers,
+        journal=account_journal,
+        name=name,
+    )
+    engine.data_source_id = await engine.get_data_source_id()
+    if len(account_index) == 0:
+        account_index.load_pages(await engine.load_database())
+    books = await engine.get_notebooklist()
+    if books is None and stored:
+        print(f"[{name}] 保存的 Cookie 已失效，重新获取 Cookie...")
+        sys.stdout.flush()
+        weread.client.cookies = parse_cookie_string(await asyncio.to_thread(get_cookie, account))
+        await weread.refresh()
+        books = await engine.get_notebooklist()
+    if books is None:
+        raise Exception(f"账号 {name} 无法获取书籍列表，请检查 Cookie 是否有效")
+    todo, skip_count = get_todo(books, account_index.latest_sort() or 0, account_index, account_journal)
+    print(f"[{name}] 共 {len(books)} 本书籍，需要同步 {len(todo)} 本，跳过 {skip_count} 本")
+    sys.stdout.flush()
+    return {
+        "name": name,
+        "engine": engine,
+        "books": books,
+        "todo": todo,
+        "skip": skip_count,
+        "cookie_store": cookie_store,
+        "cookie_source": cookie_source,
+    }
 
 
-def transform_id(book_id):
-    id_length = len(book_id)
+async def run_accounts(accounts, options):
+    """在一个进程中同步多个账号，返回每个账号的结果
 
-    if re.match(r"^\d*$", book_id):
-        ary = []
-        for i in range(0, id_length, 9):
-            ary.append(format(int(book_id[i : min(i + 9, id_length)]), "x"))
-        return "3", ary
+    所有账号共用微信读书和Notion的连接池，同时处理的书籍总数不超过--total-workers，
+    各账号的书籍轮流排队，一个账号的书籍再多也不会让其他账号一直等待。
+    """
+    weread_transport = get_async_transport(get_pool_size(options.workers * len(accounts)))
+    notion_transport = get_async_transport(
+        get_pool_size(options.notion_concurrency * len(accounts)), options.http2
+    )
+    results = []
+    try:
+        setups = await asyncio.gather(
+            *(setup_account(account, options, weread_transport, notion_transport) for account in accounts),
+            return_exceptions=True,
+        )
+        for account, setup in zip(accounts, setups):
+            if isinstance(setup, Exception):
+                print(f"[{account['name']}] ✗ 初始化失败: {setup}")
+                sys.stdout.flush()
+            else:
+                results.append(setup)
+        semaphore = asyncio.Semaphore(max(1, options.total_workers))
 
-    result = ""
-    for i in range(id_length):
-        result += format(ord(book_id[i]), "x")
-    return "4", [result]
+        async def worker(result, index, book):
+            async with semaphore:
+                await result["engine"].sync_book(index, book, len(result["books"]))
 
+        for result in results:
+            result["engine"].plan_chapters([book.get("book").get("bookId") for _, book in result["todo"]])
+        # asyncio.Semaphore按等待的顺序分配名额，轮流排队就是轮流同步
+        queues = [(i, result["todo"]) for i, result in enumerate(results)]
+        await asyncio.gather(
+            *(worker(results[i], index, book) for i, (index, book) in interleave(queues))
+        )
+    finally:
+        for result in results:
+            if result["cookie_store"] is not None:
+                result["cookie_store"].save(result["engine"].session.cookies.jar, result["cookie_source"])
+        await weread_transport.aclose()
+        await notion_transport.aclose()
+    return results, len(accounts) - len(results)
 
-def calculate_book_str_id(book_id):
-    md5 = hashlib.md5()
-    md5.update(book_id.encode("utf-8"))
-    digest = md5.hexdigest()
-    result = digest[0:3]
-    code, transformed_ids = transform_id(book_id)
-    result += code + "2" + digest[-2:]
 
-    for i in range(len(transformed_ids)):
-        hex_length_str = format(len(transformed_ids[i]), "x")
-        if len(hex_length_str) == 1:
-            hex_length_str = "0" + hex_length_str
+def print_metrics(options):
+    """输出每个接口的请求统计，并按参数写入JSON和Prometheus textfile"""
+    print("\n接口统计:")
+    print(metrics.table())
+    if options.metrics_json:
+        metrics.write_json(options.metrics_json)
+    if options.metrics_prom:
+        metrics.write_prometheus(options.metrics_prom)
+    sys.stdout.flush()
 
-        result += hex_length_str + transformed_ids[i]
 
-        if i < len(transformed_ids) - 1:
-            result += "g"
+def get_data_source_properties():
+    """获取数据源的全部属性，获取失败时返回None"""
+    try:
+        response = client.request(path=f"data_sources/{data_source_id}", method="GET")
+    except Exception as e:
+        print(f"获取数据库属性失败: {e}")
+        return None
+    return response.get("properties", {})
+
 
-    if len(result) < 20:
-        result += digest[0 : 20 - len(result)]
+def load_database():
+    """分页读取整个数据库，只取BookId、Sort、Progress、Status四个属性
 
-    md5 = hashlib.md5()
-    md5.update(result.encode("utf-8"))
-    result += md5.hexdigest()[0:3]
-    return result
+    返回[(bookId, page_id, properties)]，没有BookId的页面会被忽略。
+    """
+    query = get_filter_properties(get_data_source_properties(), INDEX_PROPERTIES)
+    pages = []
+    start_cursor = None
+    while True:
+        response = client.request(
+            path=f"data_sources/{data_source_id}/query",
+            method="POST",
+            query=query,
+            body=get_query_body(start_cursor),
+        )
+        pages.extend(get_index_pages(response.get("results")))
+        if not response.get("has_more"):
+            break
+        start_cursor = response.get("next_cursor")
+    return pages
+
+
+def get_sort():
+    """获取database中的最新时间，有本地索引时直接使用索引"""
+    if page_index is not None:
+        return page_index.latest_sort() or 0
+    filter = {"property": "Sort", "number": {"is_not_empty": True}}
+    sorts = [
+        {
+            "property": "Sort",
+            "direction": "descending",
+        }
+    ]
+    response = client.request(
+        path=f"data_sources/{data_source_id}/query",
+        method="POST",
+        body={"filter": filter, "sorts": sorts, "page_size": 1}
+    )
+    if len(response.get("results")) == 1:
+        return response.get("results")[0].get("properties").get("Sort").get("number")
+    return 0
 
 
 def try_get_cloud_cookie(url, id, password):
@@ -506,7 +901,7 @@ def try_get_cloud_cookie(url, id, password):
     req_url = f"{url}/get/{id}"
     data = {"password": password}
     result = None
-    response = requests.post(req_url, data=data)
+    response = get_http_session().post(req_url, data=data, timeout=COOKIE_CLOUD_TIMEOUT)
     if response.status_code == 200:
         data = response.json()
         cookie_data = data.get("cookie_data")
@@ -519,13 +914,14 @@ def try_get_cloud_cookie(url, id, password):
     return result
 
 
-def get_cookie():
-    url = os.getenv("CC_URL")
+def get_cookie(env=os.environ):
+    """获取微信读书Cookie，env为环境变量或者多账号配置中一个账号的配置"""
+    url = env.get("CC_URL")
     if not url:
         url = "https://cookiecloud.malinkang.com/"
-    id = os.getenv("CC_ID")
-    password = os.getenv("CC_PASSWORD")
-    cookie = os.getenv("WEREAD_COOKIE")
+    id = env.get("CC_ID")
+    password = env.get("CC_PASSWORD")
+    cookie = env.get("WEREAD_COOKIE")
     
     # 尝试从 CookieCloud 获取
     if url and id and password:
@@ -553,10 +949,16 @@ def get_cookie():
     
 
 
-def extract_page_id():
-    url = os.getenv("NOTION_PAGE")
+def get_notion_options():
+    """Notion客户端的额外参数，NOTION_BASE_URL可以指向本地的模拟服务器，用于benchmarks"""
+    base_url = os.getenv("NOTION_BASE_URL")
+    return {"base_url": base_url.rstrip("/")} if base_url else {}
+
+
+def extract_page_id(env=os.environ):
+    url = env.get("NOTION_PAGE")
     if not url:
-        url = os.getenv("NOTION_DATABASE_ID")
+        url = env.get("NOTION_DATABASE_ID")
     if not url:
         raise Exception("没有找到NOTION_PAGE，请按照文档填写")
     # 正则表达式匹配 32 个字符的 Notion page_id
@@ -597,34 +999,209 @@ if __name__ == "__main__":
     sys.stdout.flush()
     
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="并行获取微信读书数据的线程数，同时也是预取的书籍数量",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.getenv("WEREAD_CACHE_DIR", ".weread_cache"),
+        help="微信读书接口数据的本地缓存目录",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="不使用本地缓存，全部重新获取"
+    )
+    parser.add_argument(
+        "--notion-rate",
+        type=float,
+        default=None,
+        help="Notion API 每秒请求数上限，默认3",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="增量同步已存在的书籍，只修改有变化的内容块，不删除重建页面",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["sync", "async"],
+        default="sync",
+        help="同步引擎：sync为多线程预取，async使用asyncio同时处理多本书",
+    )
+    parser.add_argument(
+        "--notion-concurrency",
+        type=int,
+        default=3,
+        help="async引擎同时进行的Notion请求数",
+    )
+    parser.add_argument(
+        "--http2",
+        action="store_true",
+        help="Notion API使用HTTP/2，多个请求复用一个连接，需要安装h2",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        default=os.getenv("WEREAD_METRICS_JSON"),
+        help="运行结束后把每个接口的请求统计写入这个JSON文件",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        default=os.getenv("WEREAD_METRICS_PROM"),
+        help="运行结束后把请求统计写成Prometheus textfile",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="只获取微信读书数据并生成页面内容，写入--export指定的文件，不请求Notion",
+    )
+    parser.add_argument(
+        "--export",
+        default=None,
+        help="把要写入Notion的页面属性和内容块写入这个JSONL文件（默认weread_export.jsonl），同时开启--dry-run",
+    )
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help="把--export导出的JSONL文件写入Notion，不请求微信读书",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="按最近更新的顺序逐本同步，只保留精简的笔记本列表和预取的几本书，同步过的书籍及时释放",
+    )
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="检查微信读书和Notion各个接口是否可用，输出每个接口的状态和耗时，不同步书籍",
+    )
+    parser.add_argument(
+        "--accounts",
+        default=os.getenv("WEREAD_ACCOUNTS"),
+        help="多账号配置文件（JSON），在一个进程中同步其中的全部账号，使用async引擎",
+    )
+    parser.add_argument(
+        "--total-workers",
+        type=int,
+        default=8,
+        help="多账号时所有账号同时处理的书籍总数",
+    )
     options = parser.parse_args()
+    options.workers = max(1, options.workers)
+    if options.export:
+        options.dry_run = True
+    elif options.dry_run:
+        options.export = "weread_export.jsonl"
+    if options.dry_run and options.replay:
+        raise Exception("--dry-run/--export 和 --replay 不能同时使用")
+    if options.preflight and (options.replay or options.accounts):
+        raise Exception("--preflight 不能和 --replay/--accounts 同时使用")
+    if options.accounts:
+        if options.dry_run or options.replay or options.stream:
+            raise Exception("--accounts 不能和 --dry-run/--export/--replay/--stream 同时使用")
+        accounts = load_accounts(options.accounts)
+        print(f"多账号同步，共 {len(accounts)} 个账号")
+        sys.stdout.flush()
+        metrics = Metrics()
+        results, failed = asyncio.run(run_accounts(accounts, options))
+        print(f"\n同步完成！")
+        for result in results:
+            engine = result["engine"]
+            print(
+                f"  [{result['name']}] 成功: {engine.success_count} 本，失败: {engine.fail_count} 本，"
+                f"跳过: {result['skip']} 本"
+            )
+            print(
+                f"    微信读书请求: {engine.session.api_count} 次，主页预热 {engine.session.warmup_count} 次，"
+                f"登录超时重放 {engine.session.replay_count} 次"
+            )
+            print(f"    {engine.retry_policy.summary()}")
+            print(f"    {engine.client.summary()}")
+        if failed:
+            print(f"  初始化失败: {failed} 个账号")
+        print_metrics(options)
+        sys.exit(1 if failed else 0)
+    if not options.no_cache:
+        cache = BookCache(options.cache_dir)
+        page_index = NotionIndex(options.cache_dir)
+        journal = WriteJournal(options.cache_dir)
+    else:
+        page_index = NotionIndex()
     
     print("正在获取配置...")
     sys.stdout.flush()
-    weread_cookie = get_cookie()
-    notion_token = os.getenv("NOTION_TOKEN")
-    if not notion_token or notion_token.strip() == "" or notion_token == "***":
-        raise Exception("没有找到NOTION_TOKEN，请按照文档配置环境变量")
-    
+    metrics = Metrics()
+    client = None
+    exporter = None
+    if not options.dry_run:
+        notion_token = os.getenv("NOTION_TOKEN")
+        if not notion_token or notion_token.strip() == "" or notion_token == "***":
+            raise Exception("没有找到NOTION_TOKEN，请按照文档配置环境变量")
+        # notion_client只在需要写入Notion时导入，--dry-run不需要
+        import httpx
+        from ratelimit import ThrottledClient
+
+        client = ThrottledClient(
+            auth=notion_token,
+            log_level=logging.ERROR,
+            rate=options.notion_rate,
+            metrics=metrics,
+            client=httpx.Client(
+                transport=get_transport(get_pool_size(options.notion_concurrency), options.http2)
+            ),
+            **get_notion_options(),
+        )
+        print("正在获取数据库信息...")
+        sys.stdout.flush()
+        # database_id 用于创建页面，data_source_id 用于查询
+        database_id = extract_page_id()
+        data_source_id = get_data_source_id(database_id)
+        if len(page_index) == 0 and not options.preflight:
+            # 没有本地索引时一次性读取整个数据库，之后的查询都使用内存中的索引
+            print("正在读取 Notion 数据库...")
+            sys.stdout.flush()
+            page_index.load_pages(load_database())
+            print(f"数据库中共有 {len(page_index)} 本书籍")
+            sys.stdout.flush()
+
+    if options.replay:
+        # 只把导出文件写入Notion，不需要微信读书Cookie
+        print(f"\n正在写入导出文件 {options.replay}...")
+        sys.stdout.flush()
+        success_count, fail_count = replay_export(options.replay)
+        print(f"\n写入完成！")
+        print(f"  成功: {success_count} 本")
+        print(f"  失败: {fail_count} 本")
+        print(f"  {client.summary()}")
+        print_metrics(options)
+        sys.exit(1 if fail_count else 0)
+
+    cookie_store = None if options.no_cache else get_cookie_store(options.cache_dir)
+    cookie_source = get_cookie_source()
+    stored_cookies = cookie_store.load(cookie_source) if cookie_store is not None else None
+    if stored_cookies is None:
+        weread_cookie = get_cookie()
     print("正在初始化客户端...")
     sys.stdout.flush()
-    session = requests.Session()
-    session.cookies = parse_cookie_string(weread_cookie)
-    # 设置必要的请求头，模拟浏览器行为
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'application/json, text/plain, */*',
-        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-        'Referer': 'https://weread.qq.com/',
-        'Origin': 'https://weread.qq.com'
-    })
-    client = Client(auth=notion_token, log_level=logging.ERROR)
-    
-    print("正在获取数据库信息...")
-    sys.stdout.flush()
-    # database_id 用于创建页面，data_source_id 用于查询
-    database_id = extract_page_id()
-    data_source_id = get_data_source_id(database_id)
+    session = WeReadSession(WEREAD_URL, metrics=metrics, pool_size=get_pool_size(options.workers))
+    if stored_cookies is not None:
+        print("✓ 使用上次运行保存的 Cookie")
+        sys.stdout.flush()
+        session.cookies = stored_cookies
+    else:
+        session.cookies = parse_cookie_string(weread_cookie)
+    session.headers.update(SESSION_HEADERS)
+    if options.preflight:
+        # 每次都重新请求，接口的状态随时会变，检查的结果不缓存
+        print("\n正在检查各个接口...")
+        sys.stdout.flush()
+        results = run_preflight(session, client, database_id, data_source_id)
+        print_preflight(results)
+        sys.exit(0 if all(result["ok"] for result in results) else 1)
+    if options.dry_run:
+        # 只使用本地索引判断哪些书籍需要同步，导出的书籍不记录到索引中
+        exporter = ExportWriter(options.export)
     
     print("正在验证微信读书 Cookie...")
     sys.stdout.flush()
@@ -647,138 +1224,155 @@ if __name__ == "__main__":
     sys.stdout.flush()
     latest_sort = get_sort()
     books = get_notebooklist()
-    
-    # 测试第一本书的API调用
-    if books and len(books) > 0:
-        test_book_id = books[0].get("book", {}).get("bookId")
-        if test_book_id:
-            print(f"\n测试API调用（使用第一本书 bookId: {test_book_id}）...")
-            sys.stdout.flush()
-            try:
-                print("  - 测试 get_bookinfo...")
-                sys.stdout.flush()
-                test_isbn, test_rating = get_bookinfo(test_book_id)
-                print(f"    ✓ 成功 (ISBN: {test_isbn}, Rating: {test_rating})")
-                sys.stdout.flush()
-            except Exception as e:
-                print(f"    ✗ 失败: {e}")
-                sys.stdout.flush()
-            
-            try:
-                print("  - 测试 get_read_info...")
-                sys.stdout.flush()
-                test_read_info = get_read_info(test_book_id)
-                print(f"    ✓ 成功")
-                sys.stdout.flush()
-            except Exception as e:
-                print(f"    ✗ 失败: {e}")
-                sys.stdout.flush()
-            
-            try:
-                print("  - 测试 get_bookmark_list...")
-                sys.stdout.flush()
-                test_bookmarks = get_bookmark_list(test_book_id)
-                print(f"    ✓ 成功 (获取到 {len(test_bookmarks)} 条划线)")
-                sys.stdout.flush()
-            except Exception as e:
-                print(f"    ✗ 失败: {e}")
-                sys.stdout.flush()
-            print()
+    if books is None and stored_cookies is not None:
+        # 保存的Cookie已经失效，重新从CookieCloud或者环境变量获取
+        print("保存的 Cookie 已失效，重新获取 Cookie...")
+        sys.stdout.flush()
+        session.cookies = parse_cookie_string(get_cookie())
+        session.refresh()
+        books = get_notebooklist()
     
     if books is None:
         print("\n❌ 无法获取书籍列表，请检查 Cookie 是否有效")
-        print("提示: 请确保 Cookie 包含必要的认证信息")
+        print("提示: 请确保 Cookie 包含必要的认证信息，可以使用 --preflight 检查各个接口")
         sys.stdout.flush()
         sys.exit(1)
+    if cookie_store is not None:
+        # Cookie通过了书籍列表的验证，退出时保存会话中最新的Cookie，下次启动时直接使用
+        atexit.register(lambda: cookie_store.save(session.cookies, cookie_source))
     
     success_count = 0
     fail_count = 0
     skip_count = 0
     
     if books != None:
-        print(f"\n开始同步，共 {len(books)} 本书籍，最新排序值: {latest_sort}")
+        total = len(books)
+        print(f"\n开始同步，共 {total} 本书籍，最新排序值: {latest_sort}")
         print("注意: 部分API可能因权限限制无法获取数据（ISBN、评分、阅读状态等），这不影响划线同步\n")
         sys.stdout.flush()
-        for index, book in enumerate(books):
-            sort = book["sort"]
-            book = book.get("book")
-            title = book.get("title")
-            cover = book.get("cover").replace("/s_", "/t7_")
-            bookId = book.get("bookId")
-            author = book.get("author")
-            categories = book.get("categories")
-            if categories != None:
-                categories = [x["title"] for x in categories]
-            
-            # 快速跳过：如果Sort值小于等于latest_sort，大概率已存在，直接跳过
-            # 只有Sort值大于latest_sort的新书才会同步
-            if sort <= latest_sort:
-                skip_count += 1
-                continue
+        if options.stream:
+            # 最近更新的书籍先同步，笔记本列表只保留需要的字段，同步过的书籍逐本释放
+            stream_stats = {"skip": 0}
+            # 逐本替换，不同时保留完整的和精简的两份列表
+            for i, book in enumerate(books):
+                books[i] = compact_notebook(book)
+            todo = stream_todo(books, latest_sort, page_index, journal, stream_stats)
+            books = None
+        else:
+            todo, skip_count = get_todo(books, latest_sort, page_index, journal)
+
+        async_stats = None
+        if options.engine == "async" and exporter is None:
+            success_count, fail_count, async_stats = asyncio.run(
+                run_async_engine(todo, total, notion_token, options)
+            )
+        else:
+            batch_size = CHAPTER_BATCH_SIZE
+            if options.stream:
+                # 经过有界队列进入获取和写入阶段，最多领先workers本书，
+                # 章节信息也按workers本一组获取，预取的书籍数不超过队列的上限
+                todo = pipelined(todo, options.workers)
+                batch_size = max(1, options.workers)
+            for (index, book), futures in prefetch_books(todo, options.workers, batch_size):
+                sort = book["sort"]
+                fingerprint = get_fingerprint(book)
+                book = book.get("book")
+                title = book.get("title")
+                cover = book.get("cover").replace("/s_", "/t7_")
+                bookId = book.get("bookId")
+                author = book.get("author")
+                categories = book.get("categories")
+                if categories != None:
+                    categories = [x["title"] for x in categories]
             
-            print(f"[{index+1}/{len(books)}] 正在同步《{title}》...")
-            sys.stdout.flush()
+                print(f"[{index+1}/{total}] 正在同步《{title}》...")
+                sys.stdout.flush()
             
-            try:
-                # 删除已存在的书籍（如果有）
-                delete_book(bookId)
-                isbn, rating = get_bookinfo(bookId)
-                id = insert_to_notion(
-                    title, bookId, cover, sort, author, isbn, rating, categories
-                )
-                chapter = get_chapter_info(bookId)
-                bookmark_list = get_bookmark_list(bookId)
-                summary, reviews = get_review_list(bookId)
+                try:
+                    fetched = resolve_book_fetch(futures)
+                    chapter = fetched["chapter"]
+                    bookmark_list = fetched["bookmark_list"]
+                    summary = fetched["summary"]
+                    reviews = fetched["reviews"]
+                    page_fields = (
+                        title,
+                        bookId,
+                        cover,
+                        sort,
+                        author,
+                        fetched["isbn"],
+                        fetched["rating"],
+                        categories,
+                        fetched["read_info"],
+                    )
                 
-                # 添加详细调试信息
-                print(f"  - 划线数: {len(bookmark_list)}, 笔记数: {len(reviews)}, 点评数: {len(summary)}")
-                if len(bookmark_list) == 0 and len(reviews) > 0:
-                    print(f"  ⚠️  警告: 有笔记但没有划线，这不正常！bookId={bookId}")
-                sys.stdout.flush()
+                    # 添加详细调试信息
+                    print(f"  - 划线数: {len(bookmark_list)}, 笔记数: {len(reviews)}, 点评数: {len(summary)}")
+                    if len(bookmark_list) == 0 and len(reviews) > 0:
+                        print(f"  ⚠️  警告: 有笔记但没有划线，这不正常！bookId={bookId}")
+                    sys.stdout.flush()
                 
-                bookmark_list.extend(reviews)
+                    bookmark_list = merge_bookmarks(bookmark_list, reviews)
                 
-                # 添加调试信息
-                print(f"  - 总计 {len(bookmark_list)} 条内容")
-                sys.stdout.flush()
+                    # 添加调试信息
+                    print(f"  - 总计 {len(bookmark_list)} 条内容")
+                    sys.stdout.flush()
                 
-                bookmark_list = sorted(
-                    bookmark_list,
-                    key=lambda x: (
-                        x.get("chapterUid", 1),
-                        (
-                            0
-                            if (
-                                x.get("range", "") == ""
-                                or x.get("range").split("-")[0] == ""
-                            )
-                            else int(x.get("range").split("-")[0])
-                        ),
-                    ),
-                )
-                children, grandchild = get_children(chapter, summary, bookmark_list)
-                print(f"  - 生成了 {len(children)} 个内容块")
-                sys.stdout.flush()
+                    if exporter is not None:
+                        # 只导出页面属性和内容块，不请求Notion
+                        properties, icon = get_page_properties(*page_fields)
+                        count = exporter.write_book(
+                            bookId,
+                            title,
+                            sort,
+                            fingerprint,
+                            properties,
+                            icon,
+                            iter_batches(iter_children(chapter, summary, bookmark_list)),
+                        )
+                        print(f"  - 导出了 {count} 个内容块")
+                        sys.stdout.flush()
+                    else:
+                        write_book(
+                            bookId,
+                            sort,
+                            fingerprint,
+                            page_fields,
+                            (chapter, summary, bookmark_list),
+                            options.incremental,
+                        )
                 
-                results = add_children(id, children)
-                if results is None:
-                    print(f"  ⚠️  添加内容块时出现问题")
+                    print(f"  ✓ 成功")
                     sys.stdout.flush()
-                elif len(grandchild) > 0 and results != None:
-                    add_grandchild(grandchild, results)
-                
-                print(f"  ✓ 成功")
-                sys.stdout.flush()
-                success_count += 1
-            except Exception as e:
-                error_msg = str(e)
-                print(f"  ✗ 失败: {error_msg}")
-                sys.stdout.flush()
-                fail_count += 1
-                continue
+                    success_count += 1
+                except Exception as e:
+                    error_msg = str(e)
+                    print(f"  ✗ 失败: {error_msg}")
+                    sys.stdout.flush()
+                    fail_count += 1
+                    continue
+                finally:
+                    # 这本书已经写入，释放它的数据，不等到下一本书覆盖
+                    fetched = chapter = bookmark_list = summary = reviews = futures = None
+        if options.stream:
+            skip_count = stream_stats["skip"]
         
         print(f"\n同步完成！")
         print(f"  成功: {success_count} 本")
         print(f"  失败: {fail_count} 本")
         print(f"  跳过: {skip_count} 本")
-        sys.stdout.flush()
+        if exporter is not None:
+            exporter.close()
+            print(f"  已导出 {exporter.books} 本书籍、{exporter.blocks} 个内容块到 {exporter.path}")
+        print(
+            f"  微信读书请求: {session.api_count} 次，主页预热 {session.warmup_count} 次，"
+            f"省去预热 {session.avoided_warmups} 次，登录超时重放 {session.replay_count} 次"
+        )
+        print(f"  {retry_policy.summary()}")
+        if cache is not None:
+            print(f"  本地缓存: 命中 {cache.hits} 次，未命中 {cache.misses} 次")
+        if client is not None:
+            print(f"  {client.summary()}")
+        if async_stats is not None:
+            print(async_stats)
+        print_metrics(options)
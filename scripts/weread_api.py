@@ -0,0 +1,326 @@
+import os
+import sys
+
+# 微信读书接口的地址、请求头和返回数据的解析，不涉及网络请求，同步和异步引擎共用
+
+# 可以通过环境变量WEREAD_BASE_URL指向本地的模拟服务器，用于benchmarks
+WEREAD_BASE_URL = os.getenv("WEREAD_BASE_URL", "https://weread.qq.com").rstrip("/")
+WEREAD_URL = f"{WEREAD_BASE_URL}/"
+WEREAD_NOTEBOOKS_URL = f"{WEREAD_BASE_URL}/api/user/notebook"
+WEREAD_BOOKMARKLIST_URL = f"{WEREAD_BASE_URL}/web/book/bookmarklist"
+WEREAD_CHAPTER_INFO = f"{WEREAD_BASE_URL}/web/book/chapterInfos"
+WEREAD_READ_INFO_URL = f"{WEREAD_BASE_URL}/web/book/readinfo"
+WEREAD_REVIEW_LIST_URL = f"{WEREAD_BASE_URL}/web/review/list"
+WEREAD_BOOK_INFO = f"{WEREAD_BASE_URL}/web/book/info"
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Referer': 'https://weread.qq.com/',
+}
+BOOKMARKLIST_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Referer': 'https://weread.qq.com/',
+    'Origin': 'https://weread.qq.com',
+    'Connection': 'keep-alive',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-origin'
+}
+# chapterInfos接口每次请求的书籍数，bookIds和synckeys都是数组
+CHAPTER_BATCH_SIZE = 50
+CHAPTER_INFO_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Content-Type': 'application/json',
+    'Referer': 'https://weread.qq.com/',
+}
+
+
+class WeReadError(Exception):
+    """微信读书接口返回的错误，status为HTTP状态码，err_code为返回的errCode"""
+
+    def __init__(self, message, status=None, err_code=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.err_code = err_code
+        self.retry_after = retry_after
+
+
+def check_status(response):
+    """429和5xx抛出WeReadError，交给重试策略处理，其他状态码由调用方处理
+
+    requests和httpx的响应都可以。
+    """
+    status = response.status_code
+    if status != 429 and status < 500:
+        return
+    retry_after = response.headers.get("retry-after")
+    try:
+        retry_after = float(retry_after) if retry_after else None
+    except ValueError:
+        retry_after = None
+    raise WeReadError(f"HTTP {status}", status=status, retry_after=retry_after)
+
+
+def get_read_info_params(bookId):
+    return dict(bookId=bookId, readingDetail=1, readingBookIndex=1, finishedDate=1)
+
+
+def get_bookmark_list_params(bookId, synckey=0):
+    """synckey不为0时只返回上次同步之后的变化"""
+    if synckey:
+        return dict(bookId=bookId, syncKey=synckey)
+    return dict(bookId=bookId)
+
+
+def get_review_list_params(bookId, synckey=0):
+    return dict(bookId=bookId, listType=11, mine=1, syncKey=synckey or 0)
+
+
+def get_chapter_info_body(bookId, synckey=0):
+    return get_chapter_infos_body([(bookId, synckey)])
+
+
+def get_chapter_infos_body(items):
+    """一次请求多本书的章节，items为[(bookId, synckey)]"""
+    return {
+        "bookIds": [bookId for bookId, _ in items],
+        "synckeys": [synckey or 0 for _, synckey in items],
+        "teenmode": 0,
+    }
+
+
+def is_delta_response(synckey, data):
+    """判断返回的是不是增量数据，synckey为请求时带上的值
+
+    只有带上了不为0的synckey时才可能是增量数据：返回中有removed或者synckey有变化，
+    或者synckey没有变化并且没有更新的内容（没有变化时接口通常这样返回）。synckey没有变化
+    却返回了内容说明接口忽略了synckey、返回的是完整列表，不能合并到缓存中，
+    否则已经删除的内容会一直留在缓存里。
+    """
+    if not synckey:
+        return False
+    if "removed" in data or str(data.get("synckey")) != str(synckey):
+        return True
+    return not data.get("updated") and not data.get("reviews")
+
+
+def merge_delta(items, updated, removed, get_id):
+    """把增量数据合并到缓存的完整列表中
+
+    updated中的项替换列表中id相同的项或者追加到最后，removed中的id（或者包含id的dict）从列表中删除。
+    """
+    removed_ids = set()
+    for x in removed or []:
+        if isinstance(x, dict):
+            x = x.get("bookmarkId") or x.get("reviewId") or x.get("chapterUid") or get_id(x)
+        removed_ids.add(x)
+    updated_ids = {get_id(x) for x in updated}
+    merged = [
+        x for x in items if get_id(x) not in removed_ids and get_id(x) not in updated_ids
+    ]
+    return merged + list(updated)
+
+
+def get_bookmark_id(bookmark):
+    return bookmark.get("bookmarkId")
+
+
+def get_review_id(review):
+    return review.get("review", {}).get("reviewId")
+
+
+def get_chapter_uid(chapter):
+    return chapter.get("chapterUid")
+
+
+def sort_bookmarks(bookmarks):
+    return sorted(
+        bookmarks,
+        key=lambda x: (x.get("chapterUid", 1), int(x.get("range", "0-0").split("-")[0])),
+    )
+
+
+def parse_bookmark_list(bookId, data, base=None):
+    """解析划线接口的返回，errCode不为0时抛出异常，数据格式不对时返回None
+
+    base为缓存中的完整列表时，返回的是增量数据，合并后返回完整列表。
+    """
+    if data.get("errCode") != 0 and "errCode" in data:
+        raise WeReadError(data.get('errMsg', '登录超时'), err_code=data.get("errCode"))
+    updated = data.get("updated")
+    if base is not None and isinstance(updated, list):
+        return sort_bookmarks(merge_delta(base, updated, data.get("removed"), get_bookmark_id))
+
+    # 添加调试信息
+    if updated is None:
+        print(f"  [DEBUG] bookmarklist API返回updated=None, bookId={bookId}")
+        print(f"  [DEBUG] 完整响应: {data}")
+        sys.stdout.flush()
+    elif not isinstance(updated, list):
+        print(f"  [DEBUG] bookmarklist API返回updated类型错误: {type(updated)}, bookId={bookId}")
+        sys.stdout.flush()
+    elif len(updated) == 0:
+        print(f"  [DEBUG] bookmarklist API返回空列表, bookId={bookId}")
+        print(f"  [DEBUG] 响应keys: {list(data.keys())}")
+        sys.stdout.flush()
+
+    if updated is None or not isinstance(updated, list):
+        return None
+    return sort_bookmarks(updated)
+
+
+def parse_read_info(data):
+    """解析阅读信息，出错时返回None"""
+    # 如果返回登录超时错误（-2012），返回None
+    if data.get("errCode") == -2012:
+        return None
+    if data.get("errCode") != 0 and "errCode" in data:
+        print(f"  [DEBUG] get_read_info 其他错误: errCode={data.get('errCode')}, errMsg={data.get('errMsg')}")
+        sys.stdout.flush()
+        return None
+    return data
+
+
+def parse_bookinfo(data):
+    """解析书籍详情，返回(isbn, rating)，出错时返回None"""
+    # 如果返回登录超时错误（-2012），返回默认值而不是抛出异常
+    if data.get("errCode") == -2012:
+        print(f"  [提示] 获取书籍详情失败（权限不足），使用默认值")
+        sys.stdout.flush()
+        return None
+    if data.get("errCode") != 0 and "errCode" in data:
+        print(f"  [DEBUG] get_bookinfo 其他错误: errCode={data.get('errCode')}, errMsg={data.get('errMsg')}")
+        sys.stdout.flush()
+        return None
+    isbn = data.get("isbn","")
+    newRating = data.get("newRating", 0) / 1000
+    return (isbn, newRating)
+
+
+def parse_review_list(bookId, data, base=None):
+    """解析笔记接口的返回，返回原始的reviews列表
+
+    登录超时时返回None，其他错误抛出异常。base为缓存中的完整列表时合并增量数据。
+    """
+    # 如果是登录超时，返回空数据而不是抛出异常
+    if data.get("errCode") == -2012:
+        print(f"  [DEBUG] review_list API登录超时, bookId={bookId}")
+        sys.stdout.flush()
+        return None
+    if data.get("errCode") != 0 and "errCode" in data:
+        raise WeReadError(data.get('errMsg', '登录超时'), err_code=data.get("errCode"))
+    reviews = data.get("reviews")
+    if base is not None:
+        return merge_delta(base, reviews or [], data.get("removed"), get_review_id)
+    if not reviews:
+        print(f"  [DEBUG] review_list API返回空reviews, bookId={bookId}")
+        print(f"  [DEBUG] 响应keys: {list(data.keys())}")
+        sys.stdout.flush()
+        return []
+    return reviews
+
+
+def split_reviews(reviews):
+    """把笔记接口返回的reviews拆分为点评和笔记"""
+    summary = list(filter(lambda x: x.get("review").get("type") == 4, reviews))
+    reviews = list(filter(lambda x: x.get("review").get("type") == 1, reviews))
+    reviews = list(map(lambda x: x.get("review"), reviews))
+    reviews = list(map(lambda x: {**x, "markText": x.pop("content")}, reviews))
+    return summary, reviews
+
+
+def parse_chapter_infos(data, bases, synckeys=None):
+    """解析章节接口的返回，按bookId拆分，返回{bookId: (章节列表, synckey, 是否为增量数据)}
+
+    bases为{bookId: 缓存中的完整列表或None}，synckeys为{bookId: 请求时带上的synckey}，
+    有完整列表并且返回的是增量数据时合并。返回中没有或者数据格式不对的书籍不在结果中。
+    登录超时时返回None，其他错误抛出异常。
+    """
+    # 如果是登录超时，返回None
+    if data.get("errCode") == -2012:
+        return None
+    if data.get("errCode") != 0 and "errCode" in data:
+        raise WeReadError(data.get('errMsg', '登录超时'), err_code=data.get("errCode"))
+    items = data.get("data")
+    if not isinstance(items, list):
+        return {}
+    bookIds = {str(bookId): bookId for bookId in bases}
+    result = {}
+    for item in items:
+        if not isinstance(item, dict) or "updated" not in item:
+            continue
+        bookId = bookIds.get(str(item.get("bookId")))
+        if bookId is None and "bookId" not in item and len(bases) == 1 and len(items) == 1:
+            # 只请求一本书时返回中可能没有bookId
+            bookId = next(iter(bases))
+        if bookId is None:
+            continue
+        chapters = item["updated"]
+        base = bases[bookId]
+        delta = base is not None and is_delta_response((synckeys or {}).get(bookId), item)
+        if delta:
+            chapters = merge_delta(base, chapters, item.get("removed"), get_chapter_uid)
+            chapters.sort(key=lambda x: x.get("chapterIdx", 0))
+        result[bookId] = (chapters, item.get("synckey"), delta)
+    return result
+
+
+def get_chapter_dict(chapters):
+    return {item["chapterUid"]: item for item in chapters}
+
+
+def get_fingerprint(book):
+    """笔记本列表中一本书的指纹，有新的划线、笔记或者删除了内容时会变化"""
+    return "-".join(
+        str(book.get(name, "")) for name in ("sort", "noteCount", "reviewCount", "bookmarkCount")
+    )
+
+
+def get_notebook_counts(fingerprint):
+    """从指纹中取出笔记本列表中的(划线数, 笔记数)，没有指纹或者没有这个字段时为None
+
+    笔记本列表中noteCount是划线数，bookmarkCount是书签数（书签不同步），reviewCount是笔记数。
+    """
+    parts = fingerprint.split("-") if fingerprint else []
+    if len(parts) != 4:
+        return None, None
+    counts = []
+    for value in (parts[1], parts[2]):
+        try:
+            counts.append(int(value))
+        except ValueError:
+            counts.append(None)
+    return tuple(counts)
+
+
+# 同步时用到的笔记本列表字段，流式模式只保留这些
+NOTEBOOK_FIELDS = ("sort", "noteCount", "reviewCount", "bookmarkCount")
+NOTEBOOK_BOOK_FIELDS = ("bookId", "title", "cover", "author", "categories")
+
+
+def compact_notebook(book):
+    """只保留笔记本列表中一本书同步需要的字段，指纹不变"""
+    compact = {name: book[name] for name in NOTEBOOK_FIELDS if name in book}
+    info = book.get("book") or {}
+    compact["book"] = {name: info[name] for name in NOTEBOOK_BOOK_FIELDS if name in info}
+    return compact
+
+
+def parse_notebooklist(data):
+    """解析笔记本列表，按sort排序，出错时返回None"""
+    # 检查是否有错误码
+    if "errCode" in data and data.get("errCode") != 0:
+        print(f"获取笔记本列表失败: {data}")
+        sys.stdout.flush()
+        return None
+    books = data.get("books")
+    if books:
+        books.sort(key=lambda x: x["sort"])
+        return books
+    else:
+        print("警告: 返回的书籍列表为空")
+        sys.stdout.flush()
+        return []
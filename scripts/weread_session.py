@@ -0,0 +1,116 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from transport import DEFAULT_POOL_SIZE, get_weread_timeout, mount_pool
+from weread_api import WEREAD_URL
+
+# 登录超时，需要重新访问主页刷新wr_skey
+ERR_CODE_LOGIN_TIMEOUT = -2012
+
+
+class WeReadSession(requests.Session):
+    """只在需要时访问微信读书主页的Session
+
+    以前每个接口调用前都会先请求一次主页来刷新Cookie。这里改为第一次请求前预热一次，
+    之后只有接口返回 -2012（登录超时，需要轮换wr_skey）时才重新访问主页，
+    然后自动重放失败的请求。服务器下发的新Cookie由requests自动写回cookiejar。
+    metrics不为None时记录每个请求的接口、状态码、errCode、耗时和字节数。
+    pool_size为连接池大小，应不少于并行请求的线程数；没有指定timeout的请求使用各接口的超时。
+    """
+
+    def __init__(self, home_url=WEREAD_URL, metrics=None, pool_size=DEFAULT_POOL_SIZE):
+        super().__init__()
+        mount_pool(self, pool_size)
+        self.home_url = home_url
+        self.metrics = metrics
+        self.warmup_count = 0  # 实际访问主页的次数
+        self.api_count = 0  # 接口请求次数（不含主页）
+        self.replay_count = 0  # 因登录超时重放的次数
+        self._generation = 0  # 每次刷新加一，避免多个线程同时刷新
+        self._lock = threading.Lock()
+
+    @property
+    def avoided_warmups(self):
+        """按旧逻辑每个接口请求前都要访问一次主页，这里统计省掉的次数"""
+        return max(0, self.api_count + self.replay_count - self.warmup_count)
+
+    def warm_up(self):
+        """如果还没有访问过主页就访问一次"""
+        with self._lock:
+            if self._generation == 0:
+                self._visit_home()
+
+    def refresh(self, generation=None):
+        """重新访问主页刷新Cookie
+
+        generation为发起请求时的代数，如果期间其他线程已经刷新过就不再重复刷新。
+        """
+        with self._lock:
+            if generation is None or generation == self._generation:
+                self._visit_home()
+
+    def _visit_home(self, *args, **kwargs):
+        response = self._send("GET", self.home_url, *args, **kwargs)
+        self.warmup_count += 1
+        self._generation += 1
+        return response
+
+    def request(self, method, url, *args, **kwargs):
+        if url == self.home_url:
+            with self._lock:
+                return self._visit_home(*args, **kwargs)
+        self.warm_up()
+        generation = self._generation
+        response = self._send(method, url, *args, **kwargs)
+        with self._lock:
+            self.api_count += 1
+        if is_login_timeout(response):
+            self.refresh(generation)
+            response = self._send(method, url, *args, retry=True, **kwargs)
+            with self._lock:
+                self.replay_count += 1
+        return response
+
+    def _send(self, method, url, *args, retry=False, **kwargs):
+        kwargs.setdefault("timeout", get_weread_timeout(url))
+        if self.metrics is None:
+            return super().request(method, url, *args, **kwargs)
+        start = time.monotonic()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            self.metrics.record("weread", urlparse(url).path, time.monotonic() - start, retry=retry)
+            raise
+        record_response(self.metrics, url, response, time.monotonic() - start, retry)
+        return response
+
+
+def record_response(metrics, url, response, latency, retry=False):
+    metrics.record(
+        "weread",
+        urlparse(url).path,
+        latency,
+        status=response.status_code,
+        err_code=get_err_code(response),
+        size=len(response.content),
+        retry=retry,
+    )
+
+
+def get_err_code(response):
+    """返回接口的errCode，没有时返回None，requests和httpx的响应都可以"""
+    if response.status_code >= 400:
+        return None
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    return data.get("errCode") if isinstance(data, dict) else None
+
+
+def is_login_timeout(response):
+    """判断接口是否返回了登录超时"""
+    return get_err_code(response) == ERR_CODE_LOGIN_TIMEOUT
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# scripts目录下的模块互相用from x import ...导入，测试时同样把scripts加入sys.path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from accounts import interleave, load_accounts
+
+
+def write_config(tmp_path, data):
+    path = tmp_path / "accounts.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+
+def test_load_accounts_expands_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("ALICE_TOKEN", "secret")
+    path = write_config(tmp_path, {"accounts": [{"name": "alice", "NOTION_TOKEN": "${ALICE_TOKEN}"}, {}]})
+    accounts = load_accounts(path)
+    assert accounts[0]["NOTION_TOKEN"] == "secret"
+    # 没有名称时按顺序命名
+    assert accounts[1]["name"] == "account2"
+
+
+@pytest.mark.parametrize(
+    "accounts",
+    [[{"name": "a"}, {"name": "a"}], [{"name": "../a"}], []],
+)
+def test_load_accounts_rejects_bad_config(tmp_path, accounts):
+    with pytest.raises(Exception):
+        load_accounts(write_config(tmp_path, {"accounts": accounts}))
+
+
+def test_interleave():
+    queues = [("a", [1, 2, 3]), ("b", [4]), ("c", [5, 6])]
+    assert list(interleave(queues)) == [("a", 1), ("b", 4), ("c", 5), ("a", 2), ("c", 6), ("a", 3)]
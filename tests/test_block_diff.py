@@ -0,0 +1,73 @@
+from block_diff import diff_blocks, get_text_hash, rebuild_block_state
+from book import get_block_entries, get_children
+from utils import get_callout, get_quote
+
+
+def listed(block, block_id, has_children=False):
+    """模拟blocks.children.list返回的块，比生成的块多了id、annotations等字段"""
+    content = dict(block[block["type"]])
+    content.pop("children", None)
+    content["rich_text"] = [
+        dict(x, annotations={"bold": False}, plain_text=x["text"]["content"], href=None)
+        for x in content["rich_text"]
+    ]
+    return {"object": "block", "id": block_id, "type": block["type"], "has_children": has_children, block["type"]: content}
+
+
+def bookmark(i, text=None):
+    return {"bookmarkId": f"b{i}", "chapterUid": 1, "range": f"{i}-{i}", "markText": text or f"划线 {i}", "style": 0, "colorStyle": 1}
+
+
+def test_text_hash_ignores_notion_fields():
+    block = get_callout("划线", 0, 1, None)
+    assert get_text_hash(block) == get_text_hash(listed(block, "id"))
+    assert get_text_hash(block) != get_text_hash(get_callout("划线", 0, 2, None))
+
+
+def test_rebuild_keeps_matching_blocks():
+    old_children, _ = get_children(None, [], [bookmark(0), bookmark(1), bookmark(2)])
+    page = [listed(block, f"id{i}") for i, block in enumerate(old_children)]
+    children, keys = get_children(None, [], [bookmark(0), bookmark(2, "改过"), bookmark(3)])
+    entries = get_block_entries(children, keys)
+    plan = diff_blocks(rebuild_block_state(page, children, entries), entries)
+    assert plan["ids"] == ["id0", None, None]
+    assert sorted(plan["delete"]) == ["id1", "id2"]
+    assert plan["insert"] == [(0, [1, 2])]
+
+
+def test_rebuild_matches_duplicates_in_order():
+    children = [get_callout("重复", 0, 1, None), get_callout("重复", 0, 1, None)]
+    entries = get_block_entries(children, ["bookmark-a", "bookmark-b"])
+    state = rebuild_block_state([listed(children[0], "x"), listed(children[1], "y")], children, entries)
+    assert [entry[:2] for entry in state] == [["bookmark-a", "x"], ["bookmark-b", "y"]]
+    assert diff_blocks(state, entries)["ids"] == ["x", "y"]
+
+
+def test_rebuild_recreates_blocks_with_children():
+    block = get_callout("笔记", 0, 1, "r1")
+    block["callout"]["children"] = [get_quote("引用")]
+    entries = get_block_entries([block], ["review-r1"])
+    plan = diff_blocks(rebuild_block_state([listed(block, "x", has_children=True)], [block], entries), entries)
+    assert plan["delete"] == ["x"]
+    assert plan["insert"] == [(-1, [0])]
+
+
+def test_insert_before_first_kept_block_recreates_it():
+    # 没有章节信息时没有目录，新的划线排在最前面
+    old_children, old_keys = get_children(None, [], [bookmark(1), bookmark(2)])
+    old = [[key, f"id{i}", block_hash, children_hash]
+           for i, (key, block_hash, children_hash) in enumerate(get_block_entries(old_children, old_keys))]
+    children, keys = get_children(None, [], [bookmark(0), bookmark(1), bookmark(2)])
+    plan = diff_blocks(old, get_block_entries(children, keys))
+    # 新块和第一个保留的块一起插到它后面，原来的块最后删除，其他块不动
+    assert plan["anchor"] == "id0"
+    assert plan["insert"] == [(-1, [0, 1])]
+    assert plan["ids"] == [None, None, "id1"]
+    assert plan["delete"] == ["id0"]
+
+
+def test_insert_into_empty_page_has_no_anchor():
+    children, keys = get_children(None, [], [bookmark(0)])
+    plan = diff_blocks([], get_block_entries(children, keys))
+    assert plan["anchor"] is None
+    assert plan["insert"] == [(-1, [0])]
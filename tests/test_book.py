@@ -0,0 +1,72 @@
+from book import (
+    BATCH_BYTES,
+    BLOCK_BYTES,
+    _iter_callouts,
+    encode_json,
+    get_block_size,
+    iter_batches,
+    split_blocks,
+)
+from utils import SEGMENT_LIMIT, TEXT_LIMIT, get_callout, get_quote
+
+
+def callouts(count, text):
+    return [(get_callout(text, 0, 1, None), f"bookmark-{i}") for i in range(count)]
+
+
+def test_block_size_matches_request_body():
+    block = get_callout("中文划线 with ascii", 0, 1, None)
+    _, size = get_block_size(block)
+    assert size == len(encode_json(block))
+    assert b"\\u" not in encode_json(block)
+
+
+def test_cjk_callouts_fit_one_request():
+    # 100个1000字的中文划线约310KB，一次请求就能添加
+    batches = list(iter_batches(callouts(100, "中" * 1000)))
+    assert [len(batch) for batch in batches] == [100]
+
+
+def test_batches_stay_under_body_limit():
+    for text in ("中" * 2000, "a" * 2000, '"\\' * 1000):
+        for batch in iter_batches(callouts(300, text)):
+            body = encode_json({"children": [block for block, _ in batch]})
+            assert len(body) <= BATCH_BYTES
+
+
+def test_split_blocks_keeps_order():
+    blocks = [block for block, _ in callouts(250, "划线")]
+    batches = split_blocks(blocks)
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+    assert [block for batch in batches for block in batch] == blocks
+
+
+def test_short_callout_is_one_block():
+    blocks = _iter_callouts("划线", 0, 1, None, "bookmark-1", "引用")
+    assert [key for key, _ in blocks] == ["bookmark-1"]
+    expected = get_callout("划线", 0, 1, None)
+    expected["callout"]["children"] = [get_quote("引用")]
+    assert blocks[0][1] == expected
+
+
+def test_long_cjk_callout_is_capped_by_bytes():
+    content = "中" * (TEXT_LIMIT * SEGMENT_LIMIT)
+    blocks = _iter_callouts(content, 0, 1, "r1", "review-r1", "引" * 50000)
+    assert len(blocks) > 1
+    assert [key for key, _ in blocks][:2] == ["review-r1", "review-r1#1"]
+    for _, block in blocks:
+        assert get_block_size(block)[1] <= BLOCK_BYTES
+        assert len(block["callout"]["rich_text"]) <= SEGMENT_LIMIT
+    text = "".join(x["text"]["content"] for _, block in blocks for x in block["callout"]["rich_text"])
+    assert text == content
+    assert "children" in blocks[-1][1]["callout"]
+    assert all("children" not in block["callout"] for _, block in blocks[:-1])
+    for batch in iter_batches((block, key) for key, block in blocks):
+        body = encode_json({"children": [block for block, _ in batch]})
+        assert len(body) <= BATCH_BYTES
+
+
+def test_huge_quote_is_truncated():
+    blocks = _iter_callouts("划线", 0, 1, "r1", "review-r1", "引" * (TEXT_LIMIT * SEGMENT_LIMIT * 2))
+    assert len(blocks) == 1
+    assert get_block_size(blocks[0][1])[1] <= BLOCK_BYTES
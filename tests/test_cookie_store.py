@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("cryptography")
+
+from requests.cookies import RequestsCookieJar  # noqa: E402
+
+from cookie_store import SALT_SIZE, CookieStore, get_cookie_source  # noqa: E402
+
+
+def make_jar(skey="abc"):
+    jar = RequestsCookieJar()
+    jar.set("wr_skey", skey, domain=".weread.qq.com", path="/")
+    jar.set("wr_vid", "1", domain=".weread.qq.com", path="/")
+    return jar
+
+
+def test_save_and_load(tmp_path):
+    CookieStore(str(tmp_path), "key").save(make_jar(), "source")
+    jar = CookieStore(str(tmp_path), "key").load("source")
+    assert {c.name: c.value for c in jar} == {"wr_skey": "abc", "wr_vid": "1"}
+
+
+def test_wrong_key_or_source(tmp_path):
+    CookieStore(str(tmp_path), "key").save(make_jar(), "source")
+    assert CookieStore(str(tmp_path), "other").load("source") is None
+    assert CookieStore(str(tmp_path), "key").load("other") is None
+    # 没有配置来源时使用保存的任意Cookie
+    assert CookieStore(str(tmp_path), "key").load(None) is not None
+
+
+def test_random_salt(tmp_path):
+    first, second = tmp_path / "a", tmp_path / "b"
+    CookieStore(str(first), "key").save(make_jar(), "source")
+    CookieStore(str(second), "key").save(make_jar(), "source")
+    salts = [(path / "cookies.enc").read_bytes()[:SALT_SIZE] for path in (first, second)]
+    assert salts[0] != salts[1]
+
+
+def test_save_keeps_salt_and_source(tmp_path):
+    CookieStore(str(tmp_path), "key").save(make_jar(), "source")
+    salt = (tmp_path / "cookies.enc").read_bytes()[:SALT_SIZE]
+    store = CookieStore(str(tmp_path), "key")
+    store.load("source")
+    # 没有传来源时沿用读取到的来源
+    store.save(make_jar("rotated"), None)
+    assert (tmp_path / "cookies.enc").read_bytes()[:SALT_SIZE] == salt
+    jar = CookieStore(str(tmp_path), "key").load("source")
+    assert jar.get("wr_skey") == "rotated"
+
+
+def test_unreadable_file(tmp_path):
+    (tmp_path / "cookies.enc").write_bytes(b"not encrypted")
+    assert CookieStore(str(tmp_path), "key").load(None) is None
+
+
+def test_get_cookie_source():
+    assert get_cookie_source({}) is None
+    cloud = get_cookie_source({"CC_ID": "id", "CC_PASSWORD": "pw"})
+    assert cloud != get_cookie_source({"CC_ID": "other", "CC_PASSWORD": "pw"})
+    assert cloud != get_cookie_source({"WEREAD_COOKIE": "wr_skey=1"})
@@ -0,0 +1,96 @@
+import itertools
+from types import SimpleNamespace
+
+import weread
+from block_diff import get_content_hash
+from book import get_block_entries, get_children, iter_batches
+from cache import BookCache
+from export import ExportWriter, read_export
+from notion_index import NotionIndex
+from test_block_diff import bookmark
+
+
+class FakeNotion:
+    """只实现写入导出文件用到的pages.create、blocks.delete和blocks.children.append，块按页面保存在内存中"""
+
+    def __init__(self):
+        self.pages = {}
+        self.ids = (f"id{i}" for i in itertools.count())
+        self.children = self
+
+    def create(self, parent, icon, cover, properties):
+        page_id = next(self.ids)
+        self.pages[page_id] = []
+        return {"id": page_id}
+
+    def delete(self, block_id):
+        self.pages.pop(block_id, None)
+
+    def append(self, block_id, children, after=None):
+        results = [{"id": next(self.ids)} for _ in children]
+        self.pages[block_id].extend(children)
+        return {"results": results}
+
+
+def make_book(count):
+    return get_children(None, [], [bookmark(i) for i in range(count)])
+
+
+def export_books(path, books, size=3):
+    exporter = ExportWriter(path)
+    for bookId, (children, keys) in books.items():
+        batches = iter_batches(zip(children, keys), size=size)
+        exporter.write_book(bookId, f"书籍 {bookId}", 100, "fp", {"BookId": bookId}, None, batches)
+    exporter.close()
+    return exporter
+
+
+def use_fake_notion(monkeypatch, tmp_path):
+    notion = FakeNotion()
+    page_index = NotionIndex()
+    page_index.load_pages([])
+    cache = BookCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(weread, "client", SimpleNamespace(pages=notion, blocks=notion), raising=False)
+    monkeypatch.setattr(weread, "page_index", page_index, raising=False)
+    monkeypatch.setattr(weread, "cache", cache, raising=False)
+    monkeypatch.setattr(weread, "database_id", "db", raising=False)
+    return notion, page_index, cache
+
+
+def test_export_records(tmp_path):
+    path = str(tmp_path / "out" / "export.jsonl")
+    exporter = export_books(path, {"1": make_book(7)})
+    assert (exporter.books, exporter.blocks) == (1, 7)
+    records = list(read_export(path))
+    assert [record["type"] for record in records] == ["page", "blocks", "blocks", "blocks", "end"]
+    assert records[-1]["count"] == 7
+
+
+def test_export_replay_round_trip(tmp_path, monkeypatch):
+    books = {"1": make_book(7), "2": make_book(2)}
+    path = str(tmp_path / "export.jsonl")
+    export_books(path, books)
+    notion, page_index, cache = use_fake_notion(monkeypatch, tmp_path)
+    assert weread.replay_export(path) == (2, 0)
+    for bookId, (children, keys) in books.items():
+        entry = page_index.get(bookId)
+        # 写入的块和导出前生成的一致，索引和块记录可以直接用于增量同步
+        assert notion.pages[entry["page_id"]] == children
+        entries = get_block_entries(children, keys)
+        assert (entry["sort"], entry["fingerprint"]) == (100, "fp")
+        assert entry["hash"] == get_content_hash(entries)
+        state = cache.get_block_state(bookId, entry["page_id"])
+        assert [block[0] for block in state] == keys
+
+
+def test_replay_incomplete_book_fails(tmp_path, monkeypatch):
+    path = str(tmp_path / "export.jsonl")
+    export_books(path, {"1": make_book(4)})
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:-1])
+    _, page_index, _ = use_fake_notion(monkeypatch, tmp_path)
+    assert weread.replay_export(path) == (0, 1)
+    # 没有记录sort，下次运行会重新同步
+    assert page_index.get("1")["sort"] is None
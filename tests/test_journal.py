@@ -0,0 +1,71 @@
+from book import get_block_entries, iter_batches, iter_children
+from journal import WriteJournal
+from sync_plan import plan_resume
+
+
+def make_content(count):
+    bookmarks = [
+        {"bookmarkId": f"b{i}", "chapterUid": 1, "range": f"{i}-{i}", "markText": f"划线 {i}", "style": 0, "colorStyle": 1}
+        for i in range(count)
+    ]
+    return None, [], bookmarks
+
+
+def get_batches(content, size):
+    return list(iter_batches(iter_children(*content), size=size))
+
+
+def commit(journal, bookId, batches, start):
+    for index, batch in enumerate(batches, start):
+        blocks = [block for block, _ in batch]
+        entries = get_block_entries(blocks, [key for _, key in batch])
+        journal.commit_batch(bookId, index, entries, [f"id-{key}" for _, key in batch])
+
+
+def test_resume_after_compact_and_more_batches(tmp_path):
+    content = make_content(10)
+    batches = get_batches(content, 2)
+    journal = WriteJournal(str(tmp_path))
+    journal.start("1", "page", 1, "fp")
+    commit(journal, "1", batches[:2], 0)
+    # 重新打开时合并已完成的批次
+    journal = WriteJournal(str(tmp_path))
+    assert journal.get("1")["batches"] == 2
+    commit(journal, "1", batches[2:3], journal.get("1")["batches"])
+    journal = WriteJournal(str(tmp_path))
+    state = journal.get("1")
+    assert state["batches"] == 3
+    assert len(state["entries"]) == 6
+    state, children = plan_resume(journal, "1", "fp", content)
+    assert [key for _, key in children] == [key for batch in batches[3:] for _, key in batch]
+
+
+def test_compact_twice_keeps_batch_count(tmp_path):
+    batches = get_batches(make_content(6), 2)
+    journal = WriteJournal(str(tmp_path))
+    journal.start("1", "page", 1, "fp")
+    commit(journal, "1", batches[:1], 0)
+    journal = WriteJournal(str(tmp_path))
+    commit(journal, "1", batches[1:2], 1)
+    journal = WriteJournal(str(tmp_path))
+    commit(journal, "1", batches[2:], 2)
+    journal = WriteJournal(str(tmp_path))
+    assert journal.get("1")["batches"] == 3
+    assert len(journal.get("1")["ids"]) == 6
+
+
+def test_finished_books_are_dropped(tmp_path):
+    journal = WriteJournal(str(tmp_path))
+    journal.start("1", "page", 1, "fp")
+    journal.finish("1")
+    assert WriteJournal(str(tmp_path)).get("1") is None
+
+
+def test_resume_with_changed_fingerprint(tmp_path):
+    content = make_content(4)
+    journal = WriteJournal(str(tmp_path))
+    journal.start("1", "page", 1, "fp")
+    commit(journal, "1", get_batches(content, 2)[:1], 0)
+    state, children = plan_resume(journal, "1", "other", content)
+    assert state["page_id"] == "page"
+    assert children is None
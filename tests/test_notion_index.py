@@ -0,0 +1,47 @@
+import time
+
+from notion_index import INDEX_TTL, NotionIndex, get_index_pages
+
+
+def page(page_id, bookId, sort=None):
+    properties = {"BookId": {"type": "rich_text", "rich_text": [{"plain_text": bookId}]}}
+    if sort is not None:
+        properties["Sort"] = {"type": "number", "number": sort}
+    return {"id": page_id, "properties": properties}
+
+
+def test_put_and_reload(tmp_path):
+    index = NotionIndex(str(tmp_path))
+    index.put("1", "p1", 10, "hash", "fp")
+    entry = NotionIndex(str(tmp_path)).get("1")
+    assert (entry["page_id"], entry["sort"], entry["hash"], entry["fingerprint"]) == ("p1", 10, "hash", "fp")
+
+
+def test_expired_entry(tmp_path):
+    index = NotionIndex(str(tmp_path))
+    index.put("1", "p1")
+    index.books["1"]["synced_at"] = time.time() - INDEX_TTL - 1
+    assert index.get("1") is None
+    assert index.get("1", fresh=False)["page_id"] == "p1"
+
+
+def test_is_changed():
+    index = NotionIndex()
+    # 索引不完整时无法判断
+    assert index.is_changed("1", 10, "fp") is None
+    index.put("1", "p1", 10, None, "fp")
+    assert not index.is_changed("1", 10, "fp")
+    assert index.is_changed("1", 10, "other")
+    # 内容没有完整写入时没有sort，需要重新同步
+    index.put("2", "p2")
+    assert index.is_changed("2", 10, None)
+
+
+def test_load_pages_records_duplicates():
+    index = NotionIndex()
+    index.load_pages(get_index_pages([page("p1", "1", 10), page("p2", "1"), page("p3", "2", 20), {"id": "x"}]))
+    assert index.get("1")["duplicates"] == ["p2"]
+    assert index.get("2")["sort"] == 20
+    assert index.latest_sort() == 20
+    assert index.is_missing("3")
+    assert index.is_changed("3", 1, "fp")
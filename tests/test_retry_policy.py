@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from retry_policy import AUTH, RATE_LIMIT, TRANSIENT, CircuitOpenError, RetryPolicy
+from weread_api import WeReadError
+
+ENDPOINT = "https://weread.qq.com/web/book/bookmarklist"
+
+
+def make_policy():
+    # 不重试，每次调用只发一次请求
+    return RetryPolicy(budgets={AUTH: 0, RATE_LIMIT: 0, TRANSIENT: 0}, threshold=3, cooldown=60)
+
+
+def ok():
+    return "ok"
+
+
+def unavailable():
+    raise WeReadError("HTTP 503", status=503)
+
+
+def login_timeout():
+    raise WeReadError("登录超时", err_code=-2012)
+
+
+def trip(policy):
+    for _ in range(3):
+        with pytest.raises(WeReadError):
+            policy.call(ENDPOINT, unavailable)
+    return policy.breaker(ENDPOINT)
+
+
+def cool_down(breaker):
+    breaker.opened_until = 0
+
+
+def test_closed_breaker_passes_calls_and_resets_on_success():
+    policy = make_policy()
+    for _ in range(2):
+        with pytest.raises(WeReadError):
+            policy.call(ENDPOINT, unavailable)
+    assert policy.call(ENDPOINT, ok) == "ok"
+    assert policy.breaker(ENDPOINT).failures == 0
+
+
+def test_open_breaker_rejects_calls():
+    policy = make_policy()
+    breaker = trip(policy)
+    assert breaker.trips == 1
+    with pytest.raises(CircuitOpenError):
+        policy.call(ENDPOINT, ok)
+
+
+def test_half_open_probe_success_closes():
+    policy = make_policy()
+    breaker = trip(policy)
+    cool_down(breaker)
+    assert policy.call(ENDPOINT, ok) == "ok"
+    assert breaker.failures == 0
+    assert policy.call(ENDPOINT, ok) == "ok"
+
+
+def test_half_open_probe_failure_reopens():
+    policy = make_policy()
+    breaker = trip(policy)
+    cool_down(breaker)
+    with pytest.raises(WeReadError):
+        policy.call(ENDPOINT, unavailable)
+    assert breaker.trips == 2
+    with pytest.raises(CircuitOpenError):
+        policy.call(ENDPOINT, ok)
+
+
+def test_half_open_allows_single_probe():
+    breaker = trip(make_policy())
+    cool_down(breaker)
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.end_call(True)
+    assert breaker.before_call() is True
+
+
+def test_auth_error_on_probe_releases_breaker():
+    policy = make_policy()
+    breaker = trip(policy)
+    cool_down(breaker)
+    with pytest.raises(WeReadError):
+        policy.call(ENDPOINT, login_timeout)
+    # 登录超时不算接口故障，也不算恢复，下一个请求可以重新试探
+    assert policy.call(ENDPOINT, ok) == "ok"
+    assert breaker.failures == 0
+
+
+def test_auth_error_on_async_probe_releases_breaker():
+    policy = make_policy()
+    breaker = trip(policy)
+    cool_down(breaker)
+
+    async def expired():
+        login_timeout()
+
+    async def fine():
+        return "ok"
+
+    async def main():
+        with pytest.raises(WeReadError):
+            await policy.call_async(ENDPOINT, expired)
+        return await policy.call_async(ENDPOINT, fine)
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_auth_retry_refreshes_then_probes_again():
+    policy = RetryPolicy(base_delays={AUTH: 0}, threshold=3, cooldown=60)
+    breaker = policy.breaker(ENDPOINT)
+    breaker.failures = 3
+    refreshed = []
+    calls = iter([login_timeout, ok])
+    assert policy.call(ENDPOINT, lambda: next(calls)(), on_auth=lambda: refreshed.append(1)) == "ok"
+    assert refreshed == [1]
+    assert breaker.failures == 0
+
+
+def test_permanent_error_counts_as_response():
+    policy = make_policy()
+    breaker = policy.breaker(ENDPOINT)
+    breaker.failures = 2
+
+    def not_found():
+        raise WeReadError("书籍不存在", err_code=-2010)
+
+    with pytest.raises(WeReadError):
+        policy.call(ENDPOINT, not_found)
+    assert breaker.failures == 0
@@ -0,0 +1,148 @@
+from cache import BookCache
+from sync_plan import BookmarkFetch, ChapterFetch, ReviewFetch
+from test_weread_api import bookmark, chapter, review
+
+
+def fingerprint(bookmarks, reviews):
+    # bookmarkCount是书签数，和划线数无关
+    return f"1600000000-{bookmarks}-{reviews}-0"
+
+
+def seed(cache, name, data, synckey):
+    cache.set("1", name, data, version="old", synckey=synckey)
+
+
+def test_bookmark_fetch_uses_cache_when_fingerprint_matches(tmp_path):
+    cache = BookCache(str(tmp_path))
+    cache.set("1", "bookmark_list", [bookmark(0)], version=fingerprint(1, 0), synckey=1)
+    fetch = BookmarkFetch(cache, "1", fingerprint(1, 0))
+    assert fetch.done
+    assert [x["bookmarkId"] for x in fetch.result()] == ["b0"]
+
+
+def test_bookmark_fetch_full_response_drops_deleted(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "bookmark_list", [bookmark(0), bookmark(1), bookmark(2)], 5)
+    fetch = BookmarkFetch(cache, "1", fingerprint(2, 0))
+    assert fetch.synckey == 5
+    # 接口忽略synckey，返回删除了b2以后的完整列表
+    fetch.feed({"synckey": 5, "updated": [bookmark(0), bookmark(1)]})
+    assert fetch.done
+    assert [x["bookmarkId"] for x in fetch.result()] == ["b0", "b1"]
+    assert cache.get("1", "bookmark_list", version=fingerprint(2, 0)) == fetch.result()
+
+
+def test_bookmark_fetch_delta_response_merges(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "bookmark_list", [bookmark(0), bookmark(1)], 5)
+    fetch = BookmarkFetch(cache, "1", fingerprint(2, 0))
+    fetch.feed({"synckey": 6, "updated": [bookmark(2)], "removed": ["b0"]})
+    assert fetch.done
+    assert [x["bookmarkId"] for x in fetch.result()] == ["b1", "b2"]
+    assert cache.get_entry("1", "bookmark_list")["synckey"] == 6
+
+
+def test_bookmark_fetch_count_mismatch_refetches_full(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "bookmark_list", [bookmark(0), bookmark(1), bookmark(2)], 5)
+    fetch = BookmarkFetch(cache, "1", fingerprint(2, 0))
+    # 增量数据漏掉了删除，合并后有3条，笔记本列表中只有2条
+    fetch.feed({"synckey": 6, "updated": [], "removed": []})
+    assert not fetch.done
+    assert fetch.synckey == 0
+    fetch.feed({"synckey": 7, "updated": [bookmark(0), bookmark(1)], "removed": []})
+    assert fetch.done
+    assert [x["bookmarkId"] for x in fetch.result()] == ["b0", "b1"]
+
+
+def test_bookmark_fetch_unchanged_keeps_base(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "bookmark_list", [bookmark(0), bookmark(1)], 5)
+    fetch = BookmarkFetch(cache, "1", fingerprint(2, 0))
+    # synckey没有变化并且没有内容，表示没有变化
+    fetch.feed({"synckey": 5, "updated": []})
+    assert fetch.done
+    assert [x["bookmarkId"] for x in fetch.result()] == ["b0", "b1"]
+    assert cache.get("1", "bookmark_list", version=fingerprint(2, 0)) == fetch.result()
+
+
+def test_bookmark_fetch_unchanged_but_all_deleted_refetches(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "bookmark_list", [bookmark(0)], 5)
+    fetch = BookmarkFetch(cache, "1", fingerprint(0, 0))
+    fetch.feed({"synckey": 5, "updated": []})
+    assert not fetch.done
+    fetch.feed({"synckey": 6, "updated": []})
+    assert fetch.done
+    assert fetch.result() == []
+
+
+def test_bookmark_fetch_full_response_count_checked(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "bookmark_list", [bookmark(0), bookmark(1), bookmark(2)], 5)
+    fetch = BookmarkFetch(cache, "1", fingerprint(1, 0))
+    # 带了synckey时返回的完整列表也要检查数量
+    fetch.feed({"synckey": 5, "updated": [bookmark(0), bookmark(1)]})
+    assert (fetch.done, fetch.synckey) == (False, 0)
+
+
+def test_review_fetch_unchanged_keeps_base(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "review_list", [review(0), review(1, type=4)], 5)
+    fetch = ReviewFetch(cache, "1", fingerprint(0, 1))
+    fetch.feed({"synckey": 5, "reviews": []})
+    assert fetch.done
+    summary, notes = fetch.result()
+    assert [x["reviewId"] for x in notes] == ["r0"]
+
+
+def test_review_fetch_counts_notes_only(tmp_path):
+    cache = BookCache(str(tmp_path))
+    seed(cache, "review_list", [review(0), review(1, type=4)], 5)
+    fetch = ReviewFetch(cache, "1", fingerprint(0, 2))
+    fetch.feed({"synckey": 6, "reviews": [review(2)], "removed": []})
+    assert fetch.done
+    summary, notes = fetch.result()
+    assert [x["review"]["reviewId"] for x in summary] == ["r1"]
+    assert [x["reviewId"] for x in notes] == ["r0", "r2"]
+
+
+def test_fetch_without_cache_is_full():
+    fetch = BookmarkFetch(None, "1", fingerprint(5, 0))
+    assert (fetch.done, fetch.synckey) == (False, 0)
+    fetch.feed({"synckey": 1, "updated": [bookmark(0)]})
+    assert fetch.done
+    assert len(fetch.result()) == 1
+
+
+def test_chapter_fetch_merges_only_deltas(tmp_path):
+    cache = BookCache(str(tmp_path))
+    cache.set("1", "chapter", [chapter(1), chapter(2)], synckey=3)
+    cache.set("2", "chapter", [chapter(1), chapter(2)], synckey=3)
+    # 章节缓存已经过期
+    for bookId in ("1", "2"):
+        entries = cache._load(bookId)
+        entries["chapter"]["fetched_at"] = 0
+        cache._dump(bookId, entries)
+    fetch = ChapterFetch(cache, ["1", "2"])
+    assert fetch.body()["synckeys"] == [3, 3]
+    result = fetch.feed({
+        "data": [
+            {"bookId": "1", "synckey": 4, "updated": [chapter(3)], "removed": [1]},
+            {"bookId": "2", "synckey": 3, "updated": [chapter(2)]},
+        ]
+    })
+    assert sorted(result["1"]) == [2, 3]
+    assert sorted(result["2"]) == [2]
+
+
+def test_chapter_fetch_unchanged_keeps_base(tmp_path):
+    cache = BookCache(str(tmp_path))
+    cache.set("b", "chapter", [chapter(1), chapter(2)], synckey=7)
+    entries = cache._load("b")
+    entries["chapter"]["fetched_at"] = 0
+    cache._dump("b", entries)
+    fetch = ChapterFetch(cache, ["b"])
+    result = fetch.feed({"data": [{"bookId": "b", "synckey": 7, "updated": []}]})
+    assert sorted(result["b"]) == [1, 2]
+    assert [x["chapterUid"] for x in cache.get("b", "chapter")] == [1, 2]
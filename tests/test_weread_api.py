@@ -0,0 +1,117 @@
+import pytest
+
+from weread_api import (
+    WeReadError,
+    get_bookmark_id,
+    get_notebook_counts,
+    is_delta_response,
+    merge_delta,
+    parse_bookmark_list,
+    parse_chapter_infos,
+    parse_review_list,
+)
+
+
+def bookmark(i, chapter=1, text=None):
+    return {
+        "bookmarkId": f"b{i}",
+        "chapterUid": chapter,
+        "range": f"{i * 10}-{i * 10 + 5}",
+        "markText": text or f"划线 {i}",
+    }
+
+
+def review(i, type=1):
+    return {"review": {"reviewId": f"r{i}", "type": type, "content": f"笔记 {i}"}}
+
+
+def chapter(uid):
+    return {"chapterUid": uid, "chapterIdx": uid, "title": f"第{uid}章"}
+
+
+def test_merge_delta_replaces_appends_and_removes():
+    items = [bookmark(0), bookmark(1), bookmark(2)]
+    merged = merge_delta(items, [bookmark(1, text="改"), bookmark(3)], ["b2"], get_bookmark_id)
+    assert [x["bookmarkId"] for x in merged] == ["b0", "b1", "b3"]
+    assert merged[1]["markText"] == "改"
+
+
+def test_merge_delta_accepts_removed_dicts():
+    merged = merge_delta([bookmark(0), bookmark(1)], [], [{"bookmarkId": "b0"}], get_bookmark_id)
+    assert [x["bookmarkId"] for x in merged] == ["b1"]
+
+
+def test_is_delta_response():
+    # 没有带synckey时一定是完整列表
+    assert not is_delta_response(0, {"synckey": 5, "updated": [], "removed": []})
+    # 带了synckey，返回和原来一样的synckey并且没有内容，表示没有变化
+    assert is_delta_response(5, {"synckey": 5, "updated": []})
+    assert is_delta_response(5, {"synckey": 5, "reviews": []})
+    # synckey没有变化却返回了内容，接口返回的是完整列表
+    assert not is_delta_response(5, {"synckey": 5, "updated": [bookmark(0)]})
+    assert is_delta_response(5, {"synckey": 5, "updated": [], "removed": []})
+    assert is_delta_response(5, {"synckey": 6, "updated": []})
+
+
+def test_parse_bookmark_list_full_ignores_base():
+    data = {"synckey": 2, "updated": [bookmark(1), bookmark(0)]}
+    result = parse_bookmark_list("1", data)
+    assert [x["bookmarkId"] for x in result] == ["b0", "b1"]
+
+
+def test_parse_bookmark_list_delta_merges_into_base():
+    base = [bookmark(0), bookmark(1), bookmark(2)]
+    data = {"synckey": 3, "updated": [bookmark(3, chapter=0)], "removed": ["b1"]}
+    result = parse_bookmark_list("1", data, base)
+    assert [x["bookmarkId"] for x in result] == ["b3", "b0", "b2"]
+
+
+def test_parse_bookmark_list_error():
+    with pytest.raises(WeReadError) as info:
+        parse_bookmark_list("1", {"errCode": -2012, "errMsg": "登录超时"})
+    assert info.value.err_code == -2012
+
+
+def test_parse_review_list_full_and_delta():
+    full = parse_review_list("1", {"synckey": 1, "reviews": [review(0), review(1), review(2, type=4)]})
+    assert [x["review"]["reviewId"] for x in full] == ["r0", "r1", "r2"]
+    delta = parse_review_list("1", {"synckey": 2, "reviews": [review(3)], "removed": ["r0"]}, full)
+    assert [x["review"]["reviewId"] for x in delta] == ["r1", "r2", "r3"]
+    assert parse_review_list("1", {"errCode": -2012}) is None
+
+
+def test_parse_chapter_infos_full_and_delta():
+    base = [chapter(1), chapter(2), chapter(3)]
+    data = {
+        "data": [
+            {"bookId": "1", "synckey": 7, "updated": [chapter(4)], "removed": [2]},
+            {"bookId": "2", "synckey": 7, "updated": [chapter(1)]},
+            {"bookId": "3", "synckey": 7, "updated": []},
+        ]
+    }
+    result = parse_chapter_infos(data, {"1": base, "2": base, "3": base}, {"1": 6, "2": 7, "3": 7})
+    chapters, synckey, delta = result["1"]
+    assert [x["chapterUid"] for x in chapters] == [1, 3, 4]
+    assert (synckey, delta) == (7, True)
+    # synckey没有变化并且没有removed，返回的是完整列表，不合并到缓存
+    chapters, synckey, delta = result["2"]
+    assert [x["chapterUid"] for x in chapters] == [1]
+    assert delta is False
+    # synckey没有变化并且没有内容，章节没有变化
+    chapters, synckey, delta = result["3"]
+    assert [x["chapterUid"] for x in chapters] == [1, 2, 3]
+    assert delta is True
+
+
+def test_parse_chapter_infos_without_synckey_is_full():
+    data = {"data": [{"bookId": "1", "synckey": 7, "updated": [chapter(1)], "removed": []}]}
+    chapters, _, delta = parse_chapter_infos(data, {"1": [chapter(2)]})["1"]
+    assert [x["chapterUid"] for x in chapters] == [1]
+    assert delta is False
+
+
+def test_get_notebook_counts():
+    # 划线数是noteCount，不是bookmarkCount（书签数）
+    assert get_notebook_counts("1600000000-5-2-0") == (5, 2)
+    assert get_notebook_counts("1600000000-5--3") == (5, None)
+    assert get_notebook_counts(None) == (None, None)